@@ -0,0 +1,292 @@
+"""Control de admisión de trabajos según el trabajo pendiente.
+
+En vez de contar peticiones se cuentan segundos de trabajo: cada trabajo se
+estima al encolarlo a partir de la duración del archivo (ffprobe), el modelo
+de Whisper y el tipo de salida. Hay dos pools independientes, "audio"
+(Whisper) y "render" (quemado de subtítulos con FFmpeg), cada uno con su
+capacidad máxima de segundos pendientes (en cola o en curso). Un cliente no
+puede ocupar más de `client_share` de un pool, así un uploader masivo no
+deja sin hueco a los usuarios interactivos. Si no hay capacidad se responde
+429 con Retry-After estimado según el ritmo al que se está vaciando el pool.
+
+Las reservas se guardan en un almacén: en memoria con una sola instancia de
+la API o en el broker cuando hay varias, así todas cuentan la misma
+capacidad.
+"""
+import logging
+import math
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from jobs import FINISHED_STATES, JOB_COMPLETED
+from metrics import ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+POOL_AUDIO = "audio"
+POOL_RENDER = "render"
+POOLS = (POOL_AUDIO, POOL_RENDER)
+
+# Coste relativo de cada modelo por segundo de audio, tomando "small" como 1
+MODEL_COST = {"tiny": 0.15, "base": 0.3, "small": 1.0, "medium": 2.5, "large": 5.0}
+# Las marcas de tiempo por palabra añaden el alineamiento de cada palabra
+WORD_TIMESTAMPS_COST = 1.2
+# Coste relativo del quemado por segundo de video según el preset de x264,
+# tomando "medium" como 1; el modo soft solo copia los streams
+PRESET_COST = {
+    "ultrafast": 0.3, "superfast": 0.4, "veryfast": 0.5, "faster": 0.7,
+    "fast": 0.8, "medium": 1.0, "slow": 1.6, "slower": 2.5, "veryslow": 4.0,
+}
+SOFT_SUBTITLE_COST = 0.02
+
+# Límites del Retry-After (segundos)
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 3600
+# Peso de cada trabajo terminado en la media del ritmo de proceso
+SPEED_SMOOTHING = 0.2
+# Una reserva que no se asocia a ningún trabajo en este tiempo es de una
+# petición que no llegó a encolarlo (p. ej. la API se reinició entre medias)
+UNATTACHED_TIMEOUT = 60
+
+
+def transcription_cost(duration: float, model: str, word_timestamps: bool = False) -> float:
+    """Segundos de trabajo de Whisper para `duration` segundos de audio"""
+    factor = MODEL_COST.get(model)
+    if factor is None:
+        # Variantes como "large-v3" o "medium.en"
+        factor = next((cost for name, cost in MODEL_COST.items() if model.startswith(name)), 1.0)
+    if word_timestamps:
+        factor *= WORD_TIMESTAMPS_COST
+    return duration * factor
+
+
+def render_cost(duration: float, mode: str = "burn", preset: str = "medium") -> float:
+    """Segundos de trabajo de FFmpeg para subtitular `duration` segundos de video"""
+    if mode == "soft":
+        return duration * SOFT_SUBTITLE_COST
+    return duration * PRESET_COST.get(preset, 1.0)
+
+
+@dataclass
+class JobCost:
+    """Coste estimado de un trabajo en segundos de trabajo de cada pool"""
+    audio: float = 0.0
+    render: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return self.audio + self.render
+
+    def pools(self) -> Dict[str, float]:
+        return {POOL_AUDIO: self.audio, POOL_RENDER: self.render}
+
+
+@dataclass
+class Ticket:
+    """Trabajo admitido: ocupa su coste hasta que termina"""
+    client_id: str
+    cost: JobCost
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    job_id: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Ticket":
+        return cls(**{**data, "cost": JobCost(**data["cost"])})
+
+
+class _Rejected(Exception):
+    """Sin capacidad: (pool, motivo, exceso). Se lanza dentro de la sección
+    crítica del almacén y el 429 se prepara fuera de ella"""
+
+
+class LocalReservations:
+    """Reservas en memoria de esta instancia de la API.
+
+    Misma interfaz que el broker: `add_reservation` llama a `check` con las
+    reservas actuales y, si no lanza, guarda la nueva en la misma sección
+    crítica, así dos peticiones simultáneas no se cuelan a la vez.
+    """
+
+    def __init__(self):
+        self._reservations: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def add_reservation(self, reservation: dict, check: Callable[[List[dict]], None]):
+        with self._lock:
+            check(list(self._reservations.values()))
+            self._reservations[reservation["id"]] = reservation
+
+    def attach_reservation(self, reservation_id: str, job_id: str):
+        with self._lock:
+            if reservation_id in self._reservations:
+                self._reservations[reservation_id] = {**self._reservations[reservation_id], "job_id": job_id}
+
+    def remove_reservation(self, reservation_id: str) -> bool:
+        with self._lock:
+            return self._reservations.pop(reservation_id, None) is not None
+
+    def reservations(self) -> List[dict]:
+        with self._lock:
+            return list(self._reservations.values())
+
+
+class AdmissionController:
+    """Cuenta los segundos de trabajo pendientes por pool y por cliente.
+
+    `capacity` es el máximo de segundos pendientes de cada pool (0 = sin
+    límite). `lookup(job_id)` devuelve el estado del trabajo (`to_dict()`) o
+    None si ya no existe; con él se liberan los trabajos terminados y se
+    mide el ritmo real de proceso. `parallelism()` es el número de trabajos
+    que se ejecutan a la vez, para estimar cuánto tarda en vaciarse un pool.
+    Con `refresh_seconds` los trabajos terminados se buscan como mucho con
+    esa frecuencia, para no consultar un broker en cada petición.
+    `store` guarda las reservas (por defecto en memoria); con varias
+    instancias de la API debe ser el broker que comparten.
+    """
+
+    def __init__(self, capacity: Dict[str, float], client_share: float,
+                 lookup: Callable[[str], Optional[dict]], parallelism: Callable[[], int],
+                 refresh_seconds: float = 0.0, store=None):
+        self.capacity = capacity
+        self.client_share = client_share
+        self.lookup = lookup
+        self.parallelism = parallelism
+        self.refresh_seconds = refresh_seconds
+        self._refreshed_at = 0.0
+        self.rejected = 0
+        self.store = store if store is not None else LocalReservations()
+        # Segundos de trabajo que procesa un trabajo por segundo real (1 = tiempo real)
+        self._speed: Dict[str, float] = {pool: 1.0 for pool in POOLS}
+        self._lock = threading.Lock()
+
+    def check(self, client_id: str, pools=POOLS):
+        """Rechaza de antemano (antes de guardar la subida) si el pool ya está
+        lleno o el cliente ya ocupa toda su parte (no cabe ni un trabajo mínimo)"""
+        self._admit(client_id, JobCost(audio=1.0, render=1.0), pools, reserve=False)
+
+    def admit(self, client_id: str, cost: JobCost) -> Ticket:
+        """Reserva el coste del trabajo o lanza HTTPException 429 con Retry-After"""
+        pools = [pool for pool, amount in cost.pools().items() if amount]
+        return self._admit(client_id, cost, pools, reserve=True)
+
+    def attach(self, ticket: Ticket, job_id: str):
+        """Asocia la reserva al trabajo encolado; se libera cuando este termina"""
+        ticket.job_id = job_id
+        self.store.attach_reservation(ticket.id, job_id)
+
+    def release(self, ticket: Ticket):
+        self.store.remove_reservation(ticket.id)
+
+    def stats(self):
+        self._release_finished()
+        tickets = self._tickets()
+        outstanding = self._outstanding(tickets)
+        return {
+            "jobs": len(tickets),
+            "clients": len({ticket.client_id for ticket in tickets}),
+            "rejected": self.rejected,
+            "pools": {
+                pool: {
+                    "capacity_seconds": self.capacity.get(pool, 0),
+                    "outstanding_seconds": round(outstanding[pool], 1),
+                    "speed": round(self._speed[pool], 3),
+                }
+                for pool in POOLS
+            },
+        }
+
+    def _tickets(self) -> List[Ticket]:
+        return [Ticket.from_dict(reservation) for reservation in self.store.reservations()]
+
+    def _admit(self, client_id: str, cost: JobCost, pools, reserve: bool) -> Optional[Ticket]:
+        self._release_finished()
+        amounts = cost.pools()
+
+        def check(reservations: List[dict]):
+            tickets = [Ticket.from_dict(reservation) for reservation in reservations]
+            outstanding = self._outstanding(tickets)
+            mine = self._outstanding(tickets, client_id)
+            for pool in pools:
+                capacity = self.capacity.get(pool, 0)
+                if not capacity:
+                    continue
+                # Un pool vacío admite cualquier trabajo (si no, uno más largo que
+                # la capacidad no entraría nunca); igual con un cliente sin trabajos
+                if outstanding[pool] and outstanding[pool] + amounts[pool] > capacity:
+                    raise _Rejected(pool, "capacity", outstanding[pool] + amounts[pool] - capacity)
+                client_capacity = capacity * self.client_share
+                if mine[pool] and mine[pool] + amounts[pool] > client_capacity:
+                    raise _Rejected(pool, "client_share", mine[pool] + amounts[pool] - client_capacity)
+
+        try:
+            if not reserve:
+                check(self.store.reservations())
+                return None
+            ticket = Ticket(client_id, cost)
+            self.store.add_reservation(ticket.to_dict(), check)
+            return ticket
+        except _Rejected as rejected:
+            self._reject(*rejected.args)
+
+    def _reject(self, pool: str, reason: str, excess: float):
+        # Tiempo hasta que se libere el exceso al ritmo de proceso medido
+        rate = self._speed[pool] * max(self.parallelism(), 1)
+        retry_after = min(max(math.ceil(excess / rate), MIN_RETRY_AFTER), MAX_RETRY_AFTER)
+        with self._lock:
+            self.rejected += 1
+        ADMISSION_REJECTED.inc(pool=pool, reason=reason)
+        logger.info("Trabajo rechazado: pool %s lleno (%s), reintento en %ss", pool, reason, retry_after)
+        if reason == "client_share":
+            detail = (f"Tienes demasiado trabajo pendiente en el servidor. "
+                      f"Reintenta en {retry_after} segundos")
+        else:
+            detail = (f"El servidor está ocupado con demasiado trabajo pendiente. "
+                      f"Reintenta en {retry_after} segundos")
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    def _outstanding(self, tickets: List[Ticket], client_id: str = None) -> Dict[str, float]:
+        totals = {pool: 0.0 for pool in POOLS}
+        for ticket in tickets:
+            if client_id is None or ticket.client_id == client_id:
+                for pool, amount in ticket.cost.pools().items():
+                    totals[pool] += amount
+        return totals
+
+    def _release_finished(self):
+        """Libera las reservas de los trabajos terminados y actualiza el ritmo
+        de proceso con lo que tardaron"""
+        with self._lock:
+            now = time.monotonic()
+            if self.refresh_seconds and now - self._refreshed_at < self.refresh_seconds:
+                return
+            self._refreshed_at = now
+        for ticket in self._tickets():
+            if not ticket.job_id:
+                if time.time() - ticket.created_at > UNATTACHED_TIMEOUT:
+                    self.store.remove_reservation(ticket.id)
+                continue
+            job = self.lookup(ticket.job_id)
+            if job is not None and job["status"] not in FINISHED_STATES:
+                continue
+            # Con varias instancias solo la que la borra mide el ritmo
+            if not self.store.remove_reservation(ticket.id):
+                continue
+            if job is None or job["status"] != JOB_COMPLETED or not job["started_at"]:
+                continue
+            elapsed = job["finished_at"] - job["started_at"]
+            if elapsed <= 0:
+                continue
+            speed = ticket.cost.total / elapsed
+            with self._lock:
+                for pool, amount in ticket.cost.pools().items():
+                    if amount:
+                        self._speed[pool] += SPEED_SMOOTHING * (speed - self._speed[pool])
@@ -0,0 +1,270 @@
+"""Almacén de los archivos generados (transcripciones, videos, zips) con
+caducidad, cuota de espacio y limpieza periódica.
+
+Cada archivo de resultado se registra en un índice SQLite con su tamaño y su
+fecha de caducidad. Los registros de los archivos eliminados se conservan un
+tiempo para poder responder 410 (ya no existe) en vez de 404 (nunca existió).
+"""
+import logging
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Motivos por los que un archivo deja de estar disponible
+REMOVED_EXPIRED = "expired"
+REMOVED_EVICTED = "evicted"
+REMOVED_DELETED = "deleted"
+REMOVED_MISSING = "missing"
+
+_GONE_DETAILS = {
+    REMOVED_EXPIRED: "El archivo ha caducado y ya no está disponible",
+    REMOVED_EVICTED: "El archivo se eliminó para liberar espacio",
+    REMOVED_DELETED: "El archivo fue eliminado",
+    REMOVED_MISSING: "El archivo ya no está disponible",
+}
+
+# Prefijos de los archivos de resultado que se adoptan al arrancar si no
+# estaban en el índice (generados por versiones anteriores)
+_OUTPUT_PREFIXES = ("transcription_", "subtitled_video_", "segments_", "batch_")
+
+
+def unique_name(prefix: str, extension: str) -> str:
+    """Nombre sin colisiones aunque lleguen varias peticiones en el mismo segundo"""
+    return f"{prefix}_{uuid.uuid4().hex}.{extension}"
+
+
+class ArtifactStore:
+    """Índice de los archivos de resultado de `root`.
+
+    - Cada archivo caduca a los `ttl` segundos de registrarse.
+    - Si el total supera `max_bytes` se eliminan los descargados (o creados)
+      hace más tiempo.
+    - `sweep()` borra los caducados y los temporales huérfanos (entradas de
+      trabajos que no terminaron) con más de `stale_seconds`.
+    """
+
+    def __init__(self, root: Path, db_path: Path, default_ttl: float, max_bytes: int = 0,
+                 stale_seconds: float = 86400, tombstone_seconds: float = 7 * 86400):
+        self.root = Path(root)
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.stale_seconds = stale_seconds
+        self.tombstone_seconds = tombstone_seconds
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS artifacts (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                removed_at REAL,
+                removed_reason TEXT
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_artifacts_last_access ON artifacts (last_access)"
+        )
+        self._conn.commit()
+        self._adopt_existing()
+        self._total_bytes = self._stored_bytes()
+
+    def path(self, name: str) -> Path:
+        return self.root / name
+
+    def register(self, name: str, ttl: Optional[float] = None) -> float:
+        """Registra un archivo ya escrito en `root` y devuelve cuándo caduca"""
+        size = self.path(name).stat().st_size
+        now = time.time()
+        expires_at = now + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO artifacts
+                    (name, size, created_at, expires_at, last_access, removed_at, removed_reason)
+                VALUES (?, ?, ?, ?, ?, NULL, NULL)
+                """,
+                (name, size, now, expires_at, now)
+            )
+            self._total_bytes = self._stored_bytes()
+            self._evict(keep=name)
+            self._conn.commit()
+        return expires_at
+
+    def resolve(self, name: str) -> Path:
+        """Ruta de un archivo para descargarlo.
+
+        Lanza HTTPException 404 si nunca existió y 410 si caducó o se eliminó.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, removed_reason FROM artifacts WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                raise HTTPException(status_code=404, detail="Archivo no encontrado")
+            expires_at, removed_reason = row
+            if removed_reason is None:
+                if expires_at <= now:
+                    removed_reason = REMOVED_EXPIRED
+                elif not self.path(name).exists():
+                    removed_reason = REMOVED_MISSING
+                if removed_reason is not None:
+                    self._remove(name, removed_reason)
+                    self._conn.commit()
+            if removed_reason is not None:
+                raise HTTPException(status_code=410, detail=_GONE_DETAILS[removed_reason])
+            self._conn.execute("UPDATE artifacts SET last_access = ? WHERE name = ?", (now, name))
+            self._conn.commit()
+        return self.path(name)
+
+    def expires_at(self, name: str) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at FROM artifacts WHERE name = ? AND removed_at IS NULL", (name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def sweep(self) -> dict:
+        """Elimina los archivos caducados, los registros antiguos de archivos
+        eliminados y los temporales huérfanos"""
+        now = time.time()
+        with self._lock:
+            names = [row[0] for row in self._conn.execute(
+                "SELECT name FROM artifacts WHERE removed_at IS NULL AND expires_at <= ?", (now,)
+            )]
+            for name in names:
+                self._remove(name, REMOVED_EXPIRED)
+            self._conn.execute(
+                "DELETE FROM artifacts WHERE removed_at IS NOT NULL AND removed_at < ?",
+                (now - self.tombstone_seconds,)
+            )
+            self._conn.commit()
+            registered = {row[0] for row in self._conn.execute(
+                "SELECT name FROM artifacts WHERE removed_at IS NULL"
+            )}
+
+        stale = 0
+        for path in self.root.iterdir():
+            if path.name in registered:
+                continue
+            try:
+                if now - path.stat().st_mtime < self.stale_seconds:
+                    continue
+                if path.is_dir():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
+                stale += 1
+            except OSError:
+                pass
+        if names or stale:
+            logger.info("Limpieza de archivos: %s caducados, %s temporales huérfanos", len(names), stale)
+        return {"expired": len(names), "stale": stale}
+
+    def clear(self) -> int:
+        """Elimina todos los archivos registrados (no toca los de trabajos en curso)"""
+        with self._lock:
+            names = [row[0] for row in self._conn.execute(
+                "SELECT name FROM artifacts WHERE removed_at IS NULL"
+            )]
+            for name in names:
+                self._remove(name, REMOVED_DELETED)
+            self._conn.commit()
+        return len(names)
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM artifacts WHERE removed_at IS NULL"
+            ).fetchone()[0]
+            self._total_bytes = self._stored_bytes()
+            return {
+                "entries": entries,
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "default_ttl_seconds": self.default_ttl,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+    def _remove(self, name: str, reason: str) -> bool:
+        """Borra el archivo y deja el registro como eliminado (con el lock tomado)"""
+        row = self._conn.execute(
+            "SELECT size FROM artifacts WHERE name = ? AND removed_at IS NULL", (name,)
+        ).fetchone()
+        if row is None:
+            return False
+        try:
+            self.path(name).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # En Windows un archivo que se está descargando no se puede borrar
+            logger.error("No se pudo eliminar %s: %s", name, e)
+            return False
+        self._conn.execute(
+            "UPDATE artifacts SET removed_at = ?, removed_reason = ? WHERE name = ?",
+            (time.time(), reason, name)
+        )
+        self._total_bytes -= row[0]
+        if reason == REMOVED_EXPIRED:
+            self.expired += 1
+        elif reason == REMOVED_EVICTED:
+            self.evicted += 1
+        return True
+
+    def _stored_bytes(self) -> int:
+        # Se lee del índice en vez de acumularlo en memoria: los workers de
+        # otros procesos registran archivos en el mismo índice
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM artifacts WHERE removed_at IS NULL"
+        ).fetchone()[0]
+
+    def _evict(self, keep: str):
+        """Elimina los archivos usados hace más tiempo hasta volver a la cuota"""
+        while self.max_bytes and self._total_bytes > self.max_bytes:
+            row = self._conn.execute(
+                "SELECT name FROM artifacts WHERE removed_at IS NULL AND name != ? "
+                "ORDER BY last_access ASC LIMIT 1",
+                (keep,)
+            ).fetchone()
+            if row is None:
+                # Solo queda el archivo recién registrado
+                break
+            logger.info("Cuota de archivos superada, se elimina %s", row[0])
+            if not self._remove(row[0], REMOVED_EVICTED):
+                break
+
+    def _adopt_existing(self):
+        """Registra los resultados que ya había en `root` y no están en el índice"""
+        registered = {row[0] for row in self._conn.execute("SELECT name FROM artifacts")}
+        for path in self.root.glob("*"):
+            if (path.is_file() and path.name not in registered
+                    and path.name.startswith(_OUTPUT_PREFIXES)):
+                stat = path.stat()
+                self._conn.execute(
+                    """
+                    INSERT INTO artifacts (name, size, created_at, expires_at, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (path.name, stat.st_size, stat.st_mtime, stat.st_mtime + self.default_ttl,
+                     stat.st_mtime)
+                )
+        self._conn.commit()
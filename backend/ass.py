@@ -0,0 +1,212 @@
+"""Generación de subtítulos ASS con el estilo ya aplicado.
+
+FFmpeg convierte el VTT a ASS con su estilo por defecto y `force_style` lo
+reescribe en cada quemado. Aquí se genera el `.ass` final una sola vez
+(mismo estilo y medidas que el `force_style` anterior) y se guarda en una
+caché por hash del contenido y del estilo.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Resolución de referencia que usa FFmpeg al convertir VTT/SRT a ASS: los
+# tamaños de letra y márgenes se interpretan sobre ella
+PLAY_RES_X = 384
+PLAY_RES_Y = 288
+
+# Cambiar si cambia el formato generado, para invalidar la caché
+ASS_FORMAT_VERSION = 1
+
+
+@dataclass(frozen=True)
+class SubtitleStyle:
+    font_color: str = "#ffffff"
+    background_color: str = "#000000"
+    font_size: int = 20
+    background_opacity: float = 0.8
+    box_enabled: bool = False
+    box_color: str = "#000000"
+
+
+def hex_to_rgb(hex_color: str) -> Tuple[int, int, int]:
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def ass_color(hex_color: str, alpha: str = "00") -> str:
+    """Color en formato ASS: &HAABBGGRR (AA = transparencia)"""
+    r, g, b = hex_to_rgb(hex_color)
+    return f"&H{alpha}{b:02X}{g:02X}{r:02X}"
+
+
+def box_alpha(box_color: str) -> str:
+    """Transparencia de la caja según la luminancia de su color: los colores
+    muy oscuros se dejan más transparentes para que no tapen tanto"""
+    r, g, b = hex_to_rgb(box_color)
+    luminance = 0.299 * r + 0.587 * g + 0.114 * b
+    return "A0" if luminance < 50 else "D0"
+
+
+def style_line(style: SubtitleStyle) -> str:
+    """Línea `Style:` equivalente al force_style que se usaba con el VTT"""
+    primary = ass_color(style.font_color)
+    if style.box_enabled:
+        # BorderStyle=4: caja de fondo por línea (extensión de libass)
+        outline_color, back_color = "&H00000000", ass_color(style.box_color, box_alpha(style.box_color))
+        border_style, outline, shadow = 4, 1, 0
+        margin_l = margin_r = 15
+    else:
+        outline_color, back_color = ass_color(style.background_color), "&H00000000"
+        border_style, outline, shadow = 1, 2, 1
+        margin_l = margin_r = 10
+    return (
+        f"Style: Default,Arial,{style.font_size},{primary},{primary},{outline_color},{back_color},"
+        f"0,0,0,0,100,100,0,0,{border_style},{outline},{shadow},2,{margin_l},{margin_r},20,0"
+    )
+
+
+def format_ass_time(seconds: float) -> str:
+    """Tiempo ASS: H:MM:SS.cc (centésimas)"""
+    centiseconds = int(round(max(seconds, 0) * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+
+_VTT_TAGS = {"<b>": r"{\b1}", "</b>": r"{\b0}", "<i>": r"{\i1}", "</i>": r"{\i0}",
+             "<u>": r"{\u1}", "</u>": r"{\u0}"}
+
+
+def ass_text(text: str) -> str:
+    """Escapa el texto de un subtítulo y traduce las etiquetas básicas de VTT"""
+    text = text.replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}')
+    text = re.sub(r"</?[biu]>", lambda m: _VTT_TAGS[m.group(0)], text)
+    # Otras etiquetas de VTT (<v Nombre>, <c.clase>, marcas de tiempo) se descartan
+    text = re.sub(r"<[^>]*>", "", text)
+    return text.replace('\r', '').replace('\n', '\\N')
+
+
+def write_ass(cues: List[Tuple[float, float, str]], style: SubtitleStyle, output_path: str):
+    """Escribe los subtítulos (inicio, fin, texto) como archivo ASS con el estilo"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write("[Script Info]\n")
+        f.write("ScriptType: v4.00+\n")
+        f.write(f"PlayResX: {PLAY_RES_X}\n")
+        f.write(f"PlayResY: {PLAY_RES_Y}\n")
+        f.write("ScaledBorderAndShadow: yes\n")
+        f.write("WrapStyle: 0\n\n")
+        f.write("[V4+ Styles]\n")
+        f.write("Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, "
+                "BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, "
+                "BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding\n")
+        f.write(style_line(style) + "\n\n")
+        f.write("[Events]\n")
+        f.write("Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
+        for start, end, text in cues:
+            f.write(
+                f"Dialogue: 0,{format_ass_time(start)},{format_ass_time(end)},Default,,0,0,0,,"
+                f"{ass_text(text)}\n"
+            )
+
+
+def filter_path(path: str) -> str:
+    """Ruta para usar dentro de un filtro de FFmpeg.
+
+    Se prefiere la ruta relativa con barras normales, que no lleva la letra de
+    unidad de Windows; si no es posible se escapan `\\`, `:` y `'`.
+    """
+    try:
+        relative = Path(os.path.relpath(path)).as_posix()
+    except ValueError:
+        # En Windows, otra unidad distinta a la del directorio actual
+        relative = None
+    if relative and not re.search(r"[:'\\\[\],;]", relative):
+        return relative
+    return Path(os.path.abspath(path)).as_posix().replace(':', '\\:').replace("'", "\\'")
+
+
+class AssCache:
+    """Archivos ASS ya generados, indexados por hash de subtítulos + estilo.
+
+    Se expulsan los usados hace más tiempo (fecha de modificación) cuando hay
+    más de `max_entries`.
+    """
+
+    def __init__(self, cache_dir: Path, max_entries: int = 256):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(subtitles_hash: str, style: SubtitleStyle) -> str:
+        style_key = repr(sorted(asdict(style).items()))
+        return hashlib.sha256(
+            f"{ASS_FORMAT_VERSION}|{subtitles_hash}|{style_key}".encode('utf-8')
+        ).hexdigest()
+
+    def get_or_create(self, vtt_path: str, style: SubtitleStyle,
+                      load_cues: Callable[[str], List[Tuple[float, float, str]]]) -> str:
+        """Devuelve la ruta del ASS para este VTT y estilo, generándolo si no existe"""
+        with open(vtt_path, 'rb') as f:
+            subtitles_hash = hashlib.sha256(f.read()).hexdigest()
+        path = self.cache_dir / f"{self.make_key(subtitles_hash, style)}.ass"
+
+        with self._lock:
+            if path.exists():
+                self.hits += 1
+                # Marcar como usado recientemente
+                os.utime(path)
+                logger.debug("ASS reutilizado de la caché: %s", path.name)
+                return str(path)
+            self.misses += 1
+
+        # Se escribe en un temporal y se renombra para que un quemado
+        # simultáneo nunca lea un archivo a medias. El nombre incluye el
+        # proceso: los workers de varios procesos comparten CACHE_DIR
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        write_ass(load_cues(vtt_path), style, str(tmp_path))
+        os.replace(tmp_path, path)
+        logger.debug("ASS generado: %s (%s)", path.name, style_line(style))
+        self._evict()
+        return str(path)
+
+    def _evict(self):
+        with self._lock:
+            files = list(self.cache_dir.glob("*.ass"))
+            if len(files) <= self.max_entries:
+                return
+            mtimes = {}
+            for path in files:
+                try:
+                    mtimes[path] = path.stat().st_mtime
+                except OSError:
+                    pass
+            oldest = sorted(mtimes, key=mtimes.get)
+            for old in oldest[:max(0, len(oldest) - self.max_entries)]:
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            entries = len(list(self.cache_dir.glob("*.ass")))
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
@@ -0,0 +1,153 @@
+"""Motores de inferencia intercambiables para la transcripción.
+
+Todos devuelven la misma estructura que `whisper.transcribe`
+({'text', 'segments', 'language'}), que es lo que consumen los generadores
+de VTT y de texto limpio.
+"""
+import os
+from typing import Callable, Dict, Optional, Type
+
+
+class InferenceBackend:
+    """Interfaz común de los motores de transcripción"""
+
+    name = "base"
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @classmethod
+    def make_cache_key(cls, model_name: str, **options) -> str:
+        """Identifica motor + modelo (+ precisión) en la caché de transcripciones
+        sin necesidad de cargar el modelo"""
+        return f"{cls.name}/{model_name}"
+
+    @property
+    def cache_key(self) -> str:
+        return self.make_cache_key(self.model_name)
+
+    def transcribe(self, audio, language: str,
+                   on_segment: Optional[Callable[[dict], None]] = None, **options) -> dict:
+        """Transcribe el audio. `on_segment` recibe cada segmento en cuanto
+        está disponible (antes de terminar si el motor lo permite)"""
+        raise NotImplementedError
+
+
+class WhisperBackend(InferenceBackend):
+    """Implementación de referencia de OpenAI Whisper (PyTorch, fp32 en CPU)"""
+
+    name = "whisper"
+
+    def __init__(self, model_name: str, device: str = None):
+        super().__init__(model_name)
+        import whisper
+
+        self.model = whisper.load_model(model_name, device=device)
+
+    def transcribe(self, audio, language: str,
+                   on_segment: Optional[Callable[[dict], None]] = None, **options) -> dict:
+        result = self.model.transcribe(audio, language=language, **options)
+        # openai-whisper no expone los segmentos mientras decodifica
+        if on_segment is not None:
+            for segment in result['segments']:
+                on_segment(segment)
+        return result
+
+
+class FasterWhisperBackend(InferenceBackend):
+    """CTranslate2 (faster-whisper) con cuantización int8 por defecto en CPU"""
+
+    name = "faster-whisper"
+
+    def __init__(self, model_name: str, device: str = "cpu", compute_type: str = "int8",
+                 cpu_threads: int = 0):
+        super().__init__(model_name)
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise RuntimeError(
+                "El motor 'faster-whisper' requiere instalarlo: pip install faster-whisper"
+            )
+
+        self.compute_type = compute_type
+        self.model = WhisperModel(
+            model_name, device=device, compute_type=compute_type, cpu_threads=cpu_threads
+        )
+
+    @classmethod
+    def make_cache_key(cls, model_name: str, compute_type: str = "int8", **options) -> str:
+        return f"{cls.name}/{model_name}/{compute_type}"
+
+    @property
+    def cache_key(self) -> str:
+        return self.make_cache_key(self.model_name, compute_type=self.compute_type)
+
+    def transcribe(self, audio, language: str,
+                   on_segment: Optional[Callable[[dict], None]] = None, **options) -> dict:
+        # Los segmentos se decodifican a medida que se recorre el generador
+        segments_iter, info = self.model.transcribe(audio, language=language, **options)
+
+        # Convertir los segmentos de faster-whisper al formato de openai-whisper
+        segments = []
+        for segment in segments_iter:
+            converted = {
+                "id": len(segments),
+                "seek": segment.seek,
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text,
+                "tokens": list(segment.tokens),
+                "temperature": segment.temperature,
+                "avg_logprob": segment.avg_logprob,
+                "compression_ratio": segment.compression_ratio,
+                "no_speech_prob": segment.no_speech_prob,
+            }
+            if segment.words:
+                converted["words"] = [
+                    {
+                        "word": word.word,
+                        "start": word.start,
+                        "end": word.end,
+                        "probability": word.probability,
+                    }
+                    for word in segment.words
+                ]
+            segments.append(converted)
+            if on_segment is not None:
+                on_segment(converted)
+
+        return {
+            "text": "".join(segment["text"] for segment in segments),
+            "segments": segments,
+            "language": info.language,
+        }
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    WhisperBackend.name: WhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend,
+}
+
+
+def get_backend_class(backend_name: str) -> Type[InferenceBackend]:
+    backend_class = BACKENDS.get(backend_name)
+    if backend_class is None:
+        raise ValueError(
+            f"Motor de inferencia desconocido: '{backend_name}'. "
+            f"Opciones: {', '.join(BACKENDS)}"
+        )
+    return backend_class
+
+
+def resolve_backend_options(backend_name: str, **options) -> dict:
+    """Completa las opciones del motor con los valores del entorno"""
+    if get_backend_class(backend_name) is FasterWhisperBackend:
+        options.setdefault("compute_type", os.environ.get("FASTER_WHISPER_COMPUTE_TYPE", "int8"))
+        options.setdefault("cpu_threads", int(os.environ.get("FASTER_WHISPER_THREADS", "0")))
+    return options
+
+
+def create_backend(backend_name: str, model_name: str, **options) -> InferenceBackend:
+    """Crea el motor indicado. Las opciones no indicadas se leen del entorno"""
+    backend_class = get_backend_class(backend_name)
+    return backend_class(model_name, **resolve_backend_options(backend_name, **options))
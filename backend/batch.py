@@ -0,0 +1,141 @@
+"""Transcripción por lotes de muchos archivos cortos.
+
+Whisper procesa el audio en ventanas de 30 segundos: un clip de 5 segundos
+ocupa una ventana entera. Los clips cortos se empaquetan uno detrás de otro
+(con un silencio entre ellos) hasta llenar la ventana, se transcribe el
+paquete y los segmentos se reparten de nuevo entre los clips.
+"""
+import os
+import re
+import zipfile
+from dataclasses import dataclass
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from media import SAMPLE_RATE
+
+# Carpetas y archivos que añaden los compresores y no son contenido
+_IGNORED_ZIP_ENTRIES = ("__MACOSX/", ".DS_Store")
+
+
+@dataclass(frozen=True)
+class PackedClip:
+    index: int
+    # Posición del clip dentro del audio del paquete (segundos)
+    offset: float
+    duration: float
+
+
+def is_zip_upload(filename: str, content_type: str) -> bool:
+    return (filename or "").lower().endswith(".zip") or content_type in (
+        "application/zip", "application/x-zip-compressed"
+    )
+
+
+def safe_filename(name: str) -> str:
+    """Nombre sin directorios ni caracteres problemáticos para el disco y el zip"""
+    name = os.path.basename(name.replace("\\", "/"))
+    name = re.sub(r"[^\w.\- ]", "_", name).strip(" .")
+    return name or "archivo"
+
+
+def extract_zip(zip_path: str, destination: str, max_files: int, max_bytes: int = 0) -> List[tuple]:
+    """Extrae los archivos del zip (sin su estructura de carpetas).
+
+    Devuelve una lista de (nombre original, ruta extraída). Lanza ValueError
+    si el zip no es válido, contiene más de `max_files` archivos o, con
+    `max_bytes`, si descomprimido ocupa más de `max_bytes`.
+    """
+    try:
+        archive = zipfile.ZipFile(zip_path)
+    except zipfile.BadZipFile:
+        raise ValueError("El archivo zip no es válido")
+
+    extracted = []
+    with archive:
+        members = [
+            info for info in archive.infolist()
+            if not info.is_dir() and not any(part in info.filename for part in _IGNORED_ZIP_ENTRIES)
+        ]
+        if len(members) > max_files:
+            raise ValueError(f"El zip contiene más de {max_files} archivos")
+        too_large = f"El zip descomprimido ocupa más de {max_bytes // (1024 * 1024)} MB"
+        if max_bytes and sum(info.file_size for info in members) > max_bytes:
+            raise ValueError(too_large)
+        written = 0
+        for info in members:
+            path = os.path.join(destination, f"zip_{len(extracted):05d}_{safe_filename(info.filename)}")
+            # Se copia por bloques: nunca se usan las rutas del zip para escribir.
+            # Los tamaños del índice del zip pueden ser falsos, así que también
+            # se cuentan los bytes escritos
+            with archive.open(info) as source, open(path, "wb") as target:
+                for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                    written += len(chunk)
+                    if max_bytes and written > max_bytes:
+                        raise ValueError(too_large)
+                    target.write(chunk)
+            extracted.append((info.filename, path))
+    return extracted
+
+
+def plan_packs(durations: Dict[int, float], pack_seconds: float,
+               gap_seconds: float) -> List[List[PackedClip]]:
+    """Agrupa los clips en paquetes de hasta `pack_seconds` en el orden dado.
+
+    Los clips más largos que el paquete van solos.
+    """
+    packs = []
+    current: List[PackedClip] = []
+    offset = 0.0
+    for index, duration in durations.items():
+        if current and offset + duration > pack_seconds:
+            packs.append(current)
+            current, offset = [], 0.0
+        current.append(PackedClip(index, offset, duration))
+        offset += duration + gap_seconds
+    if current:
+        packs.append(current)
+    return packs
+
+
+def build_pack_audio(audios: Dict[int, np.ndarray], pack: Sequence[PackedClip],
+                     gap_seconds: float) -> np.ndarray:
+    gap = np.zeros(int(round(gap_seconds * SAMPLE_RATE)), dtype=np.float32)
+    parts = []
+    for clip in pack:
+        if parts:
+            parts.append(gap)
+        parts.append(audios[clip.index])
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+
+def split_pack_segments(segments: List[dict], pack: Sequence[PackedClip]) -> Dict[int, List[dict]]:
+    """Reparte los segmentos del paquete entre sus clips.
+
+    Cada segmento va al clip que contiene su punto medio, con los tiempos
+    relativos al clip y recortados a su duración.
+    """
+    result: Dict[int, List[dict]] = {clip.index: [] for clip in pack}
+    for segment in segments:
+        middle = (segment['start'] + segment['end']) / 2
+        # El último clip que empieza antes del punto medio
+        clip = pack[0]
+        for candidate in pack:
+            if candidate.offset <= middle:
+                clip = candidate
+        shifted = dict(segment)
+        shifted['start'] = _clip_time(segment['start'], clip)
+        shifted['end'] = _clip_time(segment['end'], clip)
+        if segment.get('words'):
+            shifted['words'] = [
+                {**word, 'start': _clip_time(word['start'], clip), 'end': _clip_time(word['end'], clip)}
+                for word in segment['words']
+            ]
+        shifted['id'] = len(result[clip.index])
+        result[clip.index].append(shifted)
+    return result
+
+
+def _clip_time(seconds: float, clip: PackedClip) -> float:
+    return min(max(seconds - clip.offset, 0.0), clip.duration)
@@ -0,0 +1,102 @@
+"""Compara los motores de inferencia sobre el mismo audio.
+
+Mide tiempo de carga, factor de tiempo real (RTF = tiempo de transcripción /
+duración del audio) y memoria máxima (RSS). Cada motor se ejecuta en un
+proceso nuevo para que la memoria de uno no contamine la medición del otro.
+
+Uso (desde el directorio backend):
+    python benchmarks/bench_backends.py audio.mp3 --backends whisper faster-whisper --model small
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media import SAMPLE_RATE, load_audio  # noqa: E402
+
+
+def peak_rss_mb():
+    """Memoria máxima usada por el proceso actual en MB (None si no se puede medir)"""
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux lo da en KB y macOS en bytes
+        return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+
+        return round(psutil.Process().memory_info().peak_wset / 1024 / 1024, 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+def _run_backend(backend_name, model_name, language, audio, results):
+    from backends import create_backend
+
+    started = time.perf_counter()
+    backend = create_backend(backend_name, model_name)
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    transcription = backend.transcribe(audio, language)
+    transcribe_seconds = time.perf_counter() - started
+
+    duration = len(audio) / SAMPLE_RATE
+    results.put({
+        "backend": backend.cache_key,
+        "load_seconds": round(load_seconds, 2),
+        "transcribe_seconds": round(transcribe_seconds, 2),
+        "real_time_factor": round(transcribe_seconds / duration, 3) if duration else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "segments": len(transcription["segments"]),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de motores de inferencia")
+    parser.add_argument("audio", help="Archivo de audio o video de prueba")
+    parser.add_argument("--backends", nargs="+", default=["whisper", "faster-whisper"])
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--language", default="es")
+    parser.add_argument("--output", help="Guardar los resultados en este archivo JSON")
+    args = parser.parse_args()
+
+    audio = load_audio(args.audio)
+    duration = len(audio) / SAMPLE_RATE
+    print(f"Audio: {args.audio} ({duration:.1f}s)")
+
+    context = multiprocessing.get_context("spawn")
+    rows = []
+    for backend_name in args.backends:
+        results = context.Queue()
+        process = context.Process(
+            target=_run_backend,
+            args=(backend_name, args.model, args.language, audio, results),
+        )
+        process.start()
+        process.join()
+        if process.exitcode != 0 or results.empty():
+            print(f"{backend_name}: falló (código {process.exitcode})")
+            continue
+        row = results.get()
+        rows.append(row)
+        print(
+            f"{row['backend']:<32} carga {row['load_seconds']:>6.2f}s  "
+            f"RTF {row['real_time_factor']:>6.3f}  RSS máx {row['peak_rss_mb']} MB  "
+            f"{row['segments']} segmentos"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"audio": args.audio, "duration": duration, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""Benchmark de las etapas de transcripción y subtitulado.
+
+Genera medios sintéticos con FFmpeg (ver synthetic_media.py) y mide:
+
+- stage: cada etapa por separado (ffprobe, decodificación desde archivo y
+  por streaming, VAD, Whisper, quemado de subtítulos, pista de subtítulos)
+- e2e: /transcribe y /subtitle de principio a fin con el TestClient de
+  FastAPI (con las cachés vacías en cada repetición)
+- micro: create_vtt_file, create_clean_transcription, format_timestamp y
+  count_vtt_subtitles sobre listas de segmentos muy grandes
+
+Cada resultado incluye el mejor tiempo y la media, el factor de tiempo real
+(tiempo / duración del medio), la memoria residente máxima del proceso
+durante la medición y el uso de CPU (segundos de CPU propios y de los
+procesos hijos como FFmpeg por segundo real: 2.0 = dos núcleos ocupados).
+
+Con --baseline se compara con un JSON anterior y el script termina con
+código 1 si alguna medición es más lenta que el umbral.
+
+Uso (desde el directorio backend):
+    python benchmarks/bench_pipeline.py --durations 10 60 --model tiny --output actual.json
+    python benchmarks/bench_pipeline.py --groups micro --baseline actual.json --threshold 0.2
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_backends import peak_rss_mb  # noqa: E402
+from synthetic_media import generate_fixtures  # noqa: E402
+
+GROUPS = ("stage", "e2e", "micro")
+
+# Palabras para los segmentos sintéticos de los micro-benchmarks
+WORDS = (
+    "el la de que y en un una por con para como pero más este esta todo "
+    "tiempo video subtítulo transcripción ejemplo prueba rápido lento"
+).split()
+
+
+class PeakMemory:
+    """Memoria residente máxima mientras dura el bloque `with`.
+
+    En Linux se muestrea /proc/self/statm; en otros sistemas se usa el máximo
+    de todo el proceso (que solo crece).
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _current_bytes(self):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * self._page_size
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self._current_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if os.path.exists("/proc/self/statm"):
+            self.peak_bytes = self._current_bytes()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_bytes = max(self.peak_bytes, self._current_bytes())
+
+    @property
+    def peak_mb(self):
+        if self._thread is None:
+            return peak_rss_mb()
+        return round(self.peak_bytes / 1024 / 1024, 1)
+
+
+def measure(func, repeat: int, media_seconds: float = None, setup=None):
+    """Ejecuta `func` `repeat` veces y devuelve tiempos, RTF, CPU y memoria.
+
+    `setup` se ejecuta antes de cada repetición, fuera de la medición.
+    """
+    walls, cpu_ratios, peaks = [], [], []
+    details = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        before = os.times()
+        started = time.perf_counter()
+        with PeakMemory() as memory:
+            details = func()
+        wall = time.perf_counter() - started
+        after = os.times()
+        cpu_seconds = sum(after[:4]) - sum(before[:4])
+        walls.append(wall)
+        cpu_ratios.append(cpu_seconds / wall if wall else None)
+        peaks.append(memory.peak_mb)
+    best = min(walls)
+    result = {
+        "wall_seconds": round(best, 4),
+        "mean_seconds": round(sum(walls) / len(walls), 4),
+        "repeat": repeat,
+        "real_time_factor": round(best / media_seconds, 4) if media_seconds else None,
+        "cpu_utilisation": round(cpu_ratios[walls.index(best)], 2) if cpu_ratios[walls.index(best)] is not None else None,
+        "peak_rss_mb": max((peak for peak in peaks if peak is not None), default=None),
+    }
+    if isinstance(details, dict):
+        result["details"] = details
+    return result
+
+
+def make_segments(count: int, with_words: bool = False, seed: int = 0):
+    """Segmentos como los de Whisper: 3 s y unas 10 palabras, con puntos
+    cada pocas frases"""
+    rng = random.Random(seed)
+    segments = []
+    for index in range(count):
+        start = index * 3.0
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 14))]
+        text = " " + " ".join(words) + ("." if rng.random() < 0.4 else "")
+        segment = {"id": index, "start": start, "end": start + 3.0, "text": text}
+        if with_words:
+            step = 3.0 / len(words)
+            segment["words"] = [
+                {"word": " " + word, "start": start + i * step, "end": start + (i + 1) * step}
+                for i, word in enumerate(words)
+            ]
+        segments.append(segment)
+    return segments
+
+
+def wait_for_job(client, job_id: str, poll_seconds: float = 0.05):
+    while True:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed", "cancelled"):
+            if job["status"] != "completed":
+                raise RuntimeError(f"El trabajo {job_id} terminó como {job['status']}: {job.get('error')}")
+            return job
+        time.sleep(poll_seconds)
+
+
+def run_stage_benchmarks(server, fixtures, args, work_dir):
+    from media import decode_audio_stream, iter_file_chunks, load_audio, probe_media
+    from vad import extract_speech
+
+    results = []
+    audio_fixtures = [f for f in fixtures if f.kind == "audio"]
+    video_fixtures = [f for f in fixtures if f.kind == "video"]
+    vtt_by_duration = {f.duration: f.path for f in fixtures if f.kind == "vtt"}
+
+    for fixture in audio_fixtures:
+        def decode_stream():
+            with open(fixture.path, "rb") as f:
+                decode_audio_stream(iter_file_chunks(f))
+
+        results.append(("decode_file", fixture, measure(
+            lambda: load_audio(fixture.path), args.repeat, fixture.duration)))
+        results.append(("decode_stream", fixture, measure(decode_stream, args.repeat, fixture.duration)))
+        audio = load_audio(fixture.path)
+        results.append(("vad", fixture, measure(lambda: extract_speech(audio), args.repeat, fixture.duration)))
+        if not args.skip_whisper:
+            # Carga del modelo fuera de la medición
+            server.model_registry.get(args.model)
+            results.append(("whisper", fixture, measure(
+                lambda: {"segments": len(server.transcribe_audio(audio, args.language, args.model)["segments"])},
+                args.repeat, fixture.duration)))
+
+    for fixture in video_fixtures:
+        vtt_path = vtt_by_duration[fixture.duration]
+        wav_path = os.path.join(work_dir, "bench_audio.wav")
+        burned_path = os.path.join(work_dir, "bench_burned.mp4")
+        muxed_path = os.path.join(work_dir, "bench_muxed.mp4")
+
+        def burn():
+            started = time.perf_counter()
+            encoder = server.create_subtitled_video(
+                fixture.path, vtt_path, burned_path, duration=fixture.duration
+            )
+            frames = fixture.duration * (probe_media(fixture.path).video_stream.frame_rate or 0)
+            return {"encoder": encoder, "fps": round(frames / (time.perf_counter() - started), 1)}
+
+        results.append(("ffprobe", fixture, measure(lambda: probe_media(fixture.path), args.repeat)))
+        results.append(("extract_audio", fixture, measure(
+            lambda: server.extract_audio_or_process_audio(fixture.path, wav_path),
+            args.repeat, fixture.duration)))
+        results.append(("burn_subtitles", fixture, measure(burn, args.repeat, fixture.duration)))
+        results.append(("soft_subtitles", fixture, measure(
+            lambda: server.mux_soft_subtitles(fixture.path, vtt_path, muxed_path),
+            args.repeat, fixture.duration)))
+    return results
+
+
+def run_e2e_benchmarks(server, fixtures, args):
+    from fastapi.testclient import TestClient
+
+    results = []
+    video_fixtures = [f for f in fixtures if f.kind == "video"]
+    audio_fixtures = [f for f in fixtures if f.kind == "audio"]
+    vtt_by_duration = {f.duration: f.path for f in fixtures if f.kind == "vtt"}
+
+    def clear_caches():
+        server.transcript_cache.clear()
+        for path in server.ass_cache.cache_dir.glob("*.ass"):
+            path.unlink()
+
+    with TestClient(server.app) as client:
+        if not args.skip_whisper:
+            server.model_registry.get(args.model)
+            for fixture in audio_fixtures + video_fixtures:
+                def transcribe():
+                    with open(fixture.path, "rb") as f:
+                        response = client.post(
+                            "/transcribe",
+                            files={"file": (os.path.basename(fixture.path), f,
+                                            "video/mp4" if fixture.kind == "video" else "audio/wav")},
+                            data={"language": args.language, "model": args.model},
+                        )
+                    response.raise_for_status()
+                    return {"timings": wait_for_job(client, response.json()["job_id"])["timings"]}
+
+                results.append(("transcribe", fixture, measure(
+                    transcribe, args.repeat, fixture.duration, setup=clear_caches)))
+
+        for fixture in video_fixtures:
+            def subtitle():
+                with open(fixture.path, "rb") as video, open(vtt_by_duration[fixture.duration], "rb") as vtt:
+                    response = client.post(
+                        "/subtitle",
+                        files={"video": ("video.mp4", video, "video/mp4"),
+                               "vtt": ("subtitles.vtt", vtt, "text/vtt")},
+                    )
+                response.raise_for_status()
+                job = wait_for_job(client, response.json()["job_id"])
+                return {"timings": job["timings"], "burn_fps": job["result"].get("burn_fps")}
+
+            results.append(("subtitle", fixture, measure(
+                subtitle, args.repeat, fixture.duration, setup=clear_caches)))
+    return results
+
+
+def run_micro_benchmarks(server, args, work_dir):
+    from captions import format_timestamp
+
+    results = []
+    output_path = os.path.join(work_dir, "bench_output")
+    vtt_path = os.path.join(work_dir, "bench_subtitles.vtt")
+    segments = make_segments(args.segments)
+    word_segments = make_segments(args.segments, with_words=True)
+    values = [i * 0.137 for i in range(args.timestamps)]
+
+    def format_all():
+        for value in values:
+            format_timestamp(value)
+
+    micro = [
+        ("format_timestamp", args.timestamps, format_all),
+        ("create_vtt_file", args.segments,
+         lambda: server.create_vtt_file({"segments": segments}, output_path)),
+        ("create_vtt_file_words", args.segments,
+         lambda: server.create_vtt_file({"segments": word_segments}, output_path)),
+        ("create_clean_transcription", args.segments,
+         lambda: server.create_clean_transcription({"segments": segments}, output_path)),
+    ]
+    server.create_vtt_file({"segments": segments}, vtt_path)
+    micro.append(("count_vtt_subtitles", args.segments, lambda: server.count_vtt_subtitles(vtt_path)))
+    for name, items, func in micro:
+        result = measure(func, args.repeat)
+        result["items"] = items
+        result["microseconds_per_item"] = round(result["wall_seconds"] / items * 1e6, 3)
+        results.append((name, None, result))
+    return results
+
+
+def find_regressions(results, baseline, threshold: float, min_seconds: float):
+    """Mediciones más lentas que la referencia en más de `threshold`
+    (fracción) y de `min_seconds` (para ignorar el ruido de las muy cortas)"""
+    reference = {row["name"]: row for row in baseline.get("results", [])}
+    regressions = []
+    for row in results:
+        previous = reference.get(row["name"])
+        if previous is None:
+            continue
+        current, before = row["wall_seconds"], previous["wall_seconds"]
+        if current > before * (1 + threshold) and current - before >= min_seconds:
+            regressions.append({
+                "name": row["name"],
+                "baseline_seconds": before,
+                "current_seconds": current,
+                "change": round(current / before - 1, 3),
+            })
+    return regressions
+
+
+def environment_info(args):
+    try:
+        ffmpeg = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg,
+        "backend": os.environ.get("INFERENCE_BACKEND", "whisper"),
+        "model": args.model,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de las etapas de transcripción y subtitulado")
+    parser.add_argument("--groups", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--media-dir", default="bench_media", help="Dónde se generan los medios sintéticos")
+    parser.add_argument("--durations", nargs="+", type=float, default=[10, 60])
+    parser.add_argument("--resolutions", nargs="+", default=["640x360", "1280x720"])
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--language", default="spanish")
+    parser.add_argument("--skip-whisper", action="store_true",
+                        help="No medir las etapas que necesitan un modelo de Whisper")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--segments", type=int, default=100000,
+                        help="Segmentos de los micro-benchmarks de escritura")
+    parser.add_argument("--timestamps", type=int, default=1000000,
+                        help="Llamadas del micro-benchmark de format_timestamp")
+    parser.add_argument("--output", help="Guardar los resultados en este archivo JSON")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior para detectar regresiones")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Empeoramiento máximo permitido respecto a --baseline (0.2 = 20%%)")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="Diferencia mínima para considerar una regresión")
+    args = parser.parse_args()
+
+    fixtures = generate_fixtures(os.path.abspath(args.media_dir), args.durations, args.resolutions)
+
+    # El servidor se importa en un directorio de trabajo temporal para no
+    # tocar temp_uploads ni la caché reales, y sin precargar el modelo por defecto
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    os.environ.setdefault("WARM_DEFAULT_MODEL", "0")
+    os.environ.setdefault("WHISPER_MODEL", args.model)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["CACHE_DIR"] = os.path.join(work_dir, "cache")
+    previous_cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        server = importlib.import_module("main")
+        rows = []
+        for group in args.groups:
+            if group == "stage":
+                measured = run_stage_benchmarks(server, fixtures, args, work_dir)
+            elif group == "e2e":
+                measured = run_e2e_benchmarks(server, fixtures, args)
+            else:
+                measured = run_micro_benchmarks(server, args, work_dir)
+            for name, fixture, result in measured:
+                row = {
+                    "name": "/".join(filter(None, (group, name, fixture.name if fixture else None))),
+                    "group": group,
+                    "stage": name,
+                    "fixture": fixture.name if fixture else None,
+                    **result,
+                }
+                rows.append(row)
+                rtf = f"RTF {row['real_time_factor']:.3f}" if row["real_time_factor"] else ""
+                print(
+                    f"{row['name']:<52} {row['wall_seconds']:>9.4f}s  {rtf:<11} "
+                    f"CPU {row['cpu_utilisation']}  RSS máx {row['peak_rss_mb']} MB"
+                )
+    finally:
+        os.chdir(previous_cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(rows, json.load(f), args.threshold, args.min_seconds)
+        for regression in regressions:
+            print(
+                f"REGRESIÓN {regression['name']}: {regression['baseline_seconds']}s -> "
+                f"{regression['current_seconds']}s (+{regression['change']:.0%})"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "environment": environment_info(args),
+                "fixtures": [fixture.to_dict() for fixture in fixtures],
+                "results": rows,
+                "regressions": regressions,
+            }, f, indent=2, ensure_ascii=False)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Coste de las marcas de tiempo por palabra frente a la decodificación.
+
+Transcribe el mismo audio con y sin `word_timestamps` y mide también lo que
+cuesta construir los subtítulos con cada método.
+
+Uso (desde el directorio backend):
+    python benchmarks/bench_word_timestamps.py audio.mp3 --model small --repeat 3
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backends import create_backend  # noqa: E402
+from captions import CueLimits, segment_cues  # noqa: E402
+from media import SAMPLE_RATE, load_audio  # noqa: E402
+
+
+def best_time(func, repeat: int):
+    """Menor tiempo de `repeat` ejecuciones (y el resultado de la última)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def build_cues(segments, limits: CueLimits, use_words: bool):
+    cues = []
+    for segment in segments:
+        if not use_words:
+            segment = {key: value for key, value in segment.items() if key != 'words'}
+        cues.extend(segment_cues(segment, limits=limits))
+    return cues
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de marcas de tiempo por palabra")
+    parser.add_argument("audio", help="Archivo de audio o video de prueba")
+    parser.add_argument("--backend", default=os.environ.get("INFERENCE_BACKEND", "whisper"))
+    parser.add_argument("--model", default="small")
+    parser.add_argument("--language", default="es")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-words", type=int, default=5)
+    parser.add_argument("--max-chars", type=int, default=0)
+    parser.add_argument("--max-duration", type=float, default=0.0)
+    parser.add_argument("--output", help="Guardar los resultados en este archivo JSON")
+    args = parser.parse_args()
+
+    audio = load_audio(args.audio)
+    duration = len(audio) / SAMPLE_RATE
+    print(f"Audio: {args.audio} ({duration:.1f}s)")
+
+    backend = create_backend(args.backend, args.model)
+    # Calentamiento: la primera pasada incluye inicializaciones perezosas
+    backend.transcribe(audio, args.language)
+
+    decode_seconds, _ = best_time(lambda: backend.transcribe(audio, args.language), args.repeat)
+    aligned_seconds, aligned = best_time(
+        lambda: backend.transcribe(audio, args.language, word_timestamps=True), args.repeat
+    )
+
+    limits = CueLimits(args.max_words, args.max_chars, args.max_duration)
+    segments = aligned['segments']
+    proportional_seconds, proportional_cues = best_time(
+        lambda: build_cues(segments, limits, use_words=False), args.repeat
+    )
+    word_seconds, word_cues = best_time(
+        lambda: build_cues(segments, limits, use_words=True), args.repeat
+    )
+
+    alignment_seconds = aligned_seconds - decode_seconds
+    row = {
+        "backend": backend.cache_key,
+        "audio_seconds": round(duration, 2),
+        "segments": len(segments),
+        "decode_seconds": round(decode_seconds, 3),
+        "decode_with_words_seconds": round(aligned_seconds, 3),
+        "alignment_seconds": round(alignment_seconds, 3),
+        "alignment_overhead_pct": round(100 * alignment_seconds / decode_seconds, 1),
+        "real_time_factor": round(decode_seconds / duration, 4),
+        "real_time_factor_with_words": round(aligned_seconds / duration, 4),
+        "proportional_cues": len(proportional_cues),
+        "proportional_cues_ms": round(proportional_seconds * 1000, 3),
+        "word_cues": len(word_cues),
+        "word_cues_ms": round(word_seconds * 1000, 3),
+    }
+    print(
+        f"{row['backend']:<32} RTF {row['real_time_factor']:>6.3f}  "
+        f"con palabras {row['real_time_factor_with_words']:>6.3f}  "
+        f"alineación +{row['alignment_overhead_pct']}%"
+    )
+    print(
+        f"Subtítulos: proporcional {row['proportional_cues']} en {row['proportional_cues_ms']} ms, "
+        f"por palabra {row['word_cues']} en {row['word_cues_ms']} ms"
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"audio": args.audio, "duration": duration, "results": [row]}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
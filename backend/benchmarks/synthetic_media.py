@@ -0,0 +1,135 @@
+"""Genera medios sintéticos para los benchmarks sin descargar nada.
+
+Todo sale de las fuentes `lavfi` de FFmpeg, así que los archivos son
+idénticos en cada máquina:
+
+- tone: un tono de 440 Hz
+- noise: ruido rosa
+- speech: ruido filtrado a la banda de la voz, con ritmo de sílabas
+  (modulación a 4 Hz) y pausas de 1,5 s cada 5 s. No es habla real, pero
+  activa el VAD y Whisper lo procesa como audio con voz.
+- video: barras de prueba (`testsrc2`) con el audio `speech`
+
+Uso (desde el directorio backend):
+    python benchmarks/synthetic_media.py --output-dir bench_media --durations 10 60 --resolutions 640x360 1280x720
+"""
+import argparse
+import os
+import subprocess
+from dataclasses import asdict, dataclass
+from typing import List, Optional
+
+SAMPLE_RATE = 16000
+
+AUDIO_SOURCES = {
+    "tone": "sine=frequency=440:sample_rate={rate}:duration={duration}",
+    "noise": "anoisesrc=color=pink:amplitude=0.3:sample_rate={rate}:duration={duration}",
+    "speech": (
+        "anoisesrc=color=brown:amplitude=0.8:sample_rate={rate}:duration={duration},"
+        "bandpass=f=1000:width_type=h:w=2400,tremolo=f=4:d=0.9,volume=10dB,"
+        "volume='if(lt(mod(t,5),3.5),1,0)':eval=frame"
+    ),
+}
+
+
+@dataclass(frozen=True)
+class Fixture:
+    name: str
+    kind: str
+    path: str
+    duration: float
+    resolution: Optional[str] = None
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def _run(cmd: List[str]):
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg falló generando {cmd[-1]}: {result.stderr}")
+
+
+def make_audio(path: str, source: str, duration: float):
+    filter_graph = AUDIO_SOURCES[source].format(rate=SAMPLE_RATE, duration=duration)
+    _run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", filter_graph,
+        "-ac", "1", "-c:a", "pcm_s16le", "-y", path
+    ])
+
+
+def make_video(path: str, duration: float, resolution: str, fps: int = 25):
+    audio_graph = AUDIO_SOURCES["speech"].format(rate=44100, duration=duration)
+    _run([
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={resolution}:rate={fps}:duration={duration}",
+        "-f", "lavfi", "-i", audio_graph,
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-g", str(fps * 2), "-c:a", "aac", "-b:a", "96k", "-shortest",
+        "-movflags", "+faststart", "-y", path
+    ])
+
+
+def make_vtt(path: str, duration: float, cue_seconds: float = 2.0):
+    """Un subtítulo numerado cada `cue_seconds`"""
+    lines = ["WEBVTT", ""]
+    start, index = 0.0, 1
+    while start < duration:
+        end = min(start + cue_seconds, duration)
+        lines += [
+            str(index),
+            f"{_vtt_time(start)} --> {_vtt_time(end)}",
+            f"Subtítulo de prueba número {index}",
+            "",
+        ]
+        start, index = end, index + 1
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def _vtt_time(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    secs, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{milliseconds:03d}"
+
+
+def generate_fixtures(output_dir: str, durations: List[float], resolutions: List[str],
+                      sources: List[str] = ("speech",)) -> List[Fixture]:
+    """Crea (o reutiliza si ya existen) los audios, videos y VTT de prueba"""
+    os.makedirs(output_dir, exist_ok=True)
+    fixtures = []
+    for duration in durations:
+        label = f"{duration:g}s"
+        for source in sources:
+            path = os.path.join(output_dir, f"{source}_{label}.wav")
+            if not os.path.exists(path):
+                make_audio(path, source, duration)
+            fixtures.append(Fixture(f"{source}_{label}", "audio", path, duration))
+        vtt_path = os.path.join(output_dir, f"subtitles_{label}.vtt")
+        if not os.path.exists(vtt_path):
+            make_vtt(vtt_path, duration)
+        fixtures.append(Fixture(f"subtitles_{label}", "vtt", vtt_path, duration))
+        for resolution in resolutions:
+            path = os.path.join(output_dir, f"video_{resolution}_{label}.mp4")
+            if not os.path.exists(path):
+                make_video(path, duration, resolution)
+            fixtures.append(Fixture(f"video_{resolution}_{label}", "video", path, duration, resolution))
+    return fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera medios sintéticos para los benchmarks")
+    parser.add_argument("--output-dir", default="bench_media")
+    parser.add_argument("--durations", nargs="+", type=float, default=[10, 60])
+    parser.add_argument("--resolutions", nargs="+", default=["640x360", "1280x720"])
+    parser.add_argument("--sources", nargs="+", choices=sorted(AUDIO_SOURCES), default=["speech"])
+    args = parser.parse_args()
+
+    for fixture in generate_fixtures(args.output_dir, args.durations, args.resolutions, args.sources):
+        print(f"{fixture.name:<28} {fixture.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1057 @@
+"""Broker de trabajos para separar la API de los workers.
+
+Con `BROKER_URL` la API solo guarda los archivos y encola los trabajos; los
+ejecutan procesos `worker.py` (en esta u otras máquinas) que mantienen su
+propio modelo cargado. El estado, los eventos de progreso y la cancelación
+pasan por el broker, así que cualquier nodo de la API responde a
+/jobs/{id} y /jobs/{id}/events:
+
+- `sqlite:///ruta/jobs.sqlite3`: una sola máquina, sin servicios externos
+- `redis://host:6379/0`: varias máquinas (requiere `pip install redis`)
+
+Los workers reparten los trabajos entre clientes igual que la cola en
+proceso: se reclama el más antiguo del cliente con menos coste en curso.
+
+Los argumentos de cada trabajo viajan serializados con pickle: el broker
+solo debe ser accesible por la API y los workers.
+"""
+import io
+import json
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from jobs import (
+    FINISHED_STATES, JOB_CANCELLED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, MAX_JOB_EVENTS,
+    Job, execute_job, run_cleanup
+)
+from metrics import JOBS_FINISHED
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto consulta un trabajo en curso si se pidió cancelarlo
+CANCEL_POLL_SECONDS = 0.5
+# Cada cuánto se escriben en el broker los eventos de progreso y los
+# segmentos de un trabajo en curso (los de etapa y estado van al momento)
+EVENT_FLUSH_SECONDS = 0.5
+IMMEDIATE_EVENTS = ("stage", "status")
+# Cuánto se reutilizan las estadísticas del broker (workers vivos, trabajos
+# en cola) entre peticiones
+STATS_CACHE_SECONDS = 1.0
+
+
+class _TaskUnpickler(pickle.Unpickler):
+    """Con `python main.py` las clases de main se serializan como `__main__`;
+    en el worker ese módulo es `main`"""
+
+    def find_class(self, module, name):
+        if module == "__main__":
+            module = "main"
+        return super().find_class(module, name)
+
+
+def dumps_task(func: Callable, args, kwargs) -> bytes:
+    """La función se guarda por nombre: el worker la busca en `main`"""
+    return pickle.dumps((func.__name__, args, kwargs), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def dumps_cleanup(cleanup: Optional[Callable[[], None]]) -> bytes:
+    """La limpieza se guarda aparte de los argumentos: sigue en el broker
+    mientras el trabajo está en curso por si su worker se cae. Se serializa
+    también cuando es None"""
+    return pickle.dumps(cleanup, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def loads_task(payload: bytes):
+    return _TaskUnpickler(io.BytesIO(payload)).load()
+
+
+def finished_snapshot(snapshot: dict, status: str, error: str = None,
+                      error_status: int = None) -> Tuple[dict, dict]:
+    """Estado final y evento de un trabajo que se cierra fuera del worker
+    (cancelado en cola o con el worker caído)"""
+    event_id = snapshot.get("last_event_id", 0) + 1
+    snapshot = {
+        **snapshot, "status": status, "stage": status, "finished_at": time.time(),
+        "error": error, "cancel_requested": status == JOB_CANCELLED or snapshot.get("cancel_requested"),
+        "last_event_id": event_id,
+    }
+    event = {"id": event_id, "type": "status", "status": status}
+    if error is not None:
+        event.update(error=error, error_status=error_status)
+    return snapshot, event
+
+
+class Broker:
+    """Interfaz común de los brokers"""
+
+    def enqueue(self, job_id: str, kind: str, payload: bytes, snapshot: dict, cleanup: bytes,
+                client_id: Optional[str] = None, cost: float = 1.0, after: Optional[List[str]] = None):
+        """Encola un trabajo con sus argumentos y su limpieza (`dumps_task` y
+        `dumps_cleanup`) a nombre de un cliente. Con `after` no se reclama
+        hasta que terminan esos trabajos."""
+        raise NotImplementedError
+
+    def claim(self, worker_id: str, timeout: float) -> Optional[Tuple[str, bytes, dict, bytes]]:
+        """Reserva un trabajo en cola (espera hasta `timeout`): el más antiguo
+        del cliente con menos coste en curso y, a igualdad, del que lleva más
+        tiempo sin empezar uno.
+
+        Devuelve su id, argumentos, estado y limpieza. Los argumentos se
+        borran del broker; la limpieza se guarda hasta que el trabajo termina.
+        """
+        raise NotImplementedError
+
+    def update(self, job_id: str, snapshot: dict, events: List[dict], replaces: Optional[int] = None) -> bool:
+        """Guarda el estado del trabajo y añade sus eventos nuevos (sustituyendo
+        al evento con id `replaces` si era un progreso que se fusionó).
+
+        Un trabajo terminado ya no cambia: si se cerró fuera de su worker
+        (cancelado en cola o con el worker caído) devuelve False sin escribir.
+        """
+        raise NotImplementedError
+
+    def snapshot(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def events_since(self, job_id: str, event_id: int) -> List[dict]:
+        raise NotImplementedError
+
+    def request_cancel(self, job_id: str) -> Tuple[Optional[dict], Optional[bytes]]:
+        """Pide cancelar un trabajo. Devuelve su estado y, si estaba en cola
+        (y queda cancelado al instante), su limpieza para ejecutarla"""
+        raise NotImplementedError
+
+    def claimed_cleanup(self, job_id: str) -> Optional[bytes]:
+        """Limpieza de un trabajo en curso"""
+        raise NotImplementedError
+
+    def cancel_requested(self, job_id: str) -> bool:
+        raise NotImplementedError
+
+    def heartbeat(self, worker_id: str, metrics: Optional[dict] = None):
+        """Señal de vida de un worker, con el `snapshot()` de sus métricas"""
+        raise NotImplementedError
+
+    def remove_worker(self, worker_id: str):
+        """Un worker que se detiene limpiamente deja de contar en las estadísticas"""
+        raise NotImplementedError
+
+    def worker_metrics(self, worker_timeout: float) -> Dict[str, dict]:
+        """Últimas métricas enviadas por cada worker vivo"""
+        raise NotImplementedError
+
+    def stale_running(self, worker_timeout: float) -> List[str]:
+        """Trabajos en curso cuyo worker dejó de dar señales de vida"""
+        raise NotImplementedError
+
+    def stats(self, worker_timeout: float) -> dict:
+        raise NotImplementedError
+
+    # Reservas del control de admisión, compartidas por todas las instancias
+    # de la API (misma interfaz que `admission.LocalReservations`)
+
+    def add_reservation(self, reservation: dict, check: Callable[[List[dict]], None]):
+        """Guarda la reserva si `check(reservas actuales)` no lanza; la lectura
+        y la escritura son atómicas frente a otras instancias"""
+        raise NotImplementedError
+
+    def attach_reservation(self, reservation_id: str, job_id: str):
+        raise NotImplementedError
+
+    def remove_reservation(self, reservation_id: str) -> bool:
+        """Borra la reserva; False si ya la había borrado otra instancia"""
+        raise NotImplementedError
+
+    def reservations(self) -> List[dict]:
+        raise NotImplementedError
+
+    def fail_orphaned(self, worker_timeout: float):
+        """Da por fallidos los trabajos de workers caídos y ejecuta su limpieza
+        (el worker que los tenía ya no lo hará)"""
+        for job_id in self.stale_running(worker_timeout):
+            snapshot = self.snapshot(job_id)
+            if snapshot is None:
+                continue
+            cleanup = self.claimed_cleanup(job_id)
+            snapshot, event = finished_snapshot(
+                snapshot, JOB_FAILED, "El worker que ejecutaba el trabajo dejó de responder", 500
+            )
+            if not self.update(job_id, snapshot, [event]):
+                continue
+            logger.warning("Trabajo %s fallido: su worker dejó de responder", job_id)
+            JOBS_FINISHED.inc(kind=snapshot["kind"], status=JOB_FAILED)
+            if cleanup is not None:
+                try:
+                    run_cleanup(RemoteJob(self, snapshot), loads_task(cleanup))
+                except Exception as e:
+                    logger.error("No se pudo leer la limpieza del trabajo %s: %s", job_id, e)
+
+
+class SQLiteBroker(Broker):
+    """Cola en un archivo SQLite compartido por la API y los workers de la
+    misma máquina (o del mismo sistema de archivos local)"""
+
+    def __init__(self, db_path: Path, retention_seconds: float = 3600, poll_seconds: float = 0.2):
+        self.retention_seconds = retention_seconds
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Sin transacciones implícitas: cada operación abre la suya con
+        # BEGIN IMMEDIATE para que dos workers no reserven el mismo trabajo
+        self._conn = sqlite3.connect(
+            str(db_path), timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                payload BLOB,
+                cleanup BLOB,
+                snapshot TEXT NOT NULL,
+                cancel INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                client TEXT,
+                cost REAL NOT NULL DEFAULT 1,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+            CREATE TABLE IF NOT EXISTS events (
+                job_id TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, id)
+            );
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS worker_metrics (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS dependencies (
+                job_id TEXT NOT NULL,
+                after_id TEXT NOT NULL,
+                PRIMARY KEY (job_id, after_id)
+            );
+            CREATE TABLE IF NOT EXISTS reservations (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            """
+        )
+        # Bases creadas por versiones anteriores
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (("cleanup", "BLOB"), ("client", "TEXT"),
+                                   ("cost", "REAL NOT NULL DEFAULT 1"), ("started_at", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_client ON jobs (status, client)")
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, job_id, kind, payload, snapshot, cleanup, client_id=None, cost=1.0, after=None):
+        now = time.time()
+        with self._transaction() as conn:
+            # Olvidar los trabajos terminados hace tiempo
+            old = now - self.retention_seconds
+            conn.execute(
+                "DELETE FROM events WHERE job_id IN "
+                "(SELECT id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?)", (old,)
+            )
+            conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (old,))
+            conn.execute("DELETE FROM dependencies WHERE job_id NOT IN (SELECT id FROM jobs)")
+            conn.execute("DELETE FROM workers WHERE heartbeat < ?", (old,))
+            conn.execute("DELETE FROM worker_metrics WHERE id NOT IN (SELECT id FROM workers)")
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, cleanup, snapshot, client, cost, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, JOB_QUEUED, payload, cleanup, json.dumps(snapshot), client_id, cost,
+                 snapshot["created_at"])
+            )
+            conn.executemany("INSERT OR IGNORE INTO dependencies (job_id, after_id) VALUES (?, ?)",
+                             [(job_id, after_id) for after_id in after or ()])
+
+    def claim(self, worker_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._transaction() as conn:
+                # Sin dependencias pendientes (una que ya no existe había
+                # terminado), por coste en curso del cliente y su último
+                # trabajo empezado
+                row = conn.execute(
+                    "SELECT id, payload, snapshot, cleanup FROM jobs AS queued WHERE status = ? "
+                    "AND NOT EXISTS (SELECT 1 FROM dependencies JOIN jobs AS dependency "
+                    "                ON dependency.id = dependencies.after_id "
+                    "                WHERE dependencies.job_id = queued.id AND dependency.status IN (?, ?)) "
+                    "ORDER BY (SELECT COALESCE(SUM(cost), 0) FROM jobs "
+                    "          WHERE status = ? AND client IS queued.client), "
+                    "(SELECT COALESCE(MAX(started_at), 0) FROM jobs "
+                    " WHERE status = ? AND client IS queued.client), "
+                    "created_at LIMIT 1", (JOB_QUEUED, JOB_QUEUED, JOB_RUNNING, JOB_RUNNING, JOB_RUNNING)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, payload = NULL, started_at = ? "
+                        "WHERE id = ?", (JOB_RUNNING, worker_id, time.time(), row[0])
+                    )
+                    return row[0], row[1], json.loads(row[2]), row[3]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_seconds)
+
+    def update(self, job_id, snapshot, events, replaces=None):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[0] in FINISHED_STATES:
+                return False
+            if replaces is not None:
+                conn.execute("DELETE FROM events WHERE job_id = ? AND id = ?", (job_id, replaces))
+            conn.executemany(
+                "INSERT OR REPLACE INTO events (job_id, id, data) VALUES (?, ?, ?)",
+                [(job_id, event["id"], json.dumps(event, default=str)) for event in events]
+            )
+            conn.execute(
+                "DELETE FROM events WHERE job_id = ? AND id <= ?",
+                (job_id, events[-1]["id"] - MAX_JOB_EVENTS)
+            )
+            finished = snapshot["status"] in FINISHED_STATES
+            conn.execute(
+                "UPDATE jobs SET status = ?, snapshot = ?, finished_at = ?, "
+                "cleanup = CASE WHEN ? THEN NULL ELSE cleanup END WHERE id = ?",
+                (snapshot["status"], json.dumps(snapshot, default=str), snapshot.get("finished_at"),
+                 finished, job_id)
+            )
+            return True
+
+    def snapshot(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT snapshot FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def events_since(self, job_id, event_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM events WHERE job_id = ? AND id > ? ORDER BY id", (job_id, event_id)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def request_cancel(self, job_id):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT status, snapshot, cleanup FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            status, snapshot, cleanup = row[0], json.loads(row[1]), row[2]
+            if status in FINISHED_STATES:
+                return snapshot, None
+            if status == JOB_QUEUED:
+                snapshot, event = finished_snapshot(snapshot, JOB_CANCELLED)
+                conn.execute(
+                    "INSERT INTO events (job_id, id, data) VALUES (?, ?, ?)",
+                    (job_id, event["id"], json.dumps(event))
+                )
+                conn.execute(
+                    "UPDATE jobs SET status = ?, snapshot = ?, cancel = 1, payload = NULL, "
+                    "cleanup = NULL, finished_at = ? WHERE id = ?",
+                    (JOB_CANCELLED, json.dumps(snapshot), snapshot["finished_at"], job_id)
+                )
+                return snapshot, cleanup
+            conn.execute("UPDATE jobs SET cancel = 1 WHERE id = ?", (job_id,))
+            return {**snapshot, "cancel_requested": True}, None
+
+    def cancel_requested(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT cancel FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def claimed_cleanup(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cleanup FROM jobs WHERE id = ? AND status = ?", (job_id, JOB_RUNNING)
+            ).fetchone()
+        return row[0] if row else None
+
+    def heartbeat(self, worker_id, metrics=None):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (id, heartbeat) VALUES (?, ?)", (worker_id, time.time())
+            )
+            if metrics is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO worker_metrics (id, data) VALUES (?, ?)",
+                    (worker_id, json.dumps(metrics))
+                )
+
+    def remove_worker(self, worker_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+            conn.execute("DELETE FROM worker_metrics WHERE id = ?", (worker_id,))
+
+    def worker_metrics(self, worker_timeout):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT worker_metrics.id, worker_metrics.data FROM worker_metrics "
+                "JOIN workers ON workers.id = worker_metrics.id WHERE workers.heartbeat >= ?",
+                (time.time() - worker_timeout,)
+            ).fetchall()
+        return {worker_id: json.loads(data) for worker_id, data in rows}
+
+    def stale_running(self, worker_timeout):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT jobs.id FROM jobs LEFT JOIN workers ON jobs.worker = workers.id "
+                "WHERE jobs.status = ? AND (workers.heartbeat IS NULL OR workers.heartbeat < ?)",
+                (JOB_RUNNING, time.time() - worker_timeout)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self, worker_timeout):
+        with self._lock:
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE status IN (?, ?) GROUP BY status",
+                (JOB_QUEUED, JOB_RUNNING)
+            ).fetchall())
+            workers = self._conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat >= ?", (time.time() - worker_timeout,)
+            ).fetchone()[0]
+        return {
+            "workers": workers,
+            "queued": counts.get(JOB_QUEUED, 0),
+            "running": counts.get(JOB_RUNNING, 0),
+        }
+
+    def add_reservation(self, reservation, check):
+        with self._transaction() as conn:
+            check([json.loads(row[0]) for row in conn.execute("SELECT data FROM reservations")])
+            conn.execute("INSERT INTO reservations (id, data) VALUES (?, ?)",
+                         (reservation["id"], json.dumps(reservation)))
+
+    def attach_reservation(self, reservation_id, job_id):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM reservations WHERE id = ?", (reservation_id,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE reservations SET data = ? WHERE id = ?",
+                             (json.dumps({**json.loads(row[0]), "job_id": job_id}), reservation_id))
+
+    def remove_reservation(self, reservation_id):
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,)).rowcount > 0
+
+    def reservations(self):
+        with self._lock:
+            return [json.loads(row[0]) for row in self._conn.execute("SELECT data FROM reservations")]
+
+
+class RedisBroker(Broker):
+    """Cola en Redis para repartir los trabajos entre varias máquinas.
+
+    Cada cliente tiene su cola (un conjunto ordenado por fecha de creación) y
+    el coste en curso de cada uno se lleva en un hash, así un worker elige el
+    cliente como la cola en proceso. Los trabajos con dependencias esperan en
+    un conjunto aparte y pasan a la cola de su cliente cuando estas terminan.
+    Los eventos de cada trabajo son un
+    conjunto ordenado por su id, así un progreso fusionado se sustituye por id
+    aunque detrás se haya añadido otro evento. `client` permite pasar un cliente ya creado (p. ej.
+    `fakeredis.FakeRedis()` en pruebas locales).
+    """
+
+    def __init__(self, url: str = None, client=None, prefix: str = "transcription",
+                 retention_seconds: float = 3600, poll_seconds: float = 0.2):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("BROKER_URL con Redis requiere instalar el cliente: pip install redis")
+            client = redis.Redis.from_url(url)
+        self.redis = client
+        self.prefix = prefix
+        self.retention_seconds = retention_seconds
+        self.poll_seconds = poll_seconds
+
+    def _key(self, *parts: str) -> str:
+        return ":".join((self.prefix,) + parts)
+
+    def _transact(self, job_id: str, func: Callable):
+        """Ejecuta `func(pipe, job)` con WATCH sobre el trabajo y reintenta si
+        otro proceso lo modificó entre la lectura y la escritura"""
+        from redis.exceptions import WatchError
+
+        key = self._key("job", job_id)
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    job = {k.decode(): v for k, v in pipe.hgetall(key).items()}
+                    return func(pipe, job)
+                except WatchError:
+                    continue
+
+    def enqueue(self, job_id, kind, payload, snapshot, cleanup, client_id=None, cost=1.0, after=None):
+        client = client_id or ""
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key("job", job_id), mapping={
+            "kind": kind, "status": JOB_QUEUED, "payload": payload, "cleanup": cleanup,
+            "snapshot": json.dumps(snapshot), "cancel": 0, "client": client, "cost": cost,
+            "after": json.dumps(after or []),
+        })
+        if after:
+            pipe.sadd(self._key("blocked"), job_id)
+        else:
+            pipe.zadd(self._key("queue", client), {job_id: snapshot["created_at"]})
+            pipe.sadd(self._key("clients"), client)
+        pipe.execute()
+
+    def _release_blocked(self):
+        """Pasa a la cola de su cliente los trabajos cuyas dependencias ya
+        terminaron (una que ya no existe había caducado tras terminar)"""
+        blocked_key = self._key("blocked")
+        for job_id in self.redis.smembers(blocked_key):
+            job_id = job_id.decode()
+            after = json.loads(self.redis.hget(self._key("job", job_id), "after") or "[]")
+            pipe = self.redis.pipeline(transaction=False)
+            for after_id in after:
+                pipe.hget(self._key("job", after_id), "status")
+            if any(status is not None and status.decode() not in FINISHED_STATES
+                   for status in pipe.execute()):
+                continue
+
+            def release(pipe, job):
+                pipe.multi()
+                pipe.srem(blocked_key, job_id)
+                if job and job["status"].decode() == JOB_QUEUED:
+                    client = job["client"].decode()
+                    pipe.zadd(self._key("queue", client), {job_id: json.loads(job["snapshot"])["created_at"]})
+                    pipe.sadd(self._key("clients"), client)
+                pipe.execute()
+
+            self._transact(job_id, release)
+
+    def _claim_next(self, worker_id: str):
+        """Reserva el trabajo más antiguo del cliente con menos coste en curso
+        (o None si no hay ninguno). Reintenta si otro worker cambió las colas
+        entre la elección y la reserva."""
+        from redis.exceptions import WatchError
+
+        clients_key, cost_key, started_key = (
+            self._key("clients"), self._key("client_cost"), self._key("client_started")
+        )
+        self._release_blocked()
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(clients_key, cost_key, started_key)
+                    costs = pipe.hgetall(cost_key)
+                    started = pipe.hgetall(started_key)
+                    best = None
+                    for client in pipe.smembers(clients_key):
+                        head = pipe.zrange(self._key("queue", client.decode()), 0, 0, withscores=True)
+                        if not head:
+                            continue
+                        order = (round(float(costs.get(client, 0)), 6), float(started.get(client, 0)), head[0][1])
+                        if best is None or order < best[0]:
+                            best = order, client.decode(), head[0][0].decode()
+                    if best is None:
+                        pipe.unwatch()
+                        return None
+
+                    _, client, job_id = best
+                    key, queue_key = self._key("job", job_id), self._key("queue", client)
+                    pipe.watch(key, queue_key)
+                    job = {k.decode(): v for k, v in pipe.hgetall(key).items()}
+                    last = pipe.zcard(queue_key) == 1
+                    pipe.multi()
+                    pipe.zrem(queue_key, job_id)
+                    if last:
+                        pipe.srem(clients_key, client)
+                    if job.get("status", b"").decode() != JOB_QUEUED:
+                        # Ya no está en cola (caducó): se descarta y se elige otro
+                        pipe.execute()
+                        continue
+                    pipe.hset(key, mapping={"status": JOB_RUNNING, "worker": worker_id})
+                    pipe.hdel(key, "payload")
+                    pipe.sadd(self._key("running"), job_id)
+                    pipe.hincrbyfloat(cost_key, client, float(job.get("cost", 1)))
+                    pipe.hset(started_key, client, time.time())
+                    pipe.execute()
+                    return job_id, job["payload"], json.loads(job["snapshot"]), job.get("cleanup")
+                except WatchError:
+                    continue
+
+    def claim(self, worker_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            claimed = self._claim_next(worker_id)
+            if claimed is not None:
+                return claimed
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(self.poll_seconds)
+
+    def update(self, job_id, snapshot, events, replaces=None):
+        key, events_key = self._key("job", job_id), self._key("events", job_id)
+        cost_key = self._key("client_cost")
+
+        def write(pipe, job):
+            if not job or job["status"].decode() in FINISHED_STATES:
+                pipe.unwatch()
+                return False
+            release = job["status"].decode() == JOB_RUNNING and snapshot["status"] in FINISHED_STATES
+            if release:
+                # El coste en curso del cliente deja de contar al terminar
+                client = job.get("client", b"").decode()
+                pipe.watch(cost_key)
+                remaining = float(pipe.hget(cost_key, client) or 0) - float(job.get("cost", 1))
+            pipe.multi()
+            if replaces is not None:
+                pipe.zremrangebyscore(events_key, replaces, replaces)
+            pipe.zadd(events_key, {json.dumps(event, default=str): event["id"] for event in events})
+            pipe.zremrangebyrank(events_key, 0, -MAX_JOB_EVENTS - 1)
+            pipe.hset(key, mapping={"status": snapshot["status"], "snapshot": json.dumps(snapshot, default=str)})
+            if release:
+                if remaining > 1e-6:
+                    pipe.hset(cost_key, client, remaining)
+                else:
+                    pipe.hdel(cost_key, client)
+            if snapshot["status"] in FINISHED_STATES:
+                pipe.hdel(key, "cleanup")
+                pipe.srem(self._key("running"), job_id)
+                pipe.expire(key, int(self.retention_seconds))
+                pipe.expire(events_key, int(self.retention_seconds))
+            pipe.execute()
+            return True
+
+        return self._transact(job_id, write)
+
+    def snapshot(self, job_id):
+        data = self.redis.hget(self._key("job", job_id), "snapshot")
+        return json.loads(data) if data else None
+
+    def events_since(self, job_id, event_id):
+        items = self.redis.zrangebyscore(self._key("events", job_id), f"({event_id}", "+inf")
+        return [json.loads(item) for item in items]
+
+    def request_cancel(self, job_id):
+        key, events_key = self._key("job", job_id), self._key("events", job_id)
+
+        def cancel(pipe, job):
+            if not job:
+                pipe.unwatch()
+                return None, None
+            status, snapshot = job["status"].decode(), json.loads(job["snapshot"])
+            if status in FINISHED_STATES:
+                pipe.unwatch()
+                return snapshot, None
+            if status == JOB_QUEUED:
+                client = job.get("client", b"").decode()
+                queue_key = self._key("queue", client)
+                pipe.watch(queue_key)
+                # Uno que espera a sus dependencias aún no está en la cola
+                last = pipe.zscore(queue_key, job_id) is not None and pipe.zcard(queue_key) == 1
+                pipe.multi()
+                snapshot, event = finished_snapshot(snapshot, JOB_CANCELLED)
+                pipe.hset(key, mapping={"status": JOB_CANCELLED, "snapshot": json.dumps(snapshot), "cancel": 1})
+                pipe.hdel(key, "payload", "cleanup")
+                pipe.zadd(events_key, {json.dumps(event): event["id"]})
+                pipe.zrem(queue_key, job_id)
+                pipe.srem(self._key("blocked"), job_id)
+                if last:
+                    pipe.srem(self._key("clients"), client)
+                pipe.expire(key, int(self.retention_seconds))
+                pipe.expire(events_key, int(self.retention_seconds))
+                pipe.execute()
+                return snapshot, job.get("cleanup")
+            pipe.multi()
+            pipe.hset(key, "cancel", 1)
+            pipe.execute()
+            return {**snapshot, "cancel_requested": True}, None
+
+        return self._transact(job_id, cancel)
+
+    def cancel_requested(self, job_id):
+        return self.redis.hget(self._key("job", job_id), "cancel") == b"1"
+
+    def claimed_cleanup(self, job_id):
+        status, cleanup = self.redis.hmget(self._key("job", job_id), "status", "cleanup")
+        return cleanup if status == JOB_RUNNING.encode() else None
+
+    def heartbeat(self, worker_id, metrics=None):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key("workers"), worker_id, time.time())
+        if metrics is not None:
+            pipe.hset(self._key("worker_metrics"), worker_id, json.dumps(metrics))
+        pipe.execute()
+
+    def remove_worker(self, worker_id):
+        pipe = self.redis.pipeline()
+        pipe.hdel(self._key("workers"), worker_id)
+        pipe.hdel(self._key("worker_metrics"), worker_id)
+        pipe.execute()
+
+    def worker_metrics(self, worker_timeout):
+        heartbeats = self.redis.hgetall(self._key("workers"))
+        limit = time.time() - worker_timeout
+        return {
+            worker.decode(): json.loads(data)
+            for worker, data in self.redis.hgetall(self._key("worker_metrics")).items()
+            if float(heartbeats.get(worker, 0)) >= limit
+        }
+
+    def stale_running(self, worker_timeout):
+        heartbeats = {k.decode(): float(v) for k, v in self.redis.hgetall(self._key("workers")).items()}
+        limit = time.time() - worker_timeout
+        stale = []
+        for job_id in self.redis.smembers(self._key("running")):
+            job_id = job_id.decode()
+            worker = self.redis.hget(self._key("job", job_id), "worker")
+            if worker is None or heartbeats.get(worker.decode(), 0) < limit:
+                stale.append(job_id)
+        return stale
+
+    def stats(self, worker_timeout):
+        heartbeats = self.redis.hgetall(self._key("workers"))
+        now = time.time()
+        old = [worker for worker, beat in heartbeats.items() if float(beat) < now - self.retention_seconds]
+        if old:
+            self.redis.hdel(self._key("workers"), *old)
+            self.redis.hdel(self._key("worker_metrics"), *old)
+        return {
+            "workers": sum(1 for beat in heartbeats.values() if float(beat) >= now - worker_timeout),
+            "queued": self.redis.scard(self._key("blocked")) + sum(
+                self.redis.zcard(self._key("queue", client.decode()))
+                for client in self.redis.smembers(self._key("clients"))
+            ),
+            "running": self.redis.scard(self._key("running")),
+        }
+
+    def add_reservation(self, reservation, check):
+        from redis.exceptions import WatchError
+
+        key = self._key("reservations")
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    check([json.loads(data) for data in pipe.hvals(key)])
+                    pipe.multi()
+                    pipe.hset(key, reservation["id"], json.dumps(reservation))
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def attach_reservation(self, reservation_id, job_id):
+        from redis.exceptions import WatchError
+
+        key = self._key("reservations")
+        with self.redis.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    data = pipe.hget(key, reservation_id)
+                    if data is None:
+                        pipe.unwatch()
+                        return
+                    pipe.multi()
+                    pipe.hset(key, reservation_id, json.dumps({**json.loads(data), "job_id": job_id}))
+                    pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    def remove_reservation(self, reservation_id):
+        return self.redis.hdel(self._key("reservations"), reservation_id) > 0
+
+    def reservations(self):
+        return [json.loads(data) for data in self.redis.hvals(self._key("reservations"))]
+
+
+def create_broker(url: str) -> Broker:
+    if url.startswith("sqlite:///"):
+        return SQLiteBroker(Path(url[len("sqlite:///"):]))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    raise ValueError(f"BROKER_URL no soportada: '{url}' (usa sqlite:///ruta o redis://host)")
+
+
+class RemoteJob:
+    """Trabajo guardado en el broker, con la parte de la interfaz de Job que
+    usan los endpoints"""
+
+    def __init__(self, broker: Broker, snapshot: dict):
+        self._broker = broker
+        self._snapshot = snapshot
+        self.id = snapshot["job_id"]
+        self.kind = snapshot["kind"]
+        self.status = snapshot["status"]
+        self.result = snapshot.get("result")
+        self.error = snapshot.get("error")
+        self.last_event_id = snapshot.get("last_event_id", 0)
+
+    def to_dict(self):
+        return {key: value for key, value in self._snapshot.items() if key != "last_event_id"}
+
+    def events_since(self, event_id: int) -> List[dict]:
+        return self._broker.events_since(self.id, event_id)
+
+
+class BrokerJobQueue:
+    """Misma interfaz que JobQueue, pero los trabajos los ejecutan los workers"""
+
+    def __init__(self, broker: Broker, worker_timeout: float = 30):
+        self.broker = broker
+        self.worker_timeout = worker_timeout
+        self._stats: Optional[dict] = None
+        self._stats_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def max_workers(self):
+        # Workers vivos (cada uno ejecuta varios trabajos a la vez)
+        return self.stats()["workers"]
+
+    def submit(self, kind: str, func: Callable, *args,
+               cleanup: Optional[Callable[[], None]] = None,
+               timings: Optional[Dict[str, float]] = None,
+               client_id: Optional[str] = None, cost: float = 1.0,
+               after: Optional[List[str]] = None, **kwargs) -> RemoteJob:
+        """Encola el trabajo en el broker. Los workers reparten los trabajos
+        entre clientes como `JobQueue`: según `client_id` y el `cost` que ya
+        tiene cada uno en curso. Con `after` espera a que terminen esos
+        trabajos."""
+        job = Job(id=uuid.uuid4().hex, kind=kind)
+        for stage, seconds in (timings or {}).items():
+            job.record_timing(stage, seconds)
+        snapshot = {**job.to_dict(), "last_event_id": 0}
+        self.broker.enqueue(job.id, kind, dumps_task(func, args, kwargs), snapshot, dumps_cleanup(cleanup),
+                            client_id=client_id, cost=cost, after=after)
+        return RemoteJob(self.broker, snapshot)
+
+    def get(self, job_id: str) -> Optional[RemoteJob]:
+        snapshot = self.broker.snapshot(job_id)
+        return RemoteJob(self.broker, snapshot) if snapshot else None
+
+    def cancel(self, job_id: str) -> Optional[RemoteJob]:
+        snapshot, cleanup = self.broker.request_cancel(job_id)
+        if snapshot is None:
+            return None
+        job = RemoteJob(self.broker, snapshot)
+        if cleanup is not None:
+            # Cancelado en cola: ningún worker lo verá, se limpia aquí
+            JOBS_FINISHED.inc(kind=job.kind, status=JOB_CANCELLED)
+            run_cleanup(job, loads_task(cleanup))
+        return job
+
+    def stats(self):
+        """Estadísticas del broker, reutilizadas durante STATS_CACHE_SECONDS
+        para no consultarlo en cada petición"""
+        with self._lock:
+            now = time.monotonic()
+            if self._stats is None or now - self._stats_at >= STATS_CACHE_SECONDS:
+                self._stats = self.broker.stats(self.worker_timeout)
+                self._stats_at = now
+            return dict(self._stats)
+
+    def worker_metrics(self) -> Dict[str, dict]:
+        return self.broker.worker_metrics(self.worker_timeout)
+
+    def shutdown(self):
+        # Los trabajos siguen en el broker para los workers
+        pass
+
+
+@dataclass
+class BrokeredJob(Job):
+    """Job que ejecuta un worker: los eventos actualizan el estado en el
+    broker y la cancelación se consulta allí.
+
+    Un trabajo puede publicar cientos de progresos o segmentos por segundo:
+    se acumulan y se escriben juntos como mucho cada EVENT_FLUSH_SECONDS (el
+    worker vacía los pendientes aunque no lleguen más), así los workers no
+    se turnan el broker por cada evento. Las etapas y el estado final se
+    escriben al momento.
+    """
+    broker: Any = field(default=None, repr=False)
+    _cancel_polled: float = field(default=0.0, repr=False)
+    # Último evento escrito en el broker y, si era un progreso, su id (se
+    # sustituye si se fusiona con el siguiente)
+    _flushed_id: int = field(default=0, repr=False)
+    _flushed_progress: Optional[int] = field(default=None, repr=False)
+    _flushed_at: float = field(default=0.0, repr=False)
+    _flush_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def check_cancelled(self):
+        now = time.monotonic()
+        if not self.cancel_event.is_set() and now - self._cancel_polled >= CANCEL_POLL_SECONDS:
+            self._cancel_polled = now
+            if self.broker.cancel_requested(self.id):
+                self.cancel_event.set()
+        super().check_cancelled()
+
+    def publish(self, event_type: str, **data):
+        super().publish(event_type, **data)
+        if (event_type in IMMEDIATE_EVENTS
+                or time.monotonic() - self._flushed_at >= EVENT_FLUSH_SECONDS):
+            self.flush()
+
+    def flush(self):
+        """Escribe en el broker el estado y los eventos aún no enviados"""
+        with self._flush_lock:
+            with self._events_lock:
+                pending = []
+                for event in reversed(self.events):
+                    if event["id"] <= self._flushed_id:
+                        break
+                    pending.append(event)
+                if not pending:
+                    return
+                pending.reverse()
+                # El último progreso enviado ya no está si se fusionó con el
+                # primero de los pendientes
+                previous = len(self.events) - len(pending) - 1
+                replaces = self._flushed_progress
+                if replaces is not None and previous >= 0 and self.events[previous]["id"] == replaces:
+                    replaces = None
+                snapshot = {**self.to_dict(), "last_event_id": self.last_event_id}
+            if not self.broker.update(self.id, snapshot, pending, replaces):
+                # Se cerró fuera del worker (p. ej. se dio por caído): no
+                # tiene sentido seguir ejecutándolo
+                self.cancel_event.set()
+            self._flushed_id = pending[-1]["id"]
+            self._flushed_progress = self._flushed_id if pending[-1]["type"] == "progress" else None
+            self._flushed_at = time.monotonic()
+
+
+class Worker:
+    """Reclama trabajos del broker y los ejecuta con `threads` hilos.
+
+    Da señales de vida cada `heartbeat_seconds`, con las métricas del proceso
+    si se indica `metrics` (p. ej. `REGISTRY.snapshot`); los trabajos de un
+    worker que deja de darlas durante `worker_timeout` se marcan como fallidos.
+    """
+
+    def __init__(self, broker: Broker, resolve_task: Callable[[str], Callable], threads: int = 1,
+                 heartbeat_seconds: float = 5, worker_timeout: float = 30,
+                 metrics: Optional[Callable[[], dict]] = None):
+        self.broker = broker
+        self.resolve_task = resolve_task
+        self.threads = threads
+        self.heartbeat_seconds = heartbeat_seconds
+        self.worker_timeout = worker_timeout
+        self.metrics = metrics
+        self.id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        # Trabajos en curso, para escribir sus eventos pendientes
+        self._running: Dict[str, BrokeredJob] = {}
+        self._running_lock = threading.Lock()
+
+    def run(self):
+        """Bloquea hasta `stop()`; los trabajos en curso terminan antes de salir"""
+        self._heartbeat()
+        logger.info("Worker %s iniciado con %s hilos", self.id, self.threads)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name="worker-heartbeat", daemon=True)
+        heartbeat.start()
+        flusher = threading.Thread(target=self._flush_loop, name="worker-events", daemon=True)
+        flusher.start()
+        loops = [
+            threading.Thread(target=self._loop, name=f"job-worker-{index}")
+            for index in range(self.threads)
+        ]
+        for thread in loops:
+            thread.start()
+        for thread in loops:
+            thread.join()
+        self._done.set()
+        self.broker.remove_worker(self.id)
+        logger.info("Worker %s detenido", self.id)
+
+    def stop(self):
+        self._stop.set()
+
+    def _heartbeat(self):
+        self.broker.heartbeat(self.id, self.metrics() if self.metrics else None)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            try:
+                self._heartbeat()
+                self.broker.fail_orphaned(self.worker_timeout)
+            except Exception as e:
+                logger.error("Error enviando señal de vida al broker: %s", e)
+
+    def _flush_loop(self):
+        while not self._done.wait(EVENT_FLUSH_SECONDS):
+            with self._running_lock:
+                jobs = list(self._running.values())
+            for job in jobs:
+                try:
+                    job.flush()
+                except Exception as e:
+                    logger.error("Error escribiendo los eventos del trabajo %s: %s", job.id, e)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.broker.claim(self.id, timeout=1.0)
+            except Exception as e:
+                logger.error("Error leyendo del broker: %s", e)
+                self._stop.wait(1.0)
+                continue
+            if claimed is not None:
+                self._execute(*claimed)
+
+    def _execute(self, job_id: str, payload: bytes, snapshot: dict, cleanup: bytes):
+        job = BrokeredJob(
+            id=job_id, kind=snapshot["kind"], created_at=snapshot["created_at"], broker=self.broker
+        )
+        # Tiempos medidos en la API (subida): ya están en sus métricas
+        job.timings = dict(snapshot.get("timings") or {})
+        job.mark_running()
+        try:
+            cleanup = loads_task(cleanup)
+            task_name, args, kwargs = loads_task(payload)
+            func = self.resolve_task(task_name)
+        except Exception as e:
+            logger.exception("No se pudo leer el trabajo %s", job_id)
+            job.status = job.stage = JOB_FAILED
+            job.error = f"No se pudo leer el trabajo: {e}"
+            job.error_status = 500
+            job.finished_at = time.time()
+            job.publish("status", status=JOB_FAILED, error=job.error, error_status=500)
+            if callable(cleanup):
+                run_cleanup(job, cleanup)
+            return
+        with self._running_lock:
+            self._running[job_id] = job
+        try:
+            execute_job(job, func, args, kwargs, cleanup)
+        finally:
+            with self._running_lock:
+                del self._running[job_id]
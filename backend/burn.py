@@ -0,0 +1,73 @@
+"""Quemado de subtítulos en paralelo: el video se divide en piezas por
+keyframes (sin recodificar), cada pieza se codifica por separado y se unen
+con el demuxer concat, también sin recodificar."""
+import os
+import subprocess
+from dataclasses import dataclass
+from typing import List, Sequence
+
+from fastapi import HTTPException
+
+
+@dataclass(frozen=True)
+class VideoPiece:
+    path: str
+    # Posición de la pieza en el video original (segundos)
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+def split_at_keyframes(video_path: str, piece_seconds: float, work_dir: str) -> List[VideoPiece]:
+    """Divide el video (solo la pista de video) en piezas de ~piece_seconds.
+
+    El muxer segment con `-c copy` solo puede cortar en keyframes, así que
+    cada pieza empieza en el primer keyframe tras su corte nominal.
+    """
+    list_path = os.path.join(work_dir, "pieces.csv")
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-i', video_path,
+        '-map', '0:v:0', '-c', 'copy', '-f', 'segment',
+        '-segment_time', f"{piece_seconds:.3f}", '-reset_timestamps', '1',
+        '-segment_list', list_path, '-segment_list_type', 'csv',
+        '-y', os.path.join(work_dir, "piece_%04d.mkv")
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error dividiendo el video en piezas: {result.stderr}"
+        )
+
+    pieces = []
+    with open(list_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            # Formato: nombre,inicio,fin
+            name, start, end = line.strip().rsplit(',', 2)
+            pieces.append(VideoPiece(os.path.join(work_dir, name), float(start), float(end)))
+    return pieces
+
+
+def concat_pieces(piece_paths: List[str], audio_source: str, output_path: str, work_dir: str,
+                  output_args: Sequence[str] = ()):
+    """Une las piezas codificadas y añade el audio original, todo con `-c copy`"""
+    list_path = os.path.join(work_dir, "concat.txt")
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in piece_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin',
+        '-f', 'concat', '-safe', '0', '-i', list_path, '-i', audio_source,
+        '-map', '0:v', '-map', '1:a?', '-c', 'copy', *output_args, '-y', output_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error uniendo las piezas del video: {result.stderr}"
+        )
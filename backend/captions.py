@@ -0,0 +1,317 @@
+"""Subtítulos: división de los segmentos de Whisper en cues cortos y lectura
+y escritura de archivos VTT"""
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Máximo de palabras por subtítulo en los VTT generados
+MAX_WORDS_PER_CUE = 5
+
+# Subtítulos que se calculan y formatean de una vez (tiempos en arrays de NumPy)
+CUE_BATCH_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class CueLimits:
+    """Tamaño máximo de cada subtítulo (0 = sin límite en caracteres/duración)"""
+    max_words: int = MAX_WORDS_PER_CUE
+    max_chars: int = 0
+    max_duration: float = 0.0
+
+
+def interpolate_words(segment: dict) -> List[dict]:
+    """Reparte la duración del segmento entre sus palabras en proporción a su
+    posición. Se usa cuando Whisper no devolvió marcas de tiempo por palabra."""
+    start_time_seconds = segment['start']
+    end_time_seconds = segment['end']
+    words = segment['text'].split()
+    segment_duration = end_time_seconds - start_time_seconds
+    total_words = len(words)
+    return [
+        {
+            "word": (" " if i else "") + word,
+            "start": start_time_seconds + (i / total_words) * segment_duration,
+            "end": start_time_seconds + ((i + 1) / total_words) * segment_duration,
+        }
+        for i, word in enumerate(words)
+    ]
+
+
+def group_words(words: List[dict], limits: CueLimits) -> List[Tuple[float, float, str]]:
+    """Agrupa palabras con tiempos en subtítulos que respetan los límites.
+
+    Una palabra sola que ya supera un límite forma su propio subtítulo.
+    """
+    cues = []
+    current = []
+    # Texto del subtítulo en curso, solo si hay límite de caracteres
+    text = ''
+    for word in words:
+        if current:
+            if limits.max_chars:
+                text += word['word']
+            if (len(current) >= limits.max_words
+                    or (limits.max_chars and len(text.strip()) > limits.max_chars)
+                    or (limits.max_duration and word['end'] - current[0]['start'] > limits.max_duration)):
+                cues.append(_words_cue(current))
+                current = []
+                text = word['word']
+        else:
+            text = word['word']
+        current.append(word)
+    if current:
+        cues.append(_words_cue(current))
+    return cues
+
+
+def _words_cue(words: List[dict]) -> Tuple[float, float, str]:
+    start = words[0]['start']
+    # Whisper a veces da palabras de duración cero o solapadas
+    end = max(start, max(w['end'] for w in words))
+    return start, end, ''.join(w['word'] for w in words).strip()
+
+
+def segment_cues(segment: dict, max_words: int = MAX_WORDS_PER_CUE,
+                 limits: Optional[CueLimits] = None) -> List[Tuple[float, float, str]]:
+    """Divide un segmento en subtítulos (inicio, fin, texto).
+
+    Si el segmento trae marcas de tiempo por palabra (`word_timestamps`) los
+    cortes caen en los límites reales de las palabras; si no, la duración se
+    reparte en proporción al número de palabras.
+    """
+    limits = limits or CueLimits(max_words=max_words)
+    words = segment.get('words')
+    if words:
+        return group_words(words, limits)
+
+    text = segment['text'].strip()
+    # Si el segmento cabe en un subtítulo, mantenerlo como está
+    if (len(text.split()) <= limits.max_words
+            and not (limits.max_chars and len(text) > limits.max_chars)
+            and not (limits.max_duration and segment['end'] - segment['start'] > limits.max_duration)):
+        return [(segment['start'], segment['end'], text)]
+    return group_words(interpolate_words(segment), limits)
+
+
+def iter_cue_batches(segments: Iterable[dict], limits: CueLimits,
+                     batch_size: int = CUE_BATCH_SIZE) -> Iterator[Tuple[np.ndarray, np.ndarray, List[str]]]:
+    """Divide los segmentos en subtítulos por lotes de unos `batch_size`
+    segmentos: (inicios, finales, textos) con los tiempos en arrays.
+
+    Los segmentos sin marcas por palabra y con solo el límite de palabras
+    (el caso habitual) se reparten en bloque con NumPy; el resto pasa por
+    `segment_cues`. Consume los segmentos de uno en uno, así la memoria no
+    depende de la duración de la transcripción. Los segmentos sin texto no
+    dan subtítulos (un subtítulo vacío no es válido en VTT ni en SRT).
+    """
+    batch = []
+    for segment in segments:
+        batch.append(segment)
+        if len(batch) >= batch_size:
+            yield _batch_cues(batch, limits)
+            batch = []
+    if batch:
+        yield _batch_cues(batch, limits)
+
+
+def _batch_cues(segments: List[dict], limits: CueLimits) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    max_words = max(limits.max_words, 1)
+    evenly = not (limits.max_chars or limits.max_duration)
+    starts, ends, texts = [], [], []
+    # Segmentos consecutivos que se reparten en bloque: (inicio, fin, texto, palabras)
+    run = []
+
+    def flush_run():
+        if run:
+            run_starts, run_ends, run_texts = _split_evenly(run, max_words)
+            starts.append(run_starts)
+            ends.append(run_ends)
+            texts.extend(run_texts)
+            run.clear()
+
+    for segment in segments:
+        if evenly and not segment.get('words'):
+            text = segment['text'].strip()
+            if text:
+                run.append((segment['start'], segment['end'], text, text.split()))
+            continue
+        flush_run()
+        cues = [cue for cue in segment_cues(segment, limits=limits) if cue[2]]
+        starts.append(np.array([cue[0] for cue in cues], dtype=np.float64))
+        ends.append(np.array([cue[1] for cue in cues], dtype=np.float64))
+        texts.extend(cue[2] for cue in cues)
+    flush_run()
+    if not starts:
+        return np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.float64), texts
+    return np.concatenate(starts), np.concatenate(ends), texts
+
+
+def _split_evenly(run: List[tuple], max_words: int) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """Mismos subtítulos que `segment_cues` con solo el límite de palabras:
+    bloques de `max_words` palabras con la duración repartida por palabra"""
+    segment_starts = np.array([item[0] for item in run], dtype=np.float64)
+    segment_ends = np.array([item[1] for item in run], dtype=np.float64)
+    word_counts = np.array([len(item[3]) for item in run], dtype=np.int64)
+    cue_counts = np.maximum(-(-word_counts // max_words), 1)
+
+    # Índice del segmento y posición dentro de él de cada subtítulo
+    owner = np.repeat(np.arange(len(run)), cue_counts)
+    position = np.arange(len(owner)) - np.repeat(np.cumsum(cue_counts) - cue_counts, cue_counts)
+    first = position * max_words
+    total = word_counts[owner]
+    last = np.minimum(first + max_words, total)
+    start = segment_starts[owner]
+    duration = (segment_ends - segment_starts)[owner]
+    divisor = np.maximum(total, 1)
+    # Los segmentos que caben en un subtítulo conservan sus tiempos y su texto
+    single = cue_counts[owner] == 1
+    cue_starts = np.where(single, start, start + (first / divisor) * duration)
+    cue_ends = np.where(single, segment_ends[owner], start + (last / divisor) * duration)
+
+    texts = []
+    for segment_index, cue_first, cue_last, alone in zip(
+            owner.tolist(), first.tolist(), last.tolist(), single.tolist()):
+        item = run[segment_index]
+        texts.append(item[2] if alone else ' '.join(item[3][cue_first:cue_last]))
+    return cue_starts, cue_ends, texts
+
+
+# Tablas para formatear sin aritmética por subtítulo: "MM:SS" de 0 a 3599
+# segundos y los milisegundos con su separador
+_MINUTES_SECONDS = [f"{value // 60:02d}:{value % 60:02d}" for value in range(3600)]
+_MILLISECONDS = {
+    separator: [f"{separator}{value:03d}" for value in range(1000)] for separator in ".,"
+}
+
+
+def format_timestamp(seconds, separator: str = "."):
+    """Convierte segundos a formato VTT (HH:MM:SS.mmm)"""
+    hours, milliseconds = divmod(max(int(round(seconds * 1000)), 0), 3600000)
+    minutes_seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:" + _MINUTES_SECONDS[minutes_seconds] + _MILLISECONDS[separator][milliseconds]
+
+
+def format_timestamps(seconds: np.ndarray, separator: str = ".") -> List[str]:
+    """Formatea un array de segundos como HH:MM:SS.mmm (o HH:MM:SS,mmm para SRT).
+
+    Se redondea a milisegundos enteros y se descompone con operaciones de
+    NumPy sobre todo el array; cada texto se arma con tablas precalculadas.
+    """
+    milliseconds = np.maximum(np.rint(np.asarray(seconds, dtype=np.float64) * 1000), 0).astype(np.int64)
+    hours, milliseconds = np.divmod(milliseconds, 3600000)
+    minutes_seconds, milliseconds = np.divmod(milliseconds, 1000)
+    hour_texts = [f"{value:02d}:" for value in range(int(hours.max(initial=0)) + 1)]
+    fractions = _MILLISECONDS[separator]
+    return [
+        hour_texts[hour] + _MINUTES_SECONDS[minute_second] + fractions[millisecond]
+        for hour, minute_second, millisecond in zip(
+            hours.tolist(), minutes_seconds.tolist(), milliseconds.tolist())
+    ]
+
+
+_VTT_TIMING = re.compile(
+    r"((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})\s*-->\s*((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})"
+)
+
+
+def parse_timestamp(value: str) -> float:
+    """Convierte HH:MM:SS.mmm (o MM:SS.mmm) a segundos"""
+    seconds = 0.0
+    for part in value.replace(',', '.').split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+# Tamaño de los trozos en que se leen los VTT
+VTT_READ_CHUNK = 1024 * 1024
+
+_VTT_BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+
+
+def iter_vtt_chunks(vtt_path: str, chunk_size: int = VTT_READ_CHUNK) -> Iterator[str]:
+    """Lee un VTT en trozos de unos `chunk_size` caracteres que terminan en
+    una línea en blanco, así ningún subtítulo queda partido entre dos trozos"""
+    rest = ""
+    with open(vtt_path, 'r', encoding='utf-8-sig') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            buffer = rest + chunk
+            cut = buffer.rfind("\n\n")
+            if cut < 0:
+                rest = buffer
+                continue
+            rest = buffer[cut + 2:]
+            yield buffer[:cut + 2]
+    if rest:
+        yield rest
+
+
+def iter_vtt_cues(vtt_path: str) -> Iterator[Tuple[float, float, str]]:
+    """Lee los subtítulos (inicio, fin, texto) de un archivo VTT por trozos,
+    sin cargar el archivo entero en memoria"""
+    for chunk in iter_vtt_chunks(vtt_path):
+        for block in _VTT_BLOCK_SEPARATOR.split(chunk):
+            lines = block.strip().split('\n')
+            for i, line in enumerate(lines):
+                match = _VTT_TIMING.search(line)
+                if match:
+                    text = '\n'.join(lines[i + 1:]).strip()
+                    if text:
+                        yield parse_timestamp(match.group(1)), parse_timestamp(match.group(2)), text
+                    break
+
+
+# Para contar basta con la flecha y el tiempo final; al empezar por un texto
+# fijo la búsqueda es mucho más rápida que con _VTT_TIMING
+_VTT_ARROW = re.compile(r"-->[ \t]*(?:\d+:)?\d{1,2}:\d{2}[.,]\d{3}")
+
+
+def count_vtt_cues(vtt_path: str) -> int:
+    """Número de líneas de tiempos del VTT, sin analizar cada subtítulo"""
+    return sum(len(_VTT_ARROW.findall(chunk)) for chunk in iter_vtt_chunks(vtt_path))
+
+
+def parse_vtt(vtt_path: str) -> List[Tuple[float, float, str]]:
+    """Lee los subtítulos (inicio, fin, texto) de un archivo VTT"""
+    return list(iter_vtt_cues(vtt_path))
+
+
+def validate_vtt(vtt_path: str) -> int:
+    """Comprueba que el archivo sea un VTT con subtítulos y devuelve cuántos tiene.
+
+    Lanza ValueError si no se puede leer o no contiene ningún subtítulo.
+    """
+    count = 0
+    try:
+        for start, end, _ in iter_vtt_cues(vtt_path):
+            if end < start:
+                raise ValueError(f"El subtítulo {count + 1} del VTT termina antes de empezar")
+            count += 1
+    except UnicodeDecodeError:
+        raise ValueError("El archivo VTT debe estar en UTF-8")
+    if not count:
+        raise ValueError("El archivo VTT no contiene subtítulos")
+    return count
+
+
+def write_vtt(cues: List[Tuple[float, float, str]], output_path: str):
+    """Escribe los subtítulos (inicio, fin, texto) como archivo VTT"""
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write("WEBVTT\n\n")
+        for index, (start, end, text) in enumerate(cues, 1):
+            f.write(f"{index}\n")
+            f.write(f"{format_timestamp(start)} --> {format_timestamp(end)}\n")
+            f.write(f"{text}\n\n")
+
+
+def slice_cues(cues: List[Tuple[float, float, str]], start: float,
+               end: float) -> List[Tuple[float, float, str]]:
+    """Subtítulos que se ven entre `start` y `end`, recortados a ese intervalo
+    y con los tiempos relativos a `start`"""
+    sliced = []
+    for cue_start, cue_end, text in cues:
+        if cue_end <= start or cue_start >= end:
+            continue
+        sliced.append((max(cue_start, start) - start, min(cue_end, end) - start, text))
+    return sliced
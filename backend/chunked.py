@@ -0,0 +1,220 @@
+"""Transcripción en paralelo de audios largos dividiéndolos en fragmentos solapados.
+
+Cada proceso del pool carga el motor de inferencia una sola vez y transcribe
+fragmentos independientes. Los cortes se hacen en silencios cuando es posible
+y los segmentos de las zonas solapadas se deduplican al unir los resultados.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import multiprocessing
+import threading
+from typing import Callable, Iterable, List, Optional
+
+import numpy as np
+
+from media import SAMPLE_RATE
+
+# Ventana usada para medir la energía al buscar silencios (50 ms)
+ENERGY_FRAME = int(0.05 * SAMPLE_RATE)
+
+# Ningún fragmento será más corto que una ventana de Whisper
+MIN_CHUNK_SECONDS = 30
+
+
+@dataclass(frozen=True)
+class AudioChunk:
+    index: int
+    # Rango de muestras que se transcribe (incluye el solapamiento)
+    start: int
+    end: int
+    # Rango cuyos segmentos pertenecen a este fragmento al unir resultados
+    keep_start: int
+    keep_end: int
+
+
+def _frame_energy(audio: np.ndarray) -> np.ndarray:
+    """Energía RMS por ventanas de ENERGY_FRAME muestras"""
+    frames = len(audio) // ENERGY_FRAME
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    framed = audio[:frames * ENERGY_FRAME].reshape(frames, ENERGY_FRAME)
+    return np.sqrt(np.mean(framed * framed, axis=1))
+
+
+def plan_chunks(audio: np.ndarray, chunk_seconds: float, overlap_seconds: float,
+                search_seconds: float) -> List[AudioChunk]:
+    """Divide el audio en fragmentos de ~chunk_seconds cortando en el punto más
+    silencioso dentro de ±search_seconds alrededor de cada corte nominal"""
+    total = len(audio)
+    chunk_samples = int(chunk_seconds * SAMPLE_RATE)
+    if total <= chunk_samples:
+        return [AudioChunk(0, 0, total, 0, total)]
+
+    energy = _frame_energy(audio)
+    search_frames = int(search_seconds * SAMPLE_RATE) // ENERGY_FRAME
+    overlap = int(overlap_seconds * SAMPLE_RATE)
+
+    cuts = [0]
+    while total - cuts[-1] > chunk_samples:
+        nominal = (cuts[-1] + chunk_samples) // ENERGY_FRAME
+        lo = max(cuts[-1] // ENERGY_FRAME + 1, nominal - search_frames)
+        hi = min(len(energy), nominal + search_frames + 1)
+        if hi > lo:
+            cut = (lo + int(np.argmin(energy[lo:hi]))) * ENERGY_FRAME
+        else:
+            cut = nominal * ENERGY_FRAME
+        cuts.append(cut)
+    cuts.append(total)
+
+    return [
+        AudioChunk(
+            index=i,
+            start=max(0, keep_start - overlap),
+            end=min(total, keep_end + overlap),
+            keep_start=keep_start,
+            keep_end=keep_end,
+        )
+        for i, (keep_start, keep_end) in enumerate(zip(cuts[:-1], cuts[1:]))
+    ]
+
+
+def merge_chunk_results(chunks: List[AudioChunk], results: Iterable[dict],
+                        on_segment: Optional[Callable[[dict], None]] = None) -> dict:
+    """Une los resultados de cada fragmento en la línea de tiempo original.
+
+    Cada segmento se asigna al fragmento en cuyo rango `keep` cae su punto
+    medio, así lo que se transcribió dos veces en el solapamiento aparece una
+    sola vez. `results` puede ser un iterador: los segmentos de cada fragmento
+    se entregan a `on_segment` en cuanto ese fragmento y los anteriores están
+    listos.
+    """
+    segments = []
+    collected = []
+    last_end = 0.0
+    for chunk, result in zip(chunks, results):
+        collected.append(result)
+        offset = chunk.start / SAMPLE_RATE
+        keep_start = chunk.keep_start / SAMPLE_RATE
+        keep_end = chunk.keep_end / SAMPLE_RATE
+        is_last = chunk is chunks[-1]
+
+        for segment in result.get('segments', []):
+            start = segment['start'] + offset
+            end = segment['end'] + offset
+            middle = (start + end) / 2
+            if middle < keep_start or (middle >= keep_end and not is_last):
+                continue
+
+            # Mantener los tiempos monótonos en la unión de dos fragmentos
+            start = max(start, last_end)
+            end = max(end, start)
+
+            merged = dict(segment)
+            merged['id'] = len(segments)
+            merged['start'] = round(start, 3)
+            merged['end'] = round(end, 3)
+            if 'seek' in merged:
+                merged['seek'] = int(merged['seek'] + chunk.start / SAMPLE_RATE * 100)
+            if segment.get('words'):
+                # Las palabras no pueden salirse del segmento, que puede
+                # haberse recortado para no solapar con el anterior
+                words = []
+                for word in segment['words']:
+                    word_start = min(max(word['start'] + offset, start), end)
+                    word_end = min(max(word['end'] + offset, word_start), end)
+                    words.append(dict(word, start=round(word_start, 3), end=round(word_end, 3)))
+                merged['words'] = words
+            segments.append(merged)
+            last_end = end
+            if on_segment is not None:
+                on_segment(merged)
+
+    language = next((r.get('language') for r in collected if r.get('language')), None)
+    return {
+        'text': ''.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'language': language,
+    }
+
+
+# --- Código que se ejecuta dentro de los procesos del pool ---
+
+_worker_backend = None
+
+
+def _init_worker(backend_name: str, model_name: str, threads: int):
+    """Carga el modelo una sola vez por proceso"""
+    global _worker_backend
+    from backends import create_backend
+
+    if backend_name == "whisper":
+        import torch
+
+        torch.set_num_threads(threads)
+        _worker_backend = create_backend(backend_name, model_name)
+    else:
+        _worker_backend = create_backend(backend_name, model_name, cpu_threads=threads)
+
+
+def _transcribe_chunk(audio: np.ndarray, language: str, options: dict) -> dict:
+    return _worker_backend.transcribe(audio, language, **options)
+
+
+class ChunkedTranscriber:
+    """Pool de procesos con un modelo Whisper cargado en cada uno"""
+
+    def __init__(self, backend_name: str, model_name: str, workers: int,
+                 chunk_seconds: float = 120, overlap_seconds: float = 2,
+                 search_seconds: float = 5):
+        self.backend_name = backend_name
+        self.model_name = model_name
+        self.workers = workers
+        self.chunk_seconds = chunk_seconds
+        self.overlap_seconds = overlap_seconds
+        self.search_seconds = search_seconds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # El pool se crea al primer uso para no retrasar el arranque del servidor
+        with self._lock:
+            if self._executor is None:
+                threads = max(1, (os.cpu_count() or 1) // self.workers)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    # "spawn" evita heredar hilos de PyTorch en un fork
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.backend_name, self.model_name, threads),
+                )
+            return self._executor
+
+    def transcribe(self, audio: np.ndarray, language: str,
+                   on_segment: Optional[Callable[[dict], None]] = None, **options) -> dict:
+        """Transcribe el audio repartiendo fragmentos entre los procesos"""
+        duration = len(audio) / SAMPLE_RATE
+        # Fragmentos suficientes para ocupar todos los procesos
+        chunk_seconds = min(self.chunk_seconds, max(MIN_CHUNK_SECONDS, duration / self.workers))
+        chunks = plan_chunks(audio, chunk_seconds, self.overlap_seconds, self.search_seconds)
+
+        executor = self._get_executor()
+        futures = [
+            executor.submit(_transcribe_chunk, audio[chunk.start:chunk.end], language, options)
+            for chunk in chunks
+        ]
+        try:
+            # Se unen en orden a medida que terminan para ir publicando segmentos
+            return merge_chunk_results(
+                chunks, (future.result() for future in futures), on_segment
+            )
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
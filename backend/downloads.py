@@ -0,0 +1,197 @@
+"""Descarga de archivos con peticiones parciales (Range / 206), validación con
+ETag y Last-Modified y envío sin copias cuando el servidor lo permite.
+
+Con Range el navegador puede saltar a cualquier punto de un video antes de
+que termine la descarga y un gestor de descargas puede reanudar una
+descarga cortada en vez de empezar de cero.
+"""
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Extensión ASGI para enviar un archivo sin pasar por Python (sendfile)
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+
+
+class RangeNotSatisfiable(Exception):
+    """El rango pedido empieza después del final del archivo"""
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """ETag fuerte: los archivos generados no se modifican después de escribirse"""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Devuelve (inicio, fin incluido) de una cabecera `Range: bytes=...`.
+
+    Devuelve None si el rango se debe ignorar (otra unidad, sintaxis no
+    válida o varios rangos: se responde con el archivo entero) y lanza
+    RangeNotSatisfiable si ningún byte del rango existe.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else start
+            if start < 0 or end < start:
+                return None
+            if not last:
+                end = size - 1
+        else:
+            # Sufijo: los últimos N bytes
+            suffix = int(last)
+            if suffix < 0:
+                return None
+            if suffix == 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - suffix, 0), size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def _not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        # Comparación débil: se ignora el prefijo W/
+        tags = [tag.strip()[2:] if tag.strip().startswith("W/") else tag.strip()
+                for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _range_applies(headers: Mapping[str, str], etag: str, last_modified: str) -> bool:
+    """`If-Range`: el rango solo vale si el archivo no cambió desde la primera
+    parte de la descarga; si cambió se envía entero"""
+    if_range = headers.get("if-range")
+    if if_range is None:
+        return True
+    return if_range.strip() in (etag, last_modified)
+
+
+class RangeFileResponse(Response):
+    """Como `FileResponse`, pero con Range, respuestas 304 y sendfile.
+
+    El cuerpo se envía con la extensión ASGI `http.response.zerocopysend`
+    si el servidor la ofrece; si no, en bloques leídos en un hilo.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, path: str, request_headers: Mapping[str, str], filename: str,
+                 media_type: str, method: str = "GET"):
+        self.path = path
+        self.background = None
+        self.media_type = media_type
+        stat_result = os.stat(path)
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise RuntimeError(f"{path} no es un archivo")
+        size = stat_result.st_size
+        etag = file_etag(stat_result)
+        last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": last_modified,
+            "content-disposition": content_disposition(filename),
+        }
+        self.start, self.length = 0, size
+        self.send_body = method != "HEAD"
+
+        self.status_code = 200
+        range_header = request_headers.get("range")
+        if _not_modified(request_headers, etag, stat_result.st_mtime):
+            self.status_code = 304
+            self.send_body = False
+        elif range_header and _range_applies(request_headers, etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, size)
+            except RangeNotSatisfiable:
+                self.status_code = 416
+                self.send_body = False
+                self.length = 0
+                headers["content-range"] = f"bytes */{size}"
+            else:
+                if byte_range is not None:
+                    start, end = byte_range
+                    self.status_code = 206
+                    self.start, self.length = start, end - start + 1
+                    headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        if self.status_code != 304:
+            headers["content-length"] = str(self.length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if not self.send_body or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if ZEROCOPY_EXTENSION in (scope.get("extensions") or {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining > 0:
+                # El archivo se acortó mientras se enviaba
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def accel_redirect_response(prefix: str, filename: str, media_type: str) -> Response:
+    """Deja que el proxy (nginx `X-Accel-Redirect`) sirva el archivo con
+    sendfile, Range y caché propios"""
+    return Response(
+        media_type=media_type,
+        headers={
+            "X-Accel-Redirect": prefix.rstrip("/") + "/" + quote(filename),
+            "Content-Disposition": content_disposition(filename),
+        },
+    )
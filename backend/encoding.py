@@ -0,0 +1,169 @@
+"""Perfiles de codificación de video para el quemado de subtítulos.
+
+Cada perfil fija preset y CRF de libx264. Si la máquina tiene VAAPI o Quick
+Sync (QSV) se usan esos codificadores por hardware, y si fallan se vuelve a
+libx264 por software.
+"""
+import logging
+import os
+import subprocess
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Presets de libx264 de más rápido a más lento
+X264_PRESETS = (
+    "ultrafast", "superfast", "veryfast", "faster", "fast",
+    "medium", "slow", "slower", "veryslow",
+)
+
+HWACCEL_MODES = ("auto", "none", "vaapi", "qsv")
+
+# Dispositivo DRM que usa VAAPI (configurable para máquinas con varias GPU)
+VAAPI_DEVICE = os.environ.get("VAAPI_DEVICE", "/dev/dri/renderD128")
+
+
+@dataclass(frozen=True)
+class EncoderSettings:
+    preset: str = "veryfast"
+    crf: int = 23
+    # 0 = FFmpeg decide según los núcleos disponibles
+    threads: int = 0
+    hwaccel: str = "auto"
+
+
+ENCODER_PROFILES: Dict[str, EncoderSettings] = {
+    "ultrafast": EncoderSettings(preset="ultrafast", crf=26),
+    "fast": EncoderSettings(preset="veryfast", crf=23),
+    "balanced": EncoderSettings(preset="medium", crf=21),
+    "quality": EncoderSettings(preset="slow", crf=18),
+}
+
+
+@dataclass(frozen=True)
+class EncoderChoice:
+    """Argumentos de FFmpeg para un codificador concreto"""
+    name: str
+    input_args: List[str]
+    # Se añade al final de la cadena de filtros (-vf)
+    filter_suffix: str
+    output_args: List[str]
+
+
+def resolve_encoder_settings(profile: str, preset: Optional[str] = None,
+                             crf: Optional[int] = None, threads: Optional[int] = None,
+                             hwaccel: Optional[str] = None) -> EncoderSettings:
+    """Parte del perfil y aplica los valores indicados en la petición.
+
+    Lanza ValueError con un mensaje para el usuario si algo no es válido.
+    """
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"Perfil debe ser uno de: {', '.join(ENCODER_PROFILES)}")
+    settings = ENCODER_PROFILES[profile]
+    default_threads = int(os.environ.get("ENCODER_THREADS", "0"))
+    settings = replace(settings, threads=default_threads,
+                       hwaccel=os.environ.get("ENCODER_HWACCEL", "auto"))
+
+    if preset is not None:
+        if preset not in X264_PRESETS:
+            raise ValueError(f"Preset debe ser uno de: {', '.join(X264_PRESETS)}")
+        settings = replace(settings, preset=preset)
+    if crf is not None:
+        if not 0 <= crf <= 51:
+            raise ValueError("CRF debe estar entre 0 y 51")
+        settings = replace(settings, crf=crf)
+    if threads is not None:
+        if threads < 0:
+            raise ValueError("El número de hilos no puede ser negativo")
+        settings = replace(settings, threads=threads)
+    if hwaccel is not None:
+        settings = replace(settings, hwaccel=hwaccel)
+    if settings.hwaccel not in HWACCEL_MODES:
+        raise ValueError(f"Aceleración debe ser una de: {', '.join(HWACCEL_MODES)}")
+    return settings
+
+
+_hw_support: Dict[str, bool] = {}
+_hw_lock = threading.Lock()
+
+
+def _probe_hw_encoder(name: str) -> bool:
+    """Codifica un frame de prueba: que FFmpeg liste el codificador no
+    garantiza que haya GPU o drivers"""
+    choice = _hw_choice(name, EncoderSettings())
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', *choice.input_args,
+        '-f', 'lavfi', '-i', 'color=c=black:s=256x256:d=0.1',
+        '-vf', 'null' + choice.filter_suffix, '-frames:v', '1',
+        *choice.output_args, '-f', 'null', '-'
+    ]
+    try:
+        return subprocess.run(cmd, capture_output=True, timeout=30).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def hw_encoder_available(name: str) -> bool:
+    """Comprueba (una sola vez por proceso) si el codificador por hardware funciona"""
+    with _hw_lock:
+        if name not in _hw_support:
+            if name == "vaapi" and not os.path.exists(VAAPI_DEVICE):
+                _hw_support[name] = False
+            else:
+                _hw_support[name] = _probe_hw_encoder(name)
+            logger.info("Codificador por hardware %s: %s", name,
+                        "disponible" if _hw_support[name] else "no disponible")
+        return _hw_support[name]
+
+
+def _hw_choice(name: str, settings: EncoderSettings) -> EncoderChoice:
+    if name == "vaapi":
+        return EncoderChoice(
+            name="h264_vaapi",
+            input_args=['-vaapi_device', VAAPI_DEVICE],
+            # Los subtítulos se dibujan en CPU y el frame se sube a la GPU
+            filter_suffix=',format=nv12,hwupload',
+            output_args=['-c:v', 'h264_vaapi', '-qp', str(settings.crf)],
+        )
+    return EncoderChoice(
+        name="h264_qsv",
+        input_args=[],
+        filter_suffix=',format=nv12',
+        output_args=[
+            '-c:v', 'h264_qsv', '-preset', _qsv_preset(settings.preset),
+            '-global_quality', str(settings.crf),
+        ],
+    )
+
+
+def _qsv_preset(preset: str) -> str:
+    # QSV solo entiende veryfast..veryslow
+    return preset if preset in X264_PRESETS[2:] else "veryfast"
+
+
+def software_choice(settings: EncoderSettings) -> EncoderChoice:
+    return EncoderChoice(
+        name="libx264",
+        input_args=[],
+        filter_suffix='',
+        output_args=[
+            '-c:v', 'libx264', '-preset', settings.preset, '-crf', str(settings.crf),
+            '-threads', str(settings.threads),
+        ],
+    )
+
+
+def encoder_choices(settings: EncoderSettings) -> List[EncoderChoice]:
+    """Codificadores a probar en orden: hardware (si procede) y libx264 al final"""
+    if settings.hwaccel == "none":
+        candidates = []
+    elif settings.hwaccel == "auto":
+        candidates = ["vaapi", "qsv"]
+    else:
+        candidates = [settings.hwaccel]
+
+    choices = [_hw_choice(name, settings) for name in candidates if hw_encoder_available(name)]
+    choices.append(software_choice(settings))
+    return choices
@@ -0,0 +1,173 @@
+"""Exportación de una transcripción a SRT, VTT, texto limpio, JSON o TSV.
+
+Los segmentos de Whisper de cada trabajo se guardan como artefacto (JSON
+Lines: una línea de metadatos y un segmento por línea). Cada formato es un
+generador que produce el archivo por trozos a partir de esos segmentos, así
+que se puede enviar en streaming sin construirlo entero en memoria.
+"""
+import json
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator
+
+from captions import CueLimits, format_timestamp, format_timestamps, iter_cue_batches
+
+# Campos de cada segmento que se guardan en el artefacto (los tokens y las
+# métricas internas de Whisper no hacen falta para exportar)
+ARTIFACT_SEGMENT_FIELDS = ("start", "end", "text", "words")
+
+
+def write_segments_artifact(path: str, transcription: dict, metadata: dict):
+    """Guarda los segmentos de la transcripción como JSON Lines"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps({**metadata, "language_detected": transcription.get('language')},
+                           ensure_ascii=False) + "\n")
+        for segment in transcription['segments']:
+            stored = {key: segment[key] for key in ARTIFACT_SEGMENT_FIELDS if segment.get(key) is not None}
+            f.write(json.dumps(stored, ensure_ascii=False) + "\n")
+
+
+def read_artifact_metadata(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.loads(f.readline())
+
+
+def iter_artifact_segments(path: str) -> Iterator[dict]:
+    """Lee los segmentos del artefacto de uno en uno"""
+    with open(path, 'r', encoding='utf-8') as f:
+        f.readline()
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_cue_blocks(segments: Iterable[dict], limits: CueLimits, separator: str) -> Iterator[str]:
+    """Bloques numerados "índice, tiempos, texto" de VTT y SRT: un trozo de
+    texto por lote de subtítulos"""
+    index = 1
+    for starts, ends, texts in iter_cue_batches(segments, limits):
+        start_texts = format_timestamps(starts, separator)
+        end_texts = format_timestamps(ends, separator)
+        yield "".join([
+            f"{number}\n{start} --> {end}\n{text}\n\n"
+            for number, start, end, text in zip(range(index, index + len(texts)), start_texts, end_texts, texts)
+        ])
+        index += len(texts)
+
+
+def iter_vtt(segments: Iterable[dict], limits: CueLimits) -> Iterator[str]:
+    yield "WEBVTT\n\n"
+    yield from iter_cue_blocks(segments, limits, ".")
+
+
+def format_srt_timestamp(seconds: float) -> str:
+    """Convierte segundos a formato SRT (HH:MM:SS,mmm)"""
+    return format_timestamp(seconds, ",")
+
+
+def iter_srt(segments: Iterable[dict], limits: CueLimits) -> Iterator[str]:
+    return iter_cue_blocks(segments, limits, ",")
+
+
+_SENTENCE_END = re.compile(r'[.!?]+')
+
+
+def iter_clean_text(segments: Iterable[dict]) -> Iterator[str]:
+    """Texto sin timestamps en párrafos de 3 oraciones (o menos si una
+    oración pasa de 100 caracteres)"""
+    pending = []
+    # Solo se necesita si no aparece ninguna oración (p. ej. texto vacío)
+    full_text = []
+    paragraph = []
+    first = True
+
+    def close_sentence(sentence):
+        nonlocal paragraph, first
+        sentence = sentence.strip()
+        if not sentence:
+            return None
+        paragraph.append(sentence)
+        if len(paragraph) >= 3 or len(sentence) > 100:
+            text = ('' if first else '\n') + '. '.join(paragraph) + '.'
+            paragraph, first = [], False
+            return text
+        return None
+
+    for segment in segments:
+        text = segment['text'].strip()
+        if not text:
+            continue
+        if first and not paragraph:
+            full_text.append(text)
+        # Todo lo que hay antes del último signo de fin de oración ya está
+        # completo; lo pendiente nunca contiene signos, así que basta con
+        # dividir el texto nuevo. Lo pendiente se guarda por trozos para no
+        # copiarlo entero con cada segmento si el texto no tiene puntuación
+        pieces = _SENTENCE_END.split(text + " ")
+        if len(pieces) == 1:
+            pending.append(pieces[0])
+            continue
+        pieces[0] = "".join(pending) + pieces[0]
+        pending = [pieces.pop()]
+        for sentence in pieces:
+            chunk = close_sentence(sentence)
+            if chunk:
+                yield chunk
+
+    chunk = close_sentence("".join(pending))
+    if chunk:
+        yield chunk
+    if paragraph:
+        yield ('' if first else '\n') + '. '.join(paragraph) + '.'
+    elif first:
+        # No se pudieron formar oraciones: el texto tal cual
+        yield " ".join(full_text)
+
+
+def iter_json(segments: Iterable[dict], metadata: dict) -> Iterator[str]:
+    header = {
+        "language": metadata.get("language"),
+        "model": metadata.get("model"),
+        "word_timestamps": metadata.get("word_timestamps", False),
+    }
+    yield json.dumps(header, ensure_ascii=False)[:-1] + ', "segments": ['
+    for index, segment in enumerate(segments):
+        yield ("" if index == 0 else ",") + "\n  " + json.dumps(
+            {"id": index, **segment}, ensure_ascii=False
+        )
+    yield "\n]}\n"
+
+
+def iter_tsv(segments: Iterable[dict]) -> Iterator[str]:
+    """Mismo formato que el TSV de Whisper: milisegundos enteros y el texto"""
+    yield "start\tend\ttext\n"
+    for segment in segments:
+        text = segment['text'].strip().replace('\t', ' ')
+        yield f"{round(1000 * segment['start'])}\t{round(1000 * segment['end'])}\t{text}\n"
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    extension: str
+    media_type: str
+    render: Callable[[Iterable[dict], CueLimits, dict], Iterator[str]]
+
+
+# Todos los formatos reciben (segmentos, límites de subtítulo, metadatos)
+EXPORT_FORMATS: Dict[str, ExportFormat] = {
+    "srt": ExportFormat("srt", "application/x-subrip; charset=utf-8",
+                        lambda segments, limits, metadata: iter_srt(segments, limits)),
+    "vtt": ExportFormat("vtt", "text/vtt",
+                        lambda segments, limits, metadata: iter_vtt(segments, limits)),
+    "txt": ExportFormat("txt", "text/plain",
+                        lambda segments, limits, metadata: iter_clean_text(segments)),
+    "json": ExportFormat("json", "application/json",
+                         lambda segments, limits, metadata: iter_json(segments, metadata)),
+    "tsv": ExportFormat("tsv", "text/tab-separated-values",
+                        lambda segments, limits, metadata: iter_tsv(segments)),
+}
+
+
+def artifact_cue_limits(metadata: dict) -> CueLimits:
+    """Límites de subtítulo con los que se pidió la transcripción"""
+    return CueLimits(**metadata["cue_limits"]) if metadata.get("cue_limits") else CueLimits()
@@ -0,0 +1,359 @@
+"""Cola de trabajos en segundo plano para las tareas pesadas (FFmpeg + Whisper)"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from metrics import JOBS_FINISHED, STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Estados posibles de un trabajo
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+# Máximo de eventos que se guardan por trabajo para los suscriptores de progreso
+MAX_JOB_EVENTS = 5000
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro de un trabajo cuando el usuario solicitó cancelarlo"""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: str = JOB_QUEUED
+    stage: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    error_status: Optional[int] = None
+    # Progreso (0-1) dentro de la etapa actual, si se conoce
+    progress: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    # Eventos de progreso numerados para los clientes conectados por SSE
+    events: List[Dict[str, Any]] = field(default_factory=list, repr=False)
+    last_event_id: int = 0
+    _events_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    # Segundos de cada etapa (y de la espera en cola y la subida del archivo)
+    timings: Dict[str, float] = field(default_factory=dict)
+    _stage_started: Optional[float] = field(default=None, repr=False)
+
+    @property
+    def cancel_requested(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Punto de control: interrumpe el trabajo si se pidió cancelarlo"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def set_stage(self, stage: str):
+        """Actualiza la etapa actual comprobando antes si hay que cancelar"""
+        self.check_cancelled()
+        self.end_stage()
+        self.stage = stage
+        self._stage_started = time.perf_counter()
+        self.progress = None
+        self.publish("stage", stage=stage)
+
+    def mark_running(self):
+        """Pasa el trabajo a "en curso" y anota el tiempo que esperó en cola"""
+        self.status = JOB_RUNNING
+        self.stage = JOB_RUNNING
+        self.started_at = time.time()
+        self.record_timing(JOB_QUEUED, self.started_at - self.created_at)
+
+    def end_stage(self):
+        """Suma la duración de la etapa actual a `timings` y a las métricas"""
+        if self._stage_started is None:
+            return
+        self.record_timing(self.stage, time.perf_counter() - self._stage_started)
+        self._stage_started = None
+
+    def record_timing(self, stage: str, seconds: float):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, kind=self.kind, stage=stage)
+
+    def set_progress(self, progress: float, event_type: str = "progress", **details):
+        """Actualiza el progreso de la etapa actual (también es un punto de cancelación)"""
+        self.check_cancelled()
+        self.progress = round(min(max(progress, 0.0), 1.0), 4)
+        self.publish(event_type, stage=self.stage, progress=self.progress, **details)
+
+    def publish(self, event_type: str, **data):
+        """Añade un evento al historial del trabajo.
+
+        Los eventos de progreso consecutivos se fusionan: un cliente que se
+        conecta tarde solo recibe el último y no todos los intermedios.
+        """
+        with self._events_lock:
+            if (event_type == "progress" and self.events
+                    and self.events[-1]["type"] == "progress"):
+                self.events.pop()
+            self.last_event_id += 1
+            self.events.append({"id": self.last_event_id, "type": event_type, **data})
+            if len(self.events) > MAX_JOB_EVENTS:
+                del self.events[:len(self.events) - MAX_JOB_EVENTS]
+
+    def events_since(self, event_id: int) -> List[Dict[str, Any]]:
+        """Eventos posteriores a `event_id` (0 = todos los guardados)"""
+        with self._events_lock:
+            if not self.events or self.events[-1]["id"] <= event_id:
+                return []
+            return [event for event in self.events if event["id"] > event_id]
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "cancel_requested": self.cancel_requested,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "timings": self.rounded_timings(),
+        }
+
+    def rounded_timings(self):
+        return {stage: round(seconds, 3) for stage, seconds in self.timings.items()}
+
+
+class JobQueue:
+    """Pool acotado de workers que ejecuta trabajos fuera del event loop.
+
+    Cada trabajo se encola a nombre de un cliente. Cuando queda un worker
+    libre se elige el trabajo más antiguo del cliente con menos trabajo en
+    curso (según el `cost` de cada trabajo) y, a igualdad, del que lleva más
+    tiempo sin empezar uno: los clientes se turnan y los muchos archivos en
+    cola de uno no dejan esperando a los demás.
+
+    Un trabajo encolado con `after` espera aparte, sin ocupar ningún worker,
+    hasta que terminan (de cualquier forma) los trabajos de los que depende.
+    """
+
+    def __init__(self, max_workers: int = 2, retention_seconds: int = 3600):
+        self.max_workers = max_workers
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job-worker"
+        )
+        self._jobs: Dict[str, Job] = {}
+        # Trabajos en espera por cliente y coste de lo que cada uno tiene en curso
+        self._pending: Dict[Optional[str], deque] = {}
+        self._running_cost: Dict[Optional[str], float] = {}
+        self._last_started: Dict[Optional[str], float] = {}
+        # Trabajos que esperan a otros: id -> (ids de los que dependen, cliente, entrada de la cola)
+        self._blocked: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, func: Callable, *args,
+               cleanup: Optional[Callable[[], None]] = None,
+               timings: Optional[Dict[str, float]] = None,
+               client_id: Optional[str] = None, cost: float = 1.0,
+               after: Optional[List[str]] = None, **kwargs) -> Job:
+        """Encola un trabajo. `func` recibe el Job como primer argumento.
+
+        `timings` son los tiempos medidos antes de encolar (p. ej. la subida).
+        `after` son ids de trabajos que deben terminar antes de que empiece.
+        """
+        job = Job(id=uuid.uuid4().hex, kind=kind)
+        for stage, seconds in (timings or {}).items():
+            job.record_timing(stage, seconds)
+        entry = (job, func, args, kwargs, cleanup, cost)
+        with self._lock:
+            self._prune_finished()
+            self._jobs[job.id] = job
+            if after and not self._dependencies_finished(after):
+                self._blocked[job.id] = (list(after), client_id, entry)
+                return job
+            self._pending.setdefault(client_id, deque()).append(entry)
+        # Cada tarea del pool ejecuta el siguiente trabajo que toque, no necesariamente este
+        self._executor.submit(self._run_next)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Marca un trabajo para cancelar. Si aún está en cola se cancela al instante"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return job
+            job.cancel_event.set()
+            if job.status != JOB_QUEUED:
+                return job
+            job.status = JOB_CANCELLED
+            job.stage = JOB_CANCELLED
+            job.finished_at = time.time()
+            job.publish("status", status=JOB_CANCELLED)
+            JOBS_FINISHED.inc(kind=job.kind, status=JOB_CANCELLED)
+            blocked = self._blocked.pop(job_id, None)
+            if blocked is not None:
+                # Pasa a la cola para que un worker ejecute su limpieza
+                _, client_id, entry = blocked
+                self._pending.setdefault(client_id, deque()).append(entry)
+            released = self._release_blocked() + (blocked is not None)
+        for _ in range(released):
+            self._executor.submit(self._run_next)
+        return job
+
+    def stats(self):
+        with self._lock:
+            states = [job.status for job in self._jobs.values()]
+        return {
+            "workers": self.max_workers,
+            "queued": states.count(JOB_QUEUED),
+            "running": states.count(JOB_RUNNING),
+        }
+
+    def shutdown(self):
+        """Cancela los trabajos pendientes y espera a los que están en curso"""
+        with self._lock:
+            job_ids = list(self._jobs)
+        for job_id in job_ids:
+            self.cancel(job_id)
+        self._executor.shutdown(wait=True)
+
+    def _run_next(self):
+        with self._lock:
+            client_id = min(self._pending, key=lambda client: (
+                self._running_cost.get(client, 0.0), self._last_started.get(client, 0.0),
+                self._pending[client][0][0].created_at
+            ))
+            job, func, args, kwargs, cleanup, cost = self._pending[client_id].popleft()
+            if not self._pending[client_id]:
+                del self._pending[client_id]
+            started = job.status == JOB_QUEUED
+            if started:
+                job.mark_running()
+                self._running_cost[client_id] = self._running_cost.get(client_id, 0.0) + cost
+                self._last_started[client_id] = job.started_at
+        if not started:
+            # Cancelado mientras esperaba en la cola
+            run_cleanup(job, cleanup)
+            return
+        try:
+            execute_job(job, func, args, kwargs, cleanup)
+        finally:
+            with self._lock:
+                remaining = self._running_cost.pop(client_id) - cost
+                if remaining > 1e-6:
+                    self._running_cost[client_id] = remaining
+                elif client_id not in self._pending:
+                    # Sin trabajos: se olvida el cliente
+                    self._last_started.pop(client_id, None)
+                released = self._release_blocked()
+            for _ in range(released):
+                self._executor.submit(self._run_next)
+
+    def _dependencies_finished(self, job_ids: List[str]) -> bool:
+        # Un trabajo que ya no existe se olvidó porque había terminado
+        return all(
+            job_id not in self._jobs or self._jobs[job_id].status in FINISHED_STATES
+            for job_id in job_ids
+        )
+
+    def _release_blocked(self) -> int:
+        """Pasa a la cola los trabajos cuyas dependencias ya terminaron y
+        devuelve cuántos son (se llama con el lock tomado)"""
+        ready = [job_id for job_id, (after, _, _) in self._blocked.items()
+                 if self._dependencies_finished(after)]
+        for job_id in ready:
+            _, client_id, entry = self._blocked.pop(job_id)
+            self._pending.setdefault(client_id, deque()).append(entry)
+        return len(ready)
+
+    def _prune_finished(self):
+        """Olvida trabajos terminados hace más de `retention_seconds`"""
+        limit = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.status in FINISHED_STATES and job.finished_at and job.finished_at < limit
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def execute_job(job: Job, func: Callable, args, kwargs, cleanup: Optional[Callable[[], None]] = None):
+    """Ejecuta un trabajo ya marcado como en curso y publica su estado final.
+
+    Lo usan tanto la cola en proceso como los workers del broker.
+    """
+    job.publish("status", status=JOB_RUNNING)
+    try:
+        try:
+            result = func(job, *args, **kwargs)
+        finally:
+            # La última etapa termina con el trabajo, también si falla
+            job.end_stage()
+        job.result = result
+        job.status = JOB_COMPLETED
+        job.stage = JOB_COMPLETED
+    except JobCancelled:
+        job.status = JOB_CANCELLED
+        job.stage = JOB_CANCELLED
+    except HTTPException as e:
+        job.status = JOB_FAILED
+        job.error = e.detail
+        job.error_status = e.status_code
+    except Exception as e:
+        job.status = JOB_FAILED
+        job.error = f"Error inesperado: {str(e)}"
+        job.error_status = 500
+    finally:
+        if job.finished_at is None:
+            job.finished_at = time.time()
+        JOBS_FINISHED.inc(kind=job.kind, status=job.status)
+        # Último evento: los suscriptores cierran la conexión al recibirlo
+        job.publish("status", status=job.status, result=job.result,
+                    error=job.error, error_status=job.error_status,
+                    timings=job.rounded_timings())
+        logger.info("Trabajo %s %s (%s) en %.2fs", job.kind, job.id, job.status,
+                    job.finished_at - job.started_at,
+                    extra={"job_id": job.id, "timings": job.rounded_timings()})
+        run_cleanup(job, cleanup)
+
+
+def run_cleanup(job: Job, cleanup: Optional[Callable[[], None]]):
+    if cleanup is not None:
+        try:
+            cleanup()
+        except Exception as e:
+            logger.error("Error limpiando archivos del trabajo %s: %s", job.id, e)
+
+
+def remove_paths(*paths):
+    """Borra los archivos o directorios temporales de un trabajo.
+
+    Se usa con `functools.partial` como `cleanup`: a diferencia de una
+    función local se puede serializar para enviarla a un worker.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
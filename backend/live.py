@@ -0,0 +1,149 @@
+"""Transcripción incremental de audio en directo con un buffer deslizante.
+
+Cada `step_seconds` de audio nuevo se vuelve a transcribir todo el buffer.
+Un segmento se da por definitivo cuando dos pasadas consecutivas coinciden en
+él y no es el último (que puede seguir creciendo); entonces se emite como
+subtítulo final y el buffer se recorta hasta su fin. Lo demás se emite como
+provisional. Si el buffer llega a `window_seconds` sin acuerdo, se fuerzan
+los segmentos completos para acotar la latencia.
+"""
+import re
+import threading
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from captions import segment_cues
+from media import SAMPLE_RATE
+
+# Por debajo de esta duración Whisper no produce nada útil
+MIN_AUDIO_SECONDS = 0.5
+
+
+def _normalize(text: str) -> str:
+    """Texto comparable entre pasadas (sin puntuación ni mayúsculas)"""
+    return " ".join(re.sub(r"[^\w\s]", "", text).lower().split())
+
+
+class LiveTranscriber:
+    """Estado de una sesión de transcripción en directo.
+
+    `transcribe(audio, initial_prompt)` debe devolver la misma estructura que
+    `whisper.transcribe`. `add_pcm` puede llamarse desde cualquier hilo.
+    """
+
+    def __init__(self, transcribe: Callable[[np.ndarray, Optional[str]], dict],
+                 window_seconds: float = 15.0, step_seconds: float = 2.0,
+                 context_chars: int = 200):
+        self.transcribe = transcribe
+        self.window_seconds = window_seconds
+        self.step_seconds = step_seconds
+        self.context_chars = context_chars
+        self._buffer = np.zeros(0, dtype=np.float32)
+        # Posición (segundos) del inicio del buffer en la sesión
+        self._buffer_start = 0.0
+        self._pending_samples = 0
+        self._received_samples = 0
+        self._remainder = b""
+        self._previous: List[str] = []
+        self._context = ""
+        self._next_index = 1
+        self._lock = threading.Lock()
+
+    @property
+    def pending_seconds(self) -> float:
+        """Audio recibido desde la última pasada"""
+        return self._pending_samples / SAMPLE_RATE
+
+    @property
+    def received_seconds(self) -> float:
+        return self._received_samples / SAMPLE_RATE
+
+    def add_pcm(self, data: bytes):
+        """Añade PCM s16le mono a 16 kHz (los bloques pueden cortar una muestra)"""
+        with self._lock:
+            data = self._remainder + data
+            usable = len(data) - len(data) % 2
+            self._remainder = data[usable:]
+            if not usable:
+                return
+            samples = np.frombuffer(data[:usable], np.int16).astype(np.float32) / 32768.0
+            self._buffer = np.concatenate((self._buffer, samples))
+            self._pending_samples += len(samples)
+            self._received_samples += len(samples)
+
+    def process(self, final: bool = False) -> List[dict]:
+        """Transcribe el buffer y devuelve los eventos a enviar al cliente.
+
+        Con `final=True` (fin del audio) todo lo pendiente se da por definitivo.
+        """
+        with self._lock:
+            audio = self._buffer.copy()
+            offset = self._buffer_start
+            self._pending_samples = 0
+
+        buffer_seconds = len(audio) / SAMPLE_RATE
+        if buffer_seconds < MIN_AUDIO_SECONDS:
+            if final:
+                return []
+            return [self._provisional_event([], offset)]
+
+        prompt = self._context[-self.context_chars:].strip() or None
+        result = self.transcribe(audio, prompt)
+        segments = [s for s in result.get('segments', []) if s['text'].strip()]
+
+        if final:
+            commit = len(segments)
+        else:
+            # Prefijo de segmentos en el que coinciden esta pasada y la anterior
+            commit = 0
+            for i, segment in enumerate(segments[:-1]):
+                if i < len(self._previous) and self._previous[i] == _normalize(segment['text']):
+                    commit = i + 1
+                else:
+                    break
+            if commit == 0 and buffer_seconds >= self.window_seconds:
+                commit = max(len(segments) - 1, 1) if segments else 0
+
+        finalized, provisional = segments[:commit], segments[commit:]
+        events = []
+        if finalized:
+            events.append(self._final_event(finalized, offset))
+            cut = min(finalized[-1]['end'], buffer_seconds)
+            self._trim(int(cut * SAMPLE_RATE))
+            self._context += " " + " ".join(s['text'].strip() for s in finalized)
+        elif not segments and buffer_seconds >= self.window_seconds:
+            # Solo silencio: no tiene sentido seguir transcribiéndolo
+            self._trim(len(audio))
+
+        self._previous = [_normalize(s['text']) for s in provisional]
+        if not final:
+            events.append(self._provisional_event(provisional, offset))
+        return events
+
+    def _trim(self, samples: int):
+        with self._lock:
+            self._buffer = self._buffer[samples:]
+            self._buffer_start += samples / SAMPLE_RATE
+
+    def _final_event(self, segments: List[dict], offset: float) -> dict:
+        cues = []
+        for segment in segments:
+            for start, end, text in segment_cues(segment):
+                cues.append({
+                    "index": self._next_index,
+                    "start": round(offset + start, 3),
+                    "end": round(offset + end, 3),
+                    "text": text,
+                })
+                self._next_index += 1
+        return {"type": "final", "cues": cues}
+
+    def _provisional_event(self, segments: List[dict], offset: float) -> dict:
+        # Sustituye por completo a los provisionales enviados antes
+        cues = [
+            {"start": round(offset + start, 3), "end": round(offset + end, 3), "text": text}
+            for segment in segments
+            for start, end, text in segment_cues(segment)
+        ]
+        return {"type": "provisional", "cues": cues}
@@ -0,0 +1,52 @@
+"""Configuración del logging del backend.
+
+En formato `text` cada línea lleva hora, nivel y módulo; en formato `json`
+cada línea es un objeto con esos campos más los que se pasen en `extra`
+(p. ej. `job_id`), listo para agregarlo en un sistema de logs.
+"""
+import json
+import logging
+import sys
+
+# Atributos propios de LogRecord: el resto son campos añadidos con `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class JobLogger(logging.LoggerAdapter):
+    """Añade el identificador del trabajo a cada mensaje (prefijo en texto,
+    campo `job_id` en JSON)"""
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return f"[{self.extra['job_id']}] {msg}", kwargs
+
+
+def job_logger(logger: logging.Logger, job) -> JobLogger:
+    return JobLogger(logger, {"job_id": job.id})
+
+
+def configure_logging(level: str = "INFO", log_format: str = "text"):
+    handler = logging.StreamHandler(sys.stdout)
+    if log_format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s - %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
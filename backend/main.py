@@ -1,14 +1,69 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, Request, WebSocket
+from fastapi.websockets import WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-import whisper
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 import os
-import tempfile
+import asyncio
+import hashlib
+import json
+import logging
+import queue
 import shutil
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List
 from pathlib import Path
-from datetime import datetime
+import numpy as np
 import uvicorn
 import subprocess
+from dataclasses import asdict, dataclass, replace
+
+from jobs import FINISHED_STATES, JOB_COMPLETED, JobCancelled, JobQueue, remove_paths
+from broker import BrokerJobQueue, create_broker
+from admission import (
+    POOL_AUDIO, POOL_RENDER, AdmissionController, JobCost, render_cost, transcription_cost
+)
+from media import (
+    SAMPLE_RATE, MediaInspector, audio_content_hash, decode_audio_stream, probe_media,
+    StreamingDecoder, iter_file_chunks, iter_queue_chunks, load_audio, read_wav_audio, run_ffmpeg
+)
+from transcript_cache import TranscriptCache
+from chunked import ChunkedTranscriber
+from vad import extract_speech, remap_segments
+from models import ModelRegistry
+from captions import CueLimits, count_vtt_cues, parse_vtt, slice_cues, validate_vtt
+from export import (
+    EXPORT_FORMATS, artifact_cue_limits, iter_artifact_segments, iter_clean_text, iter_vtt,
+    read_artifact_metadata, write_segments_artifact
+)
+from ass import AssCache, SubtitleStyle, filter_path, write_ass
+from artifacts import ArtifactStore, unique_name
+from uploads import UploadStore
+from downloads import RangeFileResponse, accel_redirect_response
+from logs import configure_logging, job_logger
+from metrics import (
+    BURN_FPS, CONTENT_TYPE as METRICS_CONTENT_TYPE, DECODE_SECONDS, OUTPUT_WRITE_SECONDS,
+    REGISTRY, UPLOAD_BYTES, UPLOAD_SECONDS, WHISPER_RTF, RequestStartMiddleware
+)
+from live import LiveTranscriber
+from encoding import (
+    ENCODER_PROFILES, EncoderSettings, encoder_choices, resolve_encoder_settings, software_choice
+)
+from burn import concat_pieces, split_at_keyframes
+from batch import (
+    build_pack_audio, extract_zip, is_zip_upload, plan_packs, safe_filename, split_pack_segments
+)
+
+# Logging: LOG_LEVEL=DEBUG muestra el detalle de cada paso (comandos de
+# FFmpeg, rutas...); LOG_FORMAT=json escribe una línea JSON por mensaje
+configure_logging(os.environ.get("LOG_LEVEL", "INFO"), os.environ.get("LOG_FORMAT", "text"))
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Video Transcription API", version="1.0.0")
 
@@ -20,15 +75,208 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Marca el inicio de cada petición para medir las subidas
+app.add_middleware(RequestStartMiddleware)
 
-# Directorio para archivos temporales
-TEMP_DIR = Path("temp_uploads")
+# Directorio para archivos temporales y resultados (con varios nodos, en un
+# almacenamiento compartido por la API y los workers)
+TEMP_DIR = Path(os.environ.get("TEMP_DIR", "temp_uploads"))
 TEMP_DIR.mkdir(exist_ok=True)
 
-# Cargar modelo Whisper (se descarga automáticamente la primera vez)
-print("Cargando modelo Whisper...")
-model = whisper.load_model("small")
-print("Modelo Whisper 'small' cargado exitosamente")
+# Modelos Whisper (se descargan automáticamente la primera vez). Se cargan
+# bajo demanda en el primer uso para que el servidor arranque al instante.
+# INFERENCE_BACKEND elige el motor: "whisper" (referencia, PyTorch) o
+# "faster-whisper" (CTranslate2 con int8, mucho más rápido en CPU)
+WHISPER_MODEL_NAME = os.environ.get("WHISPER_MODEL", "small")
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "whisper")
+ALLOWED_MODELS = os.environ.get("ALLOWED_MODELS", "tiny,base,small,medium,large").split(",")
+model_registry = ModelRegistry(
+    INFERENCE_BACKEND,
+    allowed_models=set(ALLOWED_MODELS) | {WHISPER_MODEL_NAME},
+    # Número máximo de modelos en memoria y presupuesto aproximado (0 = sin límite)
+    max_models=int(os.environ.get("MAX_LOADED_MODELS", "2")),
+    memory_budget_mb=int(os.environ.get("MODEL_MEMORY_BUDGET_MB", "0"))
+)
+# Precargar el modelo por defecto en segundo plano al arrancar
+WARM_DEFAULT_MODEL = os.environ.get("WARM_DEFAULT_MODEL", "1") == "1"
+
+# Número de trabajos (FFmpeg + Whisper) que se procesan en paralelo
+MAX_WORKERS = int(os.environ.get("TRANSCRIPTION_WORKERS", "2"))
+
+# Número máximo de transcripciones simultáneas sobre el mismo modelo Whisper.
+# Mientras un trabajo transcribe, los demás pueden ir extrayendo audio con FFmpeg.
+WHISPER_CONCURRENCY = int(os.environ.get("WHISPER_CONCURRENCY", "1"))
+whisper_semaphore = threading.Semaphore(WHISPER_CONCURRENCY)
+
+# Con BROKER_URL (sqlite:///... o redis://...) esta API solo encola los
+# trabajos y los ejecutan procesos worker.py; sin él se ejecutan aquí mismo
+BROKER_URL = os.environ.get("BROKER_URL", "")
+if BROKER_URL:
+    job_queue = BrokerJobQueue(create_broker(BROKER_URL))
+else:
+    job_queue = JobQueue(max_workers=MAX_WORKERS)
+
+def job_snapshot(job_id: str):
+    job = job_queue.get(job_id)
+    return job.to_dict() if job else None
+
+# Control de admisión: máximo de segundos de trabajo pendientes (en cola o en
+# curso) de Whisper y del quemado de subtítulos (0 = sin límite), y parte de
+# esa capacidad que puede ocupar un solo cliente. Al superarlos se responde
+# 429 con Retry-After. Los clientes se distinguen por IP o, detrás de un
+# proxy o con claves de API, por la cabecera CLIENT_ID_HEADER
+ADMISSION_MAX_AUDIO_SECONDS = float(os.environ.get("ADMISSION_MAX_AUDIO_SECONDS", "14400"))
+ADMISSION_MAX_RENDER_SECONDS = float(os.environ.get("ADMISSION_MAX_RENDER_SECONDS", "7200"))
+ADMISSION_CLIENT_SHARE = float(os.environ.get("ADMISSION_CLIENT_SHARE", "0.5"))
+CLIENT_ID_HEADER = os.environ.get("CLIENT_ID_HEADER", "")
+# Con broker las reservas se guardan en él, así todas las instancias de la
+# API cuentan la misma capacidad, y el estado de los trabajos admitidos se
+# revisa como mucho una vez por segundo en lugar de en cada petición
+admission = AdmissionController(
+    {POOL_AUDIO: ADMISSION_MAX_AUDIO_SECONDS, POOL_RENDER: ADMISSION_MAX_RENDER_SECONDS},
+    ADMISSION_CLIENT_SHARE, job_snapshot, lambda: job_queue.max_workers,
+    refresh_seconds=1.0 if BROKER_URL else 0.0,
+    store=job_queue.broker if BROKER_URL else None
+)
+
+# Frecuencia con la que /jobs/{id}/events revisa si hay eventos nuevos, y
+# cada cuánto envía un comentario para que los proxies no corten la conexión
+JOB_EVENTS_POLL_SECONDS = 0.25
+JOB_EVENTS_KEEPALIVE_SECONDS = 15
+
+# Duración máxima aceptada en segundos (por defecto 30 minutos, 0 = sin límite)
+MAX_MEDIA_DURATION = int(os.environ.get("MAX_MEDIA_DURATION", "1800"))
+
+# Transcripción en paralelo por fragmentos para audios largos: número de
+# procesos (cada uno con su propio modelo cargado), 0 = desactivada
+CHUNKED_WORKERS = int(os.environ.get("CHUNKED_TRANSCRIPTION_WORKERS", "0"))
+# Solo se divide el audio a partir de esta duración (segundos)
+CHUNKED_MIN_DURATION = float(os.environ.get("CHUNKED_MIN_DURATION", "300"))
+chunked_transcriber = None
+if CHUNKED_WORKERS > 0:
+    chunked_transcriber = ChunkedTranscriber(
+        INFERENCE_BACKEND, WHISPER_MODEL_NAME, CHUNKED_WORKERS,
+        chunk_seconds=float(os.environ.get("CHUNK_SECONDS", "120")),
+        overlap_seconds=float(os.environ.get("CHUNK_OVERLAP_SECONDS", "2"))
+    )
+
+# Perfil de codificación por defecto para el quemado de subtítulos
+# (ultrafast, fast, balanced o quality; ver encoding.py)
+DEFAULT_ENCODER_PROFILE = os.environ.get("ENCODER_PROFILE", "fast")
+if DEFAULT_ENCODER_PROFILE not in ENCODER_PROFILES:
+    raise ValueError(f"ENCODER_PROFILE desconocido: '{DEFAULT_ENCODER_PROFILE}'")
+
+# Quemado en paralelo: número de piezas que se codifican a la vez (0 = desactivado)
+# y duración mínima del video para dividirlo
+PARALLEL_BURN_WORKERS = int(os.environ.get("PARALLEL_BURN_WORKERS", "0"))
+PARALLEL_BURN_MIN_DURATION = float(os.environ.get("PARALLEL_BURN_MIN_DURATION", "120"))
+
+# Lotes (/transcribe/batch): máximo de archivos por lote, duración de los
+# paquetes de clips cortos que se transcriben juntos (una ventana de Whisper)
+# y silencio que se deja entre clips dentro de un paquete
+BATCH_MAX_FILES = int(os.environ.get("BATCH_MAX_FILES", "1000"))
+# Tamaño máximo de un lote en disco, contando el contenido descomprimido de
+# los zip (0 = sin límite)
+BATCH_MAX_MB = int(os.environ.get("BATCH_MAX_MB", "4096"))
+BATCH_PACK_SECONDS = float(os.environ.get("BATCH_PACK_SECONDS", "30"))
+BATCH_PACK_GAP_SECONDS = float(os.environ.get("BATCH_PACK_GAP_SECONDS", "1.0"))
+
+# Transcripción en directo (/transcribe/live): cada cuántos segundos de audio
+# nuevo se transcribe y tamaño máximo del buffer antes de forzar subtítulos
+# definitivos. Más paso y más ventana = más precisión pero más latencia.
+LIVE_STEP_SECONDS = float(os.environ.get("LIVE_STEP_SECONDS", "2"))
+LIVE_WINDOW_SECONDS = float(os.environ.get("LIVE_WINDOW_SECONDS", "15"))
+LIVE_MAX_SESSIONS = int(os.environ.get("LIVE_MAX_SESSIONS", "2"))
+live_sessions = 0
+
+# Caché persistente de segmentos de Whisper (fuera de TEMP_DIR para que
+# /cleanup no la borre)
+CACHE_DIR = Path(os.environ.get("CACHE_DIR", "cache"))
+TRANSCRIPT_CACHE_MAX_MB = int(os.environ.get("TRANSCRIPT_CACHE_MAX_MB", "512"))
+transcript_cache = TranscriptCache(
+    CACHE_DIR / "transcriptions.sqlite3", TRANSCRIPT_CACHE_MAX_MB * 1024 * 1024
+)
+
+# Subtítulos ASS ya generados con su estilo (mismo VTT + mismo estilo = mismo archivo)
+ASS_CACHE_MAX_ENTRIES = int(os.environ.get("ASS_CACHE_MAX_ENTRIES", "256"))
+ass_cache = AssCache(CACHE_DIR / "ass", ASS_CACHE_MAX_ENTRIES)
+
+# Subtítulos de los VTT: marcas de tiempo por palabra de Whisper (cortes en
+# los límites reales de las palabras) y tamaño máximo por defecto de cada uno
+WORD_TIMESTAMPS = os.environ.get("WORD_TIMESTAMPS", "0") == "1"
+DEFAULT_CUE_LIMITS = CueLimits(
+    max_words=int(os.environ.get("CUE_MAX_WORDS", "5")),
+    max_chars=int(os.environ.get("CUE_MAX_CHARS", "0")),
+    max_duration=float(os.environ.get("CUE_MAX_DURATION", "0"))
+)
+
+# Archivos de resultado en TEMP_DIR: caducan a las horas indicadas (los videos
+# antes, porque ocupan mucho más), con una cuota total de espacio (0 = sin
+# límite) y una limpieza periódica que también borra los temporales huérfanos
+ARTIFACT_TTL_SECONDS = float(os.environ.get("ARTIFACT_TTL_SECONDS", "86400"))
+ARTIFACT_VIDEO_TTL_SECONDS = float(os.environ.get("ARTIFACT_VIDEO_TTL_SECONDS", "21600"))
+ARTIFACT_MAX_MB = int(os.environ.get("ARTIFACT_MAX_MB", "5120"))
+ARTIFACT_SWEEP_SECONDS = float(os.environ.get("ARTIFACT_SWEEP_SECONDS", "300"))
+ARTIFACT_STALE_SECONDS = float(os.environ.get("ARTIFACT_STALE_SECONDS", "86400"))
+artifact_store = ArtifactStore(
+    TEMP_DIR, CACHE_DIR / "artifacts.sqlite3", ARTIFACT_TTL_SECONDS,
+    ARTIFACT_MAX_MB * 1024 * 1024, ARTIFACT_STALE_SECONDS
+)
+
+# Subidas reanudables (/uploads): los archivos completos se guardan una sola
+# vez por contenido en UPLOAD_DIR (en el mismo disco que temp_uploads para
+# poder enlazarlos sin copiarlos), caducan a las horas indicadas y tienen un
+# tamaño máximo (0 = sin límite)
+UPLOAD_DIR = Path(os.environ.get("UPLOAD_DIR", "uploads"))
+UPLOAD_TTL_SECONDS = float(os.environ.get("UPLOAD_TTL_SECONDS", "86400"))
+UPLOAD_MAX_MB = int(os.environ.get("UPLOAD_MAX_MB", "4096"))
+upload_store = UploadStore(
+    UPLOAD_DIR, CACHE_DIR / "uploads.sqlite3", UPLOAD_TTL_SECONDS, UPLOAD_MAX_MB * 1024 * 1024
+)
+
+# Descargas: si hay un nginx delante, con DOWNLOAD_ACCEL_REDIRECT (p. ej.
+# "/protected") el archivo lo envía nginx con sendfile vía X-Accel-Redirect.
+# MP4_FASTSTART mueve el índice del MP4 al principio para que el video se
+# pueda reproducir mientras se descarga (cuesta una pasada extra de escritura)
+DOWNLOAD_ACCEL_REDIRECT = os.environ.get("DOWNLOAD_ACCEL_REDIRECT", "")
+MP4_FASTSTART = os.environ.get("MP4_FASTSTART", "1") == "1"
+
+@dataclass
+class TranscriptionOptions:
+    """Opciones de una petición de transcripción que viajan hasta el worker"""
+    language: str
+    transcription_type: str = "vtt"
+    vad: bool = False
+    model: str = WHISPER_MODEL_NAME
+    word_timestamps: bool = WORD_TIMESTAMPS
+    cue_limits: CueLimits = DEFAULT_CUE_LIMITS
+
+@app.on_event("startup")
+def warm_default_model():
+    # El servidor empieza a escuchar sin esperar a que termine la carga. Con
+    # broker el modelo lo cargan los workers
+    if WARM_DEFAULT_MODEL and not BROKER_URL:
+        model_registry.warm(WHISPER_MODEL_NAME)
+
+async def sweep_artifacts_periodically():
+    while True:
+        await asyncio.sleep(ARTIFACT_SWEEP_SECONDS)
+        try:
+            await run_in_threadpool(artifact_store.sweep)
+            await run_in_threadpool(upload_store.sweep)
+        except Exception as e:
+            logger.error("Limpieza de archivos fallida: %s", e)
+
+@app.on_event("startup")
+async def start_artifact_sweeper():
+    app.state.artifact_sweeper = asyncio.create_task(sweep_artifacts_periodically())
+
+@app.on_event("shutdown")
+def shutdown_job_queue():
+    app.state.artifact_sweeper.cancel()
+    job_queue.shutdown()
+    if chunked_transcriber is not None:
+        chunked_transcriber.shutdown()
 
 def check_ffmpeg():
     """Verifica si FFmpeg está disponible"""
@@ -38,63 +286,71 @@ def check_ffmpeg():
     except (subprocess.CalledProcessError, FileNotFoundError):
         return False
 
-def get_media_duration(media_path: str):
+# Verificar FFmpeg una sola vez al arrancar en lugar de en cada petición
+FFMPEG_AVAILABLE = check_ffmpeg()
+if not FFMPEG_AVAILABLE:
+    logger.error("FFmpeg no encontrado. Las transcripciones y subtítulos fallarán hasta instalarlo.")
+
+def require_ffmpeg():
+    """Lanza un error si FFmpeg no estaba disponible al arrancar"""
+    if not FFMPEG_AVAILABLE:
+        raise HTTPException(
+            status_code=500,
+            detail="FFmpeg no está instalado. Por favor instala FFmpeg desde https://ffmpeg.org/download.html"
+        )
+
+# Un único ffprobe por archivo, cacheado por hash de contenido
+media_inspector = MediaInspector()
+
+def get_media_duration(media_path: str, content_hash: str = None):
     """Obtiene la duración del archivo de video o audio usando FFprobe"""
+    return media_inspector.inspect(media_path, content_hash).duration
+
+def check_media_duration(duration: float):
+    if MAX_MEDIA_DURATION and duration > MAX_MEDIA_DURATION:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El archivo debe durar menos de {MAX_MEDIA_DURATION // 60} minutos"
+        )
+
+def input_duration(media_path: str, content_hash: str, cleanup, check_limit: bool = True) -> float:
+    """Duración de una entrada ya guardada, para estimar el coste del trabajo.
+    
+    El ffprobe queda en la caché por hash, así el trabajo no vuelve a
+    analizar el archivo. Los archivos demasiado largos se rechazan aquí, antes
+    de encolarlos. Si ffprobe falla devuelve 0 y el error lo informa el trabajo.
+    """
     try:
-        cmd = [
-            'ffprobe', '-v', 'quiet', '-print_format', 'json',
-            '-show_format', '-show_streams', media_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        
-        import json
-        data = json.loads(result.stdout)
-        
-        # Buscar duración en streams de video o audio
-        for stream in data.get('streams', []):
-            if stream.get('codec_type') in ['video', 'audio']:
-                duration = float(stream.get('duration', 0))
-                if duration > 0:
-                    return duration
-        
-        # Si no se encuentra en streams, buscar en format
-        duration = float(data.get('format', {}).get('duration', 0))
-        return duration
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error obteniendo duración: {str(e)}")
+        duration = get_media_duration(media_path, content_hash)
+    except HTTPException:
+        return 0.0
+    if check_limit:
+        try:
+            check_media_duration(duration)
+        except HTTPException:
+            cleanup()
+            raise
+    return duration
+
+def extract_audio_or_process_audio(input_path: str, audio_path: str, content_hash: str = None,
+                                   on_progress=None):
+    """Extrae audio de un archivo de video o procesa archivo de audio usando FFmpeg.
 
-def extract_audio_or_process_audio(input_path: str, audio_path: str):
-    """Extrae audio de un archivo de video o procesa archivo de audio usando FFmpeg"""
+    `on_progress` recibe la fracción decodificada según la salida de `-progress`.
+    """
     try:
         # Verificar si FFmpeg está disponible
-        if not check_ffmpeg():
-            raise HTTPException(
-                status_code=500,
-                detail="FFmpeg no está instalado. Por favor instala FFmpeg desde https://ffmpeg.org/download.html"
-            )
+        require_ffmpeg()
         
-        # Obtener duración del archivo
-        duration = get_media_duration(input_path)
-        
-        # Verificar duración (máximo 30 minutos = 1800 segundos)
-        if duration > 1800:
-            raise HTTPException(status_code=400, detail="El archivo debe durar menos de 30 minutos")
-        
-        # Detectar si es archivo de video o audio
-        cmd = [
-            'ffprobe', '-v', 'quiet', '-print_format', 'json',
-            '-show_streams', input_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        # Obtener duración y streams del archivo con un único ffprobe
+        media_info = media_inspector.inspect(input_path, content_hash)
+        duration = media_info.duration
         
-        import json
-        data = json.loads(result.stdout)
+        # Verificar duración (máximo 30 minutos = 1800 segundos por defecto)
+        check_media_duration(duration)
         
         # Verificar si tiene stream de video
-        has_video = any(stream.get('codec_type') == 'video' for stream in data.get('streams', []))
-        
-        if has_video:
+        if media_info.has_video:
             # Es un archivo de video - extraer audio
             cmd = [
                 'ffmpeg', '-i', input_path, '-vn', '-acodec', 'pcm_s16le',
@@ -107,188 +363,449 @@ def extract_audio_or_process_audio(input_path: str, audio_path: str):
                 '-ar', '16000', '-ac', '1', '-y', audio_path
             ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        started = time.perf_counter()
+        result = run_ffmpeg(cmd, duration, on_progress)
         
         if result.returncode != 0:
             error_detail = f"Error procesando audio con FFmpeg: {result.stderr}"
-            print(f"ERROR - {error_detail}")
+            logger.error(error_detail)
             raise HTTPException(
                 status_code=500,
                 detail=error_detail
             )
         
-        print("DEBUG - FFmpeg completado exitosamente.")
+        DECODE_SECONDS.observe(time.perf_counter() - started, source="file")
+        logger.debug("FFmpeg completado exitosamente.")
         return duration
         
-    except HTTPException:
+    except (HTTPException, JobCancelled):
         raise
     except Exception as e:
         error_detail = f"Error procesando archivo: {str(e)}"
-        print(f"ERROR - {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
-def transcribe_audio(audio_path: str, language: str):
-    """Transcribe audio usando Whisper"""
+def whisper_language(language: str) -> str:
+    """Mapea el idioma del formulario al código que espera Whisper"""
+    lang_map = {
+        "spanish": "es",
+        "english": "en"
+    }
+    return lang_map.get(language.lower(), "es")
+
+def transcribe_audio(audio, language: str, model_name: str = WHISPER_MODEL_NAME,
+                     on_segment=None, word_timestamps: bool = False,
+                     condition_on_previous_text: bool = True):
+    """Transcribe audio usando Whisper (ruta a un archivo o array float32 a 16 kHz).
+
+    `on_segment` recibe cada segmento en cuanto el motor lo decodifica. Con
+    `word_timestamps` Whisper alinea cada palabra tras decodificar el segmento.
+    Sin `condition_on_previous_text` cada ventana se decodifica sin el texto
+    de la anterior.
+    """
     try:
-        # Mapear idiomas
-        lang_map = {
-            "spanish": "es",
-            "english": "en"
-        }
-        
-        whisper_lang = lang_map.get(language.lower(), "es")
+        whisper_lang = whisper_language(language)
+        options = {"word_timestamps": True} if word_timestamps else {}
+        if not condition_on_previous_text:
+            options["condition_on_previous_text"] = False
         
         # Transcribir
-        print(f"DEBUG - Iniciando transcripción con Whisper para el idioma: {whisper_lang}")
-        result = model.transcribe(audio_path, language=whisper_lang)
-        print("DEBUG - Transcripción con Whisper completada.")
+        logger.debug("Iniciando transcripción con Whisper '%s' para el idioma: %s", model_name, whisper_lang)
+        started = time.perf_counter()
+        if (chunked_transcriber is not None and model_name == chunked_transcriber.model_name
+                and not isinstance(audio, str)
+                and len(audio) / SAMPLE_RATE >= CHUNKED_MIN_DURATION):
+            # Audio largo: fragmentos en paralelo en el pool de procesos
+            logger.debug("Transcripción en paralelo con %s procesos", CHUNKED_WORKERS)
+            result = chunked_transcriber.transcribe(
+                audio, whisper_lang, on_segment=on_segment, **options
+            )
+        else:
+            backend = model_registry.get(model_name)
+            with whisper_semaphore:
+                result = backend.transcribe(audio, whisper_lang, on_segment=on_segment, **options)
+        if not isinstance(audio, str) and len(audio):
+            # Segundos de cómputo por segundo de audio (incluye la espera del semáforo)
+            WHISPER_RTF.observe(
+                (time.perf_counter() - started) / (len(audio) / SAMPLE_RATE), model=model_name
+            )
+        logger.debug("Transcripción con Whisper completada.")
         return result
+    except JobCancelled:
+        raise
     except Exception as e:
         error_detail = f"Error en transcripción con Whisper: {str(e)}"
-        print(f"ERROR - {error_detail}")
+        logger.error(error_detail)
         raise HTTPException(status_code=500, detail=error_detail)
 
-def create_vtt_file(transcription_result, output_path: str):
-    """Convierte la transcripción a formato VTT con máximo 5 palabras por segmento"""
+def create_vtt_file(transcription_result, output_path: str,
+                    limits: CueLimits = DEFAULT_CUE_LIMITS):
+    """Convierte la transcripción a formato VTT con subtítulos de máximo
+    `limits.max_words` palabras (5 por defecto)"""
     try:
+        started = time.perf_counter()
         with open(output_path, 'w', encoding='utf-8') as f:
-            f.write("WEBVTT\n\n")
-            
-            segment_counter = 1
-            
-            for segment in transcription_result['segments']:
-                start_time_seconds = segment['start']
-                end_time_seconds = segment['end']
-                text = segment['text'].strip()
-                
-                # Dividir el texto en palabras
-                words = text.split()
-                
-                # Si el segmento tiene 5 palabras o menos, mantenerlo como está
-                if len(words) <= 5:
-                    start_time = format_timestamp(start_time_seconds)
-                    end_time = format_timestamp(end_time_seconds)
-                    
-                    f.write(f"{segment_counter}\n")
-                    f.write(f"{start_time} --> {end_time}\n")
-                    f.write(f"{text}\n\n")
-                    segment_counter += 1
-                else:
-                    # Dividir en sub-segmentos de máximo 5 palabras
-                    segment_duration = end_time_seconds - start_time_seconds
-                    total_words = len(words)
-                    
-                    # Crear sub-segmentos
-                    for i in range(0, total_words, 5):
-                        # Obtener las palabras para este sub-segmento
-                        sub_words = words[i:i+5]
-                        sub_text = ' '.join(sub_words)
-                        
-                        # Calcular timestamps proporcionales
-                        words_in_subsegment = len(sub_words)
-                        words_processed = i
-                        
-                        # Calcular tiempo de inicio y fin proporcional
-                        sub_start = start_time_seconds + (words_processed / total_words) * segment_duration
-                        sub_end = start_time_seconds + ((words_processed + words_in_subsegment) / total_words) * segment_duration
-                        
-                        # Formatear timestamps
-                        sub_start_formatted = format_timestamp(sub_start)
-                        sub_end_formatted = format_timestamp(sub_end)
-                        
-                        # Escribir sub-segmento
-                        f.write(f"{segment_counter}\n")
-                        f.write(f"{sub_start_formatted} --> {sub_end_formatted}\n")
-                        f.write(f"{sub_text}\n\n")
-                        segment_counter += 1
-                
+            f.writelines(iter_vtt(transcription_result['segments'], limits))
+        OUTPUT_WRITE_SECONDS.observe(time.perf_counter() - started, format="vtt")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creando archivo VTT: {str(e)}")
 
 def create_clean_transcription(transcription_result, output_path: str):
-    """Convierte la transcripción a formato de texto limpio sin timestamps"""
+    """Convierte la transcripción a formato de texto limpio sin timestamps,
+    en párrafos de unas 3 oraciones"""
     try:
+        started = time.perf_counter()
         with open(output_path, 'w', encoding='utf-8') as f:
-            # Recopilar todo el texto de los segmentos
-            full_text = ""
-            for segment in transcription_result['segments']:
-                text = segment['text'].strip()
-                if text:
-                    full_text += text + " "
-            
-            # Limpiar el texto y crear párrafos más naturales
-            full_text = full_text.strip()
-            
-            # Dividir en oraciones usando puntos, signos de exclamación y interrogación
-            import re
-            sentences = re.split(r'[.!?]+', full_text)
-            
-            # Agrupar oraciones en párrafos (aproximadamente cada 3-4 oraciones)
-            paragraphs = []
-            current_paragraph = []
-            
-            for sentence in sentences:
-                sentence = sentence.strip()
-                if sentence:
-                    current_paragraph.append(sentence)
-                    
-                    # Crear nuevo párrafo cada 3-4 oraciones o si la oración es muy larga
-                    if len(current_paragraph) >= 3 or len(sentence) > 100:
-                        paragraphs.append('. '.join(current_paragraph) + '.')
-                        current_paragraph = []
-            
-            # Añadir último párrafo si queda contenido
-            if current_paragraph:
-                paragraphs.append('. '.join(current_paragraph) + '.')
-            
-            # Si no se pudieron crear párrafos, usar el texto completo
-            if not paragraphs:
-                paragraphs = [full_text]
-            
-            # Escribir párrafos separados por líneas en blanco
-            for i, paragraph in enumerate(paragraphs):
-                f.write(paragraph)
-                if i < len(paragraphs) - 1:  # No añadir línea extra al final
-                    f.write('\n')
-                
+            f.writelines(iter_clean_text(transcription_result['segments']))
+        OUTPUT_WRITE_SECONDS.observe(time.perf_counter() - started, format="clean")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creando transcripción limpia: {str(e)}")
 
-def format_timestamp(seconds):
-    """Convierte segundos a formato VTT (HH:MM:SS.mmm)"""
-    hours = int(seconds // 3600)
-    minutes = int((seconds % 3600) // 60)
-    secs = seconds % 60
-    return f"{hours:02d}:{minutes:02d}:{secs:06.3f}"
-
 @app.get("/")
 async def root():
     return {
         "message": "Video Transcription API",
         "status": "running",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "ffmpeg_available": FFMPEG_AVAILABLE,
+        "queue": job_queue.stats(),
+        "media_probe_cache": media_inspector.stats(),
+        "transcript_cache": transcript_cache.stats(),
+        "ass_cache": ass_cache.stats(),
+        "artifacts": artifact_store.stats(),
+        "uploads": upload_store.stats(),
+        "admission": admission.stats(),
+        "models": model_registry.stats()
     }
 
-@app.post("/transcribe")
-async def transcribe_media(
-    file: UploadFile = File(...),
-    language: str = Form(...),
-    transcription_type: str = Form("vtt")
+def cache_metric_values(field: str):
+    caches = {
+        "transcript": transcript_cache.stats(),
+        "ass": ass_cache.stats(),
+        "media_probe": media_inspector.stats(),
+    }
+    return [((name,), stats[field]) for name, stats in caches.items()]
+
+def queue_metric_values():
+    stats = job_queue.stats()
+    return [((state,), stats[state]) for state in ("queued", "running")]
+
+def model_metric_values(field: str):
+    stats = model_registry.stats()
+    return [((), stats[field])]
+
+# Métricas calculadas en cada consulta a partir de los stats() existentes
+REGISTRY.callback("job_queue_jobs", "Trabajos en cola o en curso", ("state",), queue_metric_values)
+REGISTRY.callback("admission_outstanding_seconds",
+                  "Segundos de trabajo estimados en cola o en curso por pool", ("pool",),
+                  lambda: [((pool,), stats["outstanding_seconds"])
+                           for pool, stats in admission.stats()["pools"].items()])
+REGISTRY.callback("job_queue_workers", "Workers de la cola de trabajos", (),
+                  lambda: [((), job_queue.max_workers)])
+# Las cachés en memoria y los modelos son de cada proceso: con broker los
+# workers también los envían (per_process)
+REGISTRY.callback("cache_hits_total", "Aciertos de las cachés", ("cache",),
+                  lambda: cache_metric_values("hits"), type_name="counter", per_process=True)
+REGISTRY.callback("cache_misses_total", "Fallos de las cachés", ("cache",),
+                  lambda: cache_metric_values("misses"), type_name="counter", per_process=True)
+REGISTRY.callback("whisper_models_loaded", "Modelos de Whisper en memoria", (),
+                  lambda: [((), len(model_registry.stats()["loaded"]))], per_process=True)
+REGISTRY.callback("whisper_models_memory_estimate_bytes",
+                  "Memoria estimada de los modelos cargados", (),
+                  lambda: [((), model_registry.stats()["memory_estimate_mb"] * 1024 * 1024)],
+                  per_process=True)
+REGISTRY.callback("whisper_model_loads_total", "Cargas de modelos", (),
+                  lambda: model_metric_values("loads"), type_name="counter", per_process=True)
+REGISTRY.callback("whisper_model_evictions_total", "Modelos expulsados de memoria", (),
+                  lambda: model_metric_values("evictions"), type_name="counter", per_process=True)
+REGISTRY.callback("artifacts_bytes", "Espacio ocupado por los archivos generados", (),
+                  lambda: [((), artifact_store.stats()["size_bytes"])])
+
+@app.get("/metrics")
+async def metrics():
+    """Métricas en formato de texto de Prometheus. Con broker incluye las de
+    cada worker (etiqueta `worker`), enviadas con su última señal de vida"""
+    def render():
+        return REGISTRY.render(job_queue.worker_metrics() if BROKER_URL else None)
+    return Response(await run_in_threadpool(render), media_type=METRICS_CONTENT_TYPE)
+
+def record_upload(request: Request, endpoint: str, size: int):
+    """Registra tamaño y tiempo de una subida (desde que empezó la petición)
+    y devuelve el tiempo para el desglose del trabajo"""
+    seconds = time.perf_counter() - request.state.started_at
+    UPLOAD_BYTES.observe(size, endpoint=endpoint)
+    UPLOAD_SECONDS.observe(seconds, endpoint=endpoint)
+    return {"upload": seconds}
+
+def request_client_id(request: Request) -> str:
+    """Cliente al que se atribuye una petición para repartir la capacidad"""
+    if CLIENT_ID_HEADER and request.headers.get(CLIENT_ID_HEADER):
+        return request.headers[CLIENT_ID_HEADER]
+    return request.client.host if request.client else "unknown"
+
+def submit_job(client_id: str, cost: JobCost, kind: str, func, *args, cleanup=None, **kwargs):
+    """Encola un trabajo si cabe en la capacidad; si no, borra su entrada y
+    responde 429 con Retry-After"""
+    try:
+        ticket = admission.admit(client_id, cost)
+    except HTTPException:
+        if cleanup is not None:
+            cleanup()
+        raise
+    try:
+        job = job_queue.submit(
+            kind, func, *args, cleanup=cleanup, client_id=client_id, cost=cost.total, **kwargs
+        )
+    except Exception:
+        admission.release(ticket)
+        raise
+    admission.attach(ticket, job.id)
+    return job
+
+def save_upload(upload: UploadFile, destination):
+    """Guarda en disco un archivo subido y devuelve el SHA-256 de su contenido.
+
+    El hash se calcula mientras se copia, sin volver a leer el archivo.
+    """
+    digest = hashlib.sha256()
+    with open(destination, "wb") as buffer:
+        for chunk in iter_file_chunks(upload.file):
+            digest.update(chunk)
+            buffer.write(chunk)
+    return digest.hexdigest()
+
+def input_source(file: UploadFile = None, upload_id: str = None):
+    """Nombre y tipo del archivo de entrada: subido en la propia petición o
+    antes con /uploads (`upload_id`)"""
+    if (file is None) == (upload_id is None):
+        raise HTTPException(status_code=400, detail="Envía el archivo o un upload_id (uno de los dos)")
+    if file is not None:
+        return file.filename, file.content_type
+    upload = upload_store.get(upload_id)
+    return upload.filename, upload.content_type
+
+async def store_input(file: UploadFile, upload_id: str, destination) -> str:
+    """Guarda la entrada en `destination` y devuelve el SHA-256 de su contenido"""
+    if upload_id is not None:
+        # Ya está en disco: se enlaza sin volver a copiar ni a calcular el hash
+        return await run_in_threadpool(upload_store.materialize, upload_id, destination)
+    return await run_in_threadpool(save_upload, file, destination)
+
+def upload_response(upload, status_code: int = 200):
+    return JSONResponse(
+        upload.to_dict(), status_code=status_code,
+        headers={"Upload-Offset": str(upload.offset), "Upload-Length": str(upload.size)}
+    )
+
+@app.post("/uploads", status_code=201)
+async def create_upload(
+    filename: str = Form(...),
+    size: int = Form(...),
+    content_type: str = Form("application/octet-stream"),
+    sha256: str = Form(None)
 ):
-    """Endpoint principal para transcribir videos o audios"""
+    """Crea una subida reanudable. Con `sha256` (del archivo completo) se
+    comprueba al terminar que el contenido llegó entero"""
+    upload = await run_in_threadpool(
+        upload_store.create, safe_filename(filename), size, content_type, sha256
+    )
+    return upload_response(upload, status_code=201)
+
+@app.api_route("/uploads/{upload_id}", methods=["GET", "HEAD"])
+async def get_upload(upload_id: str):
+    """Estado de una subida; `Upload-Offset` indica desde dónde continuar"""
+    return upload_response(await run_in_threadpool(upload_store.get, upload_id))
+
+@app.patch("/uploads/{upload_id}")
+async def append_upload(upload_id: str, request: Request, upload_offset: int = Header(...)):
+    """Añade al archivo el cuerpo de la petición, que empieza en el byte
+    `Upload-Offset`. Si la conexión se corta se conserva lo recibido"""
+    writer = await run_in_threadpool(upload_store.open_append, upload_id, upload_offset)
+    # Se escribe en bloques de ~1 MB para no saltar al threadpool por cada paquete
+    buffer = bytearray()
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= 1024 * 1024:
+                await run_in_threadpool(writer.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await run_in_threadpool(writer.write, bytes(buffer))
+    finally:
+        upload = await run_in_threadpool(writer.close)
+    record_upload(request, "uploads", upload.offset - upload_offset)
+    return upload_response(upload)
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    await run_in_threadpool(upload_store.delete, upload_id)
+    return {"message": "Subida eliminada"}
+
+def run_transcription_job(job, input_path: Path, audio_path: Path, output_path: Path,
+                          output_filename: str, options: TranscriptionOptions,
+                          content_hash: str = None):
+    """Ejecuta FFmpeg + Whisper para un trabajo de transcripción encolado"""
+    log = job_logger(logger, job)
+    # Extraer o procesar audio
+    job.set_stage("extracting_audio")
+    log.debug("Iniciando extracción de audio para: %s", input_path)
+    duration = extract_audio_or_process_audio(
+        str(input_path), str(audio_path), content_hash, on_progress=job.set_progress
+    )
+    log.debug("Extracción de audio completada. Duración: %ss", duration)
+    
+    # Cargar el WAV en memoria: sirve para calcular el hash del audio y evita
+    # que Whisper lo vuelva a decodificar con FFmpeg
+    audio = read_wav_audio(str(audio_path))
+    return finish_transcription(job, audio, duration, output_path, output_filename, options)
+
+def run_stream_transcription_job(job, audio, output_path: Path, output_filename: str,
+                                 options: TranscriptionOptions):
+    """Transcribe un audio ya decodificado en memoria (modo streaming)"""
+    if isinstance(audio, Path):
+        # Con broker el audio llega en un archivo .npy
+        audio = np.load(audio)
+    duration = len(audio) / SAMPLE_RATE
+    return finish_transcription(job, audio, duration, output_path, output_filename, options)
+
+def transcribe_speech_only(job, audio, options: TranscriptionOptions):
+    """Transcribe solo las regiones con voz y devuelve los segmentos en la
+    línea de tiempo original junto con la línea de tiempo del VAD"""
+    speech, timeline = extract_speech(audio)
+    job_logger(logger, job).info(
+        "VAD: %.1fs de voz, %.1fs omitidos", timeline.speech_seconds, timeline.skipped_seconds
+    )
+    
+    if len(speech) == 0:
+        # No hay voz: no tiene sentido ejecutar Whisper
+        return {"text": "", "segments": [], "language": None}, timeline
+    
+    on_segment = segment_reporter(job, len(speech) / SAMPLE_RATE, timeline)
+    transcription = transcribe_audio(
+        speech, options.language, options.model, on_segment, options.word_timestamps
+    )
+    return remap_segments(transcription, timeline), timeline
+
+def segment_reporter(job, duration: float, timeline=None):
+    """Callback que publica cada segmento decodificado como evento del trabajo,
+    para que el cliente vea la transcripción parcial mientras avanza"""
+    def on_segment(segment):
+        start, end = segment['start'], segment['end']
+        progress = end / duration if duration else 0.0
+        if timeline is not None:
+            # Con VAD los tiempos vienen del audio recortado
+            start = timeline.to_original(start, is_start=True)
+            end = timeline.to_original(end)
+        job.set_progress(
+            progress, event_type="segment",
+            start=round(start, 3), end=round(end, 3), text=segment['text'].strip()
+        )
+    return on_segment
+
+def finish_transcription(job, audio, duration: float, output_path: Path,
+                         output_filename: str, options: TranscriptionOptions):
+    """Transcribe el audio y escribe el archivo de salida del trabajo"""
+    log = job_logger(logger, job)
+    # El VAD cambia el resultado, así que forma parte de la clave de la caché
+    cache_model = model_registry.cache_key(options.model)
+    if options.vad:
+        cache_model += "+vad"
+    if options.word_timestamps:
+        cache_model += "+words"
     
-    # Debug logging para verificar parámetros recibidos
-    print(f"DEBUG - Parámetros recibidos:")
-    print(f"DEBUG - file.filename: {file.filename}")
-    print(f"DEBUG - file.content_type: {file.content_type}")
-    print(f"DEBUG - language: {language}")
-    print(f"DEBUG - transcription_type: '{transcription_type}'")
-    print(f"DEBUG - transcription_type.lower(): '{transcription_type.lower()}'")
+    # Buscar primero en la caché: mismo audio, idioma y modelo
+    language = options.language.lower()
+    audio_hash = audio_content_hash(audio)
+    transcription = transcript_cache.get(audio_hash, language, cache_model)
+    cached = transcription is not None
+    timeline = None
     
+    if cached:
+        log.info("Transcripción encontrada en caché, se omite Whisper")
+        job.set_stage("reading_cache")
+        on_segment = segment_reporter(job, duration)
+        for segment in transcription['segments']:
+            on_segment(segment)
+    else:
+        # Transcribir audio
+        job.set_stage("transcribing")
+        log.debug("Iniciando transcripción del audio")
+        if options.vad:
+            transcription, timeline = transcribe_speech_only(job, audio, options)
+        else:
+            transcription = transcribe_audio(
+                audio, options.language, options.model, segment_reporter(job, duration),
+                options.word_timestamps
+            )
+        transcript_cache.put(audio_hash, language, cache_model, transcription)
+        log.debug("Transcripción completada.")
+    
+    # Los segmentos se guardan para poder exportarlos después en cualquier
+    # formato (/jobs/{id}/export) sin volver a ejecutar Whisper
+    segments_name = segments_artifact_name(job.id)
+    write_segments_artifact(str(artifact_store.path(segments_name)), transcription, {
+        "language": options.language,
+        "model": options.model,
+        "word_timestamps": options.word_timestamps,
+        "cue_limits": asdict(options.cue_limits),
+    })
+    
+    # Crear archivo según el tipo solicitado
+    job.set_stage("writing_output")
+    log.debug("Creando archivo de transcripción en: %s", output_path)
+    
+    if options.transcription_type == "clean":
+        create_clean_transcription(transcription, str(output_path))
+        transcription_message = "Transcripción limpia completada exitosamente"
+    else:
+        create_vtt_file(transcription, str(output_path), options.cue_limits)
+        transcription_message = "Transcripción VTT completada exitosamente"
+    log.debug(transcription_message)
+    artifact_store.register(segments_name)
+    expires_at = artifact_store.register(output_filename)
+    
+    # Retornar información de la transcripción
+    return {
+        "message": transcription_message,
+        "duration": round(duration, 2),
+        "language": options.language,
+        "transcription_type": options.transcription_type,
+        "model": options.model,
+        "word_timestamps": options.word_timestamps,
+        "original_segments_count": len(transcription['segments']),
+        "cached": cached,
+        "vad": vad_summary(timeline) if options.vad else None,
+        "download_url": f"/download/{output_filename}",
+        "export_url": f"/jobs/{job.id}/export",
+        "expires_at": expires_at
+    }
+
+def segments_artifact_name(job_id: str) -> str:
+    """Artefacto con los segmentos de Whisper de un trabajo de transcripción"""
+    return f"segments_{job_id}.jsonl"
+
+def vad_summary(timeline):
+    """Resumen del audio omitido por el VAD (None si el resultado vino de caché)"""
+    if timeline is None:
+        return None
+    return {
+        "speech_seconds": round(timeline.speech_seconds, 2),
+        "skipped_seconds": round(timeline.skipped_seconds, 2),
+        "speech_regions": len(timeline.regions)
+    }
+
+def validate_transcription_params(content_type: str, language: str, transcription_type: str,
+                                  model: str = WHISPER_MODEL_NAME):
+    """Valida los parámetros comunes de los endpoints de transcripción"""
     # Validar tipo de archivo
-    if not (file.content_type.startswith('video/') or file.content_type.startswith('audio/')):
+    if not content_type or not (content_type.startswith('video/') or content_type.startswith('audio/')):
         raise HTTPException(status_code=400, detail="El archivo debe ser un video o audio")
     
+    validate_transcription_options(language, transcription_type, model)
+
+def validate_transcription_options(language: str, transcription_type: str,
+                                   model: str = WHISPER_MODEL_NAME):
+    """Valida idioma, tipo de salida y modelo"""
     # Validar idioma de entrada
     if language.lower() not in ['spanish', 'english']:
         raise HTTPException(status_code=400, detail="Idioma debe ser 'spanish' o 'english'")
@@ -297,120 +814,855 @@ async def transcribe_media(
     if transcription_type.lower() not in ['vtt', 'clean']:
         raise HTTPException(status_code=400, detail="Tipo de transcripción debe ser 'vtt' o 'clean'")
     
-    # Crear nombres de archivos temporales
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    input_filename = f"input_{timestamp}_{file.filename}"
-    audio_filename = f"audio_{timestamp}.wav"
-    
-    # Determinar extensión del archivo de salida según el tipo
+    # Validar modelo de Whisper
+    if not model_registry.is_allowed(model):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Modelo debe ser uno de: {', '.join(sorted(model_registry.allowed_models))}"
+        )
+
+def resolve_cue_limits(max_words: int = None, max_chars: int = None,
+                       max_cue_duration: float = None,
+                       base: CueLimits = DEFAULT_CUE_LIMITS) -> CueLimits:
+    """Aplica los límites de subtítulo de la petición sobre `base` (por
+    defecto, los configurados en el entorno)"""
+    limits = base
+    if max_words is not None:
+        if max_words < 1:
+            raise HTTPException(status_code=400, detail="max_words debe ser al menos 1")
+        limits = replace(limits, max_words=max_words)
+    if max_chars is not None:
+        if max_chars < 0:
+            raise HTTPException(status_code=400, detail="max_chars no puede ser negativo")
+        limits = replace(limits, max_chars=max_chars)
+    if max_cue_duration is not None:
+        if max_cue_duration < 0:
+            raise HTTPException(status_code=400, detail="max_cue_duration no puede ser negativo")
+        limits = replace(limits, max_duration=max_cue_duration)
+    return limits
+
+def transcription_output_filename(transcription_type: str):
+    """Determina el nombre del archivo de salida según el tipo"""
     if transcription_type.lower() == "clean":
-        output_filename = f"transcription_{timestamp}.txt"
-    else:
-        output_filename = f"transcription_{timestamp}.vtt"
+        return unique_name("transcription", "txt")
+    return unique_name("transcription", "vtt")
+
+def enqueue_stream_transcription(audio, options: TranscriptionOptions, timings: dict = None,
+                                 client_id: str = None):
+    """Encola la transcripción de un audio ya decodificado en memoria"""
+    cost = JobCost(audio=transcription_cost(
+        len(audio) / SAMPLE_RATE, options.model, options.word_timestamps
+    ))
+    output_filename = transcription_output_filename(options.transcription_type)
+    output_path = TEMP_DIR / output_filename
+    
+    cleanup = None
+    if isinstance(job_queue, BrokerJobQueue):
+        # El worker puede estar en otro proceso: el audio se le pasa por el
+        # almacenamiento compartido en vez de dentro del mensaje del broker
+        audio_path = TEMP_DIR / f"audio_{uuid.uuid4().hex}.npy"
+        np.save(audio_path, audio)
+        audio, cleanup = audio_path, partial(remove_paths, audio_path)
+    
+    job = submit_job(
+        client_id, cost, "transcription", run_stream_transcription_job,
+        audio, output_path, output_filename, options, cleanup=cleanup, timings=timings
+    )
+    logger.info("Trabajo de transcripción (streaming) encolado: %s", job.id)
+    
+    return {
+        "message": "Transcripción encolada",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+@app.post("/transcribe", status_code=202)
+async def transcribe_media(
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
+    language: str = Form(...),
+    transcription_type: str = Form("vtt"),
+    streaming: bool = Form(False),
+    vad: bool = Form(False),
+    model: str = Form(WHISPER_MODEL_NAME),
+    word_timestamps: bool = Form(WORD_TIMESTAMPS),
+    max_words: int = Form(None),
+    max_chars: int = Form(None),
+    max_cue_duration: float = Form(None)
+):
+    """Endpoint principal para transcribir videos o audios (subidos en la
+    petición o antes con /uploads)"""
+    
+    filename, content_type = await run_in_threadpool(input_source, file, upload_id)
+    logger.debug(
+        "Parámetros recibidos: filename=%s content_type=%s language=%s transcription_type=%s "
+        "streaming=%s vad=%s model=%s word_timestamps=%s",
+        filename, content_type, language, transcription_type,
+        streaming, vad, model, word_timestamps
+    )
+    
+    validate_transcription_params(content_type, language, transcription_type, model)
+    options = TranscriptionOptions(
+        language, transcription_type.lower(), vad, model, word_timestamps,
+        resolve_cue_limits(max_words, max_chars, max_cue_duration)
+    )
+    
+    # Si ya no cabe ni un trabajo se rechaza sin guardar ni decodificar nada
+    client_id = request_client_id(request)
+    admission.check(client_id, [POOL_AUDIO])
+    
+    # El multipart ya está recibido: la subida terminó
+    timings = record_upload(request, "transcribe", file.size or 0) if file is not None else {}
+    
+    # Con upload_id el archivo ya está en disco y se usa el flujo basado en archivos
+    if streaming and file is not None:
+        # Modo streaming: la subida va directa a FFmpeg por stdin y el audio
+        # queda en memoria, sin archivo de entrada ni WAV intermedio
+        try:
+            started = time.perf_counter()
+            audio = await run_in_threadpool(
+                decode_audio_stream, iter_file_chunks(file.file), MAX_MEDIA_DURATION or None
+            )
+            timings["decoding_audio"] = time.perf_counter() - started
+            return enqueue_stream_transcription(audio, options, timings, client_id)
+        except HTTPException as e:
+            if e.status_code != 500:
+                raise
+            # Contenedores que no se pueden leer desde un pipe (p. ej. MP4 con
+            # el átomo moov al final) se procesan con el flujo basado en archivos
+            logger.info("Decodificación en streaming falló, usando archivo temporal: %s", e.detail)
+            await run_in_threadpool(file.file.seek, 0)
+    
+    # Crear nombres de archivos temporales
+    token = uuid.uuid4().hex
+    input_filename = f"input_{token}_{safe_filename(filename)}"
+    audio_filename = f"audio_{token}.wav"
+    output_filename = transcription_output_filename(transcription_type)
     
     input_path = TEMP_DIR / input_filename
     audio_path = TEMP_DIR / audio_filename
     output_path = TEMP_DIR / output_filename
     
     try:
-        # Guardar archivo subido
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Guardar archivo subido sin bloquear el event loop
+        started = time.perf_counter()
+        content_hash = await store_input(file, upload_id, input_path)
+        timings["saving_upload"] = time.perf_counter() - started
+    except HTTPException:
+        raise
+    except Exception as e:
+        if input_path.exists():
+            input_path.unlink()
+        raise HTTPException(status_code=500, detail=f"Error guardando archivo: {str(e)}")
+    
+    # Limpiar archivos temporales (excepto archivo de transcripción)
+    cleanup = partial(remove_paths, input_path, audio_path)
+    
+    duration = await run_in_threadpool(input_duration, str(input_path), content_hash, cleanup)
+    cost = JobCost(audio=transcription_cost(duration, options.model, options.word_timestamps))
+    
+    # Encolar el trabajo y responder inmediatamente con su identificador
+    job = submit_job(
+        client_id, cost, "transcription", run_transcription_job,
+        input_path, audio_path, output_path, output_filename, options, content_hash,
+        cleanup=cleanup, timings=timings
+    )
+    logger.info("Trabajo de transcripción encolado: %s", job.id)
+    
+    return {
+        "message": "Transcripción encolada",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+@app.post("/transcribe/stream", status_code=202)
+async def transcribe_media_stream(
+    request: Request,
+    language: str,
+    transcription_type: str = "vtt",
+    vad: bool = False,
+    model: str = WHISPER_MODEL_NAME,
+    word_timestamps: bool = WORD_TIMESTAMPS,
+    max_words: int = None,
+    max_chars: int = None,
+    max_cue_duration: float = None
+):
+    """Transcribe el cuerpo crudo de la petición sin escribirlo nunca a disco.
+
+    El archivo se envía como cuerpo binario (no multipart) y cada bloque que
+    llega se pasa directamente a FFmpeg mientras continúa la subida.
+    """
+    validate_transcription_params(
+        request.headers.get('content-type', ''), language, transcription_type, model
+    )
+    options = TranscriptionOptions(
+        language, transcription_type.lower(), vad, model, word_timestamps,
+        resolve_cue_limits(max_words, max_chars, max_cue_duration)
+    )
+    
+    client_id = request_client_id(request)
+    admission.check(client_id, [POOL_AUDIO])
+    
+    # Cola acotada: si FFmpeg va más lento que la red, la subida espera
+    chunk_queue = queue.Queue(maxsize=16)
+    loop = asyncio.get_running_loop()
+    decode_task = loop.run_in_executor(
+        None, decode_audio_stream, iter_queue_chunks(chunk_queue), MAX_MEDIA_DURATION or None
+    )
+    
+    async def put_chunk(item):
+        # Espera a que haya hueco en la cola mientras FFmpeg siga consumiendo
+        while not decode_task.done():
+            try:
+                await run_in_threadpool(chunk_queue.put, item, True, 0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if chunk and not await put_chunk(chunk):
+                # FFmpeg terminó antes (error o duración excedida)
+                break
+    finally:
+        # Señal de fin de datos para el hilo que alimenta a FFmpeg
+        await put_chunk(None)
+    
+    audio = await decode_task
+    # La subida y la decodificación van a la vez: el tiempo incluye ambas
+    return enqueue_stream_transcription(
+        audio, options, record_upload(request, "transcribe_stream", received), client_id
+    )
+
+@dataclass
+class BatchEntry:
+    """Un archivo de un lote: nombre original, copia en disco y nombre de su
+    transcripción dentro del zip de resultados"""
+    name: str
+    path: Path
+    output_name: str
+
+def save_batch_uploads(files: List[UploadFile], batch_dir: Path, extension: str) -> List[BatchEntry]:
+    """Guarda los archivos del lote (descomprimiendo los zip) en `batch_dir`.
+    
+    Lanza ValueError si hay demasiados archivos, ocupan más de BATCH_MAX_MB o
+    un zip no es válido.
+    """
+    max_bytes = BATCH_MAX_MB * 1024 * 1024
+    saved = []
+    saved_bytes = 0
+    for index, upload in enumerate(files):
+        if is_zip_upload(upload.filename, upload.content_type):
+            zip_path = batch_dir / f"upload_{index:05d}.zip"
+            save_upload(upload, zip_path)
+            # El zip se extrae con lo que queda del límite del lote (al menos
+            # un byte, para que un límite agotado siga rechazándolo)
+            extracted = extract_zip(
+                str(zip_path), str(batch_dir), BATCH_MAX_FILES - len(saved),
+                max(max_bytes - saved_bytes, 1) if max_bytes else 0
+            )
+            zip_path.unlink()
+            saved.extend(extracted)
+            saved_bytes += sum(os.path.getsize(path) for _, path in extracted)
+        else:
+            path = batch_dir / f"file_{index:05d}_{safe_filename(upload.filename)}"
+            save_upload(upload, path)
+            saved.append((upload.filename, str(path)))
+            saved_bytes += path.stat().st_size
+        if len(saved) > BATCH_MAX_FILES:
+            raise ValueError(f"Un lote admite como máximo {BATCH_MAX_FILES} archivos")
+        if max_bytes and saved_bytes > max_bytes:
+            raise ValueError(f"El lote ocupa más de {BATCH_MAX_MB} MB")
+    
+    entries = []
+    used_names = set()
+    for name, path in saved:
+        stem = Path(safe_filename(name)).stem
+        output_name = f"{stem}.{extension}"
+        counter = 2
+        while output_name in used_names:
+            output_name = f"{stem}_{counter}.{extension}"
+            counter += 1
+        used_names.add(output_name)
+        entries.append(BatchEntry(name, Path(path), output_name))
+    return entries
+
+def batch_durations(entries: List[BatchEntry]) -> List[float]:
+    """Duración de cada archivo del lote (ffprobe en paralelo) para repartirlo
+    en paquetes y estimar su coste. Los archivos que no se pueden analizar
+    cuentan 0: fallarán al decodificarlos en el trabajo"""
+    def duration(entry: BatchEntry):
+        try:
+            return probe_media(str(entry.path)).duration
+        except HTTPException:
+            return 0.0
+    with ThreadPoolExecutor() as executor:
+        return list(executor.map(duration, entries))
+
+def decode_batch_file(path: Path):
+    """Decodifica un archivo del lote comprobando que tenga audio y no sea
+    demasiado largo"""
+    audio = load_audio(str(path))
+    duration = len(audio) / SAMPLE_RATE
+    if duration == 0:
+        raise HTTPException(status_code=400, detail="El archivo no contiene audio")
+    check_media_duration(duration)
+    return audio
+
+def batch_extension(options: TranscriptionOptions) -> str:
+    return "txt" if options.transcription_type == "clean" else "vtt"
+
+def run_batch_pack(job, batch_dir: Path, entries: Dict[int, BatchEntry],
+                   options: TranscriptionOptions):
+    """Transcribe un paquete de archivos de un lote (índice en el lote ->
+    archivo) y deja sus transcripciones en `batch_dir/outputs`.
+    
+    Los clips se unen uno detrás de otro y se transcriben de una vez. Un
+    archivo que falla no detiene el paquete: queda marcado en el resultado.
+    """
+    cache_model = model_registry.cache_key(options.model)
+    if options.word_timestamps:
+        cache_model += "+words"
+    # Los segmentos sacados de un paquete no son iguales a los de transcribir
+    # el clip solo (el texto puede pasar de un clip a otro): se guardan aparte
+    # para que /transcribe no los reutilice
+    pack_cache_model = cache_model + "+pack"
+    language = options.language.lower()
+    output_dir = batch_dir / "outputs"
+    files = {}
+    packs_count = 0
+    
+    def finish_entry(index, status, **details):
+        files[index] = {"index": index, "status": status, **details}
+        job.set_progress(
+            len(files) / len(entries), event_type="file",
+            file=entries[index].name, status=status, **details
+        )
+    
+    def write_entry(index, segments, duration, cached):
+        transcription = {"segments": segments}
+        output_path = output_dir / entries[index].output_name
+        if batch_extension(options) == "txt":
+            create_clean_transcription(transcription, str(output_path))
+        else:
+            create_vtt_file(transcription, str(output_path), options.cue_limits)
+        finish_entry(
+            index, "completed", duration=round(duration, 2),
+            segments=len(segments), cached=cached
+        )
+    
+    job.set_stage("decoding")
+    # Audio decodificado de los clips que no estaban en caché: índice -> (audio, hash)
+    pending = {}
+    for index, entry in entries.items():
+        job.check_cancelled()
+        try:
+            audio = decode_batch_file(entry.path)
+        except HTTPException as e:
+            finish_entry(index, "failed", error=e.detail)
+            continue
+        audio_hash = audio_content_hash(audio)
+        cached = transcript_cache.get(audio_hash, language, cache_model)
+        if cached is None:
+            cached = transcript_cache.get(audio_hash, language, pack_cache_model)
+        if cached is not None:
+            write_entry(index, cached['segments'], len(audio) / SAMPLE_RATE, cached=True)
+        else:
+            pending[index] = (audio, audio_hash)
+    
+    job.set_stage("transcribing")
+    # El paquete se planificó con las duraciones de ffprobe: si el audio
+    # decodificado es más largo puede salir más de uno
+    durations = {index: len(audio) / SAMPLE_RATE for index, (audio, _) in pending.items()}
+    for pack in plan_packs(durations, BATCH_PACK_SECONDS, BATCH_PACK_GAP_SECONDS):
+        job.check_cancelled()
+        audio = build_pack_audio({c.index: pending[c.index][0] for c in pack}, pack,
+                                 BATCH_PACK_GAP_SECONDS)
+        try:
+            # Sin condicionar cada ventana al texto anterior, que sería el
+            # de otro clip
+            result = transcribe_audio(
+                audio, options.language, options.model, None, options.word_timestamps,
+                condition_on_previous_text=False
+            )
+        except HTTPException as e:
+            for clip in pack:
+                finish_entry(clip.index, "failed", error=e.detail)
+            continue
+        packs_count += 1
+        for index, segments in split_pack_segments(result['segments'], pack).items():
+            audio_hash = pending[index][1]
+            transcript_cache.put(audio_hash, language, pack_cache_model, {
+                "text": "".join(segment['text'] for segment in segments),
+                "segments": segments,
+                "language": result.get('language'),
+            })
+            write_entry(index, segments, durations[index], cached=False)
+    return {"files": [files[index] for index in sorted(files)], "packs": packs_count}
+
+def cancel_batch_packs(pack_job_ids: List[str]):
+    """Cancela los paquetes de un lote que aún no han terminado"""
+    for job_id in pack_job_ids:
+        snapshot = job_snapshot(job_id)
+        if snapshot is not None and snapshot["status"] not in FINISHED_STATES:
+            job_queue.cancel(job_id)
+
+def remove_batch(batch_dir: Path, pack_job_ids: List[str]):
+    """Limpieza del trabajo del lote: si se cancela (o falla) antes de que
+    terminen sus paquetes, estos se cancelan antes de borrar sus archivos"""
+    cancel_batch_packs(pack_job_ids)
+    remove_paths(batch_dir)
+
+def run_batch_job(job, batch_dir: Path, entries: List[BatchEntry], pack_jobs: Dict[str, List[int]],
+                  zip_filename: str):
+    """Recoge los paquetes de un lote (id del trabajo -> índices de sus
+    archivos) y empaqueta las transcripciones en un zip.
+    
+    Se encola con `after` sobre sus paquetes: ningún worker lo toma hasta que
+    han terminado todos, así que solo lee el resultado de cada uno.
+    """
+    manifest = [
+        {"file": entry.name, "output": entry.output_name, "status": "pending"}
+        for entry in entries
+    ]
+    finished = 0
+    packs_count = 0
+    
+    def finish_entry(index, status, **details):
+        nonlocal finished
+        manifest[index].update(status=status, **details)
+        finished += 1
+        job.set_progress(
+            finished / len(entries), event_type="file",
+            file=entries[index].name, status=status, **details
+        )
+    
+    job.set_stage("transcribing")
+    log = job_logger(logger, job)
+    log.info("Lote de %s archivos en %s paquetes", len(entries), len(pack_jobs))
+    for pack_job_id, indexes in pack_jobs.items():
+        snapshot = job_snapshot(pack_job_id)
+        if snapshot is not None and snapshot["status"] == JOB_COMPLETED:
+            packs_count += snapshot["result"]["packs"]
+            for item in snapshot["result"]["files"]:
+                details = {k: v for k, v in item.items() if k not in ("index", "status")}
+                finish_entry(item["index"], item["status"], **details)
+            continue
+        error = snapshot["error"] if snapshot else None
+        for index in indexes:
+            if manifest[index]["status"] == "pending":
+                finish_entry(index, "failed", error=error or "El paquete no terminó")
+    
+    # Empaquetar las transcripciones y el manifiesto en un solo zip
+    job.set_stage("packaging")
+    output_dir = batch_dir / "outputs"
+    zip_path = TEMP_DIR / zip_filename
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for item in manifest:
+            if item["status"] == "completed":
+                archive.write(output_dir / item["output"], item["output"])
+        archive.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    expires_at = artifact_store.register(zip_filename)
+    
+    completed = sum(1 for item in manifest if item["status"] == "completed")
+    log.info("Lote terminado: %s/%s archivos en %s paquetes", completed, len(entries), packs_count)
+    return {
+        "message": "Transcripción del lote completada",
+        "total": len(entries),
+        "completed": completed,
+        "failed": len(entries) - completed,
+        "cached": sum(1 for item in manifest if item.get("cached")),
+        "packs": packs_count,
+        "files": manifest,
+        "download_url": f"/download/{zip_filename}",
+        "expires_at": expires_at
+    }
+
+@app.post("/transcribe/batch", status_code=202)
+async def transcribe_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    language: str = Form(...),
+    transcription_type: str = Form("vtt"),
+    model: str = Form(WHISPER_MODEL_NAME),
+    word_timestamps: bool = Form(WORD_TIMESTAMPS),
+    max_words: int = Form(None),
+    max_chars: int = Form(None),
+    max_cue_duration: float = Form(None)
+):
+    """Transcribe muchos archivos (o uno o varios zip) repartidos en paquetes.
+    
+    Cada paquete de clips es un trabajo del pool de workers; el trabajo del
+    lote recoge sus resultados en un manifiesto con el estado de cada archivo
+    y un zip con todas las transcripciones.
+    """
+    validate_transcription_options(language, transcription_type, model)
+    options = TranscriptionOptions(
+        language, transcription_type.lower(), False, model, word_timestamps,
+        resolve_cue_limits(max_words, max_chars, max_cue_duration)
+    )
+    
+    client_id = request_client_id(request)
+    admission.check(client_id, [POOL_AUDIO])
+    
+    batch_dir = Path(tempfile.mkdtemp(prefix="batch_", dir=str(TEMP_DIR)))
+    try:
+        entries = await run_in_threadpool(save_batch_uploads, files, batch_dir, batch_extension(options))
+    except ValueError as e:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=f"Error guardando archivos: {str(e)}")
+    if not entries:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise HTTPException(status_code=400, detail="El lote no contiene archivos")
+    (batch_dir / "outputs").mkdir()
+    timings = record_upload(request, "transcribe_batch", sum(upload.size or 0 for upload in files))
+    
+    durations = await run_in_threadpool(batch_durations, entries)
+    packs = plan_packs(dict(enumerate(durations)), BATCH_PACK_SECONDS, BATCH_PACK_GAP_SECONDS)
+    
+    # El lote se admite entero (una sola reserva, que se libera cuando
+    # termina el trabajo del lote) y cada paquete se encola aparte
+    cost = JobCost(audio=transcription_cost(sum(durations), options.model, options.word_timestamps))
+    try:
+        ticket = admission.admit(client_id, cost)
+    except HTTPException:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise
+    pack_jobs = {}
+    try:
+        for pack in packs:
+            pack_cost = transcription_cost(
+                sum(clip.duration for clip in pack), options.model, options.word_timestamps
+            )
+            pack_job = job_queue.submit(
+                "batch_pack", run_batch_pack, batch_dir,
+                {clip.index: entries[clip.index] for clip in pack}, options,
+                client_id=client_id, cost=pack_cost
+            )
+            pack_jobs[pack_job.id] = [clip.index for clip in pack]
+        zip_filename = unique_name("batch", "zip")
+        job = job_queue.submit(
+            "batch", run_batch_job, batch_dir, entries, pack_jobs, zip_filename,
+            cleanup=partial(remove_batch, batch_dir, list(pack_jobs)), timings=timings,
+            client_id=client_id, cost=0.0, after=list(pack_jobs)
+        )
+    except Exception:
+        admission.release(ticket)
+        remove_batch(batch_dir, list(pack_jobs))
+        raise
+    admission.attach(ticket, job.id)
+    logger.info("Lote encolado: %s (%s archivos, %s paquetes)", job.id, len(entries), len(pack_jobs))
+    
+    return {
+        "message": "Lote encolado",
+        "job_id": job.id,
+        "status": job.status,
+        "files": len(entries),
+        "pack_jobs": len(pack_jobs),
+        "pack_job_ids": list(pack_jobs),
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+async def close_live_session(websocket: WebSocket, detail: str, code: int = 1011):
+    """Envía el error al cliente y cierra el WebSocket (si sigue conectado)"""
+    try:
+        await websocket.send_json({"type": "error", "detail": detail})
+        await websocket.close(code=code)
+    except Exception:
+        pass
+
+@app.websocket("/transcribe/live")
+async def transcribe_live(
+    websocket: WebSocket,
+    language: str = "spanish",
+    model: str = WHISPER_MODEL_NAME,
+    format: str = "pcm",
+    step: float = LIVE_STEP_SECONDS,
+    window: float = LIVE_WINDOW_SECONDS
+):
+    """Transcripción en directo por WebSocket.
+    
+    El cliente envía mensajes binarios con audio (`format=pcm`: PCM s16le mono
+    a 16 kHz; `format=webm`/`ogg`: Opus u otro formato que lea FFmpeg) y el
+    texto "stop" al terminar. El servidor responde con mensajes JSON
+    `provisional` (sustituyen a los anteriores) y `final` (definitivos) con
+    subtítulos de máximo 5 palabras, y `done` al cerrar la sesión.
+    """
+    global live_sessions
+    await websocket.accept()
+    
+    error = None
+    if language.lower() not in ['spanish', 'english']:
+        error = "Idioma debe ser 'spanish' o 'english'"
+    elif not model_registry.is_allowed(model):
+        error = f"Modelo debe ser uno de: {', '.join(sorted(model_registry.allowed_models))}"
+    elif format not in ['pcm', 'webm', 'ogg']:
+        error = "Formato debe ser 'pcm', 'webm' u 'ogg'"
+    elif not 0.5 <= step <= window:
+        error = "El paso debe ser de al menos 0.5 segundos y no mayor que la ventana"
+    elif live_sessions >= LIVE_MAX_SESSIONS:
+        error = "Demasiadas sesiones en directo, inténtalo más tarde"
+    if error:
+        await close_live_session(websocket, error, code=1008)
+        return
+    
+    live_sessions += 1
+    decoder = None
+    receiver = None
+    try:
+        backend = await run_in_threadpool(model_registry.get, model)
+        whisper_lang = whisper_language(language)
         
-        # Extraer o procesar audio
-        print(f"DEBUG - Iniciando extracción de audio para: {input_path}")
-        duration = extract_audio_or_process_audio(str(input_path), str(audio_path))
-        print(f"DEBUG - Extracción de audio completada. Duración: {duration}s")
+        def transcribe_window(audio, prompt):
+            with whisper_semaphore:
+                return backend.transcribe(audio, whisper_lang, initial_prompt=prompt)
         
-        # Transcribir audio
-        print(f"DEBUG - Iniciando transcripción del archivo de audio: {audio_path}")
-        transcription = transcribe_audio(str(audio_path), language)
-        print("DEBUG - Transcripción completada.")
+        transcriber = LiveTranscriber(transcribe_window, window_seconds=window, step_seconds=step)
+        if format != 'pcm':
+            require_ffmpeg()
+            decoder = StreamingDecoder(transcriber.add_pcm)
+        await websocket.send_json({
+            "type": "ready", "sample_rate": SAMPLE_RATE, "format": format,
+            "step": step, "window": window
+        })
+        logger.info("Sesión en directo iniciada (modelo %s, paso %ss, ventana %ss)", model, step, window)
         
-        # Crear archivo según el tipo solicitado
-        print(f"DEBUG - Creando archivo de transcripción...")
-        print(f"DEBUG - transcription_type.lower() == 'clean': {transcription_type.lower() == 'clean'}")
-        print(f"DEBUG - output_path: {output_path}")
+        stopped = asyncio.Event()
+        disconnected = False
         
-        if transcription_type.lower() == "clean":
-            print(f"DEBUG - Creando transcripción limpia...")
-            create_clean_transcription(transcription, str(output_path))
-            transcription_message = "Transcripción limpia completada exitosamente"
-            print(f"DEBUG - Transcripción limpia creada exitosamente")
-        else:
-            print(f"DEBUG - Creando archivo VTT...")
-            create_vtt_file(transcription, str(output_path))
-            transcription_message = "Transcripción VTT completada exitosamente"
-            print(f"DEBUG - Archivo VTT creado exitosamente")
+        async def receive_audio():
+            nonlocal disconnected
+            try:
+                while True:
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        disconnected = True
+                        break
+                    if message.get("bytes"):
+                        if decoder is not None:
+                            await run_in_threadpool(decoder.write, message["bytes"])
+                        else:
+                            transcriber.add_pcm(message["bytes"])
+                    elif (message.get("text") or "").strip().lower() == "stop":
+                        break
+                if decoder is not None:
+                    # Esperar a que FFmpeg entregue el audio que le queda
+                    await run_in_threadpool(decoder.close)
+            finally:
+                stopped.set()
         
-        # Retornar información de la transcripción
-        return {
-            "message": transcription_message,
-            "duration": round(duration, 2),
-            "language": language,
-            "transcription_type": transcription_type.lower(),
-            "original_segments_count": len(transcription['segments']),
-            "download_url": f"/download/{output_filename}"
-        }
+        receiver = asyncio.create_task(receive_audio())
+        while not stopped.is_set():
+            if transcriber.pending_seconds >= step:
+                for event in await run_in_threadpool(transcriber.process):
+                    await websocket.send_json(event)
+            else:
+                await asyncio.sleep(0.1)
         
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
+        await receiver
+        if not disconnected:
+            # Lo que queda en el buffer pasa a definitivo
+            for event in await run_in_threadpool(transcriber.process, True):
+                await websocket.send_json(event)
+            await websocket.send_json({
+                "type": "done", "duration": round(transcriber.received_seconds, 2)
+            })
+            await websocket.close()
+        logger.info("Sesión en directo terminada (%.1fs de audio)", transcriber.received_seconds)
     
+    except WebSocketDisconnect:
+        logger.info("Cliente desconectado de la sesión en directo")
+    except HTTPException as e:
+        await close_live_session(websocket, e.detail)
+    except Exception as e:
+        logger.error("Error en la sesión en directo: %s", e)
+        await close_live_session(websocket, f"Error inesperado: {str(e)}")
     finally:
-        # Limpiar archivos temporales (excepto archivo de transcripción)
-        for temp_file in [input_path, audio_path]:
-            if temp_file.exists():
-                temp_file.unlink()
+        live_sessions -= 1
+        if receiver is not None and not receiver.done():
+            receiver.cancel()
+        if decoder is not None and decoder.process.poll() is None:
+            decoder.process.kill()
 
-@app.get("/download/{filename}")
-async def download_transcription(filename: str):
-    """Endpoint para descargar archivos de transcripción (VTT o TXT)"""
-    file_path = TEMP_DIR / filename
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Endpoint para consultar el estado de un trabajo"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/export")
+async def export_job(job_id: str, format: str = "vtt", max_words: int = None,
+                     max_chars: int = None, max_cue_duration: float = None):
+    """Exporta la transcripción de un trabajo en SRT, VTT, TXT, JSON o TSV.
     
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+    Se genera en streaming a partir de los segmentos guardados, sin volver a
+    ejecutar Whisper. Los límites de subtítulo son por defecto los de la
+    transcripción original.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    export_format = EXPORT_FORMATS.get(format.lower())
+    if export_format is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato debe ser uno de: {', '.join(EXPORT_FORMATS)}"
+        )
+    if job.status != JOB_COMPLETED:
+        raise HTTPException(status_code=409, detail=f"El trabajo no ha terminado (estado: {job.status})")
+    
+    if job.kind not in ("transcription", "transcribe_subtitle"):
+        raise HTTPException(status_code=404, detail="El trabajo no tiene una transcripción para exportar")
+    # 410 si los segmentos ya caducaron
+    artifact_path = await run_in_threadpool(artifact_store.resolve, segments_artifact_name(job_id))
+    
+    metadata = await run_in_threadpool(read_artifact_metadata, str(artifact_path))
+    limits = resolve_cue_limits(
+        max_words, max_chars, max_cue_duration, base=artifact_cue_limits(metadata)
+    )
     
+    chunks = export_format.render(iter_artifact_segments(str(artifact_path)), limits, metadata)
+    return StreamingResponse(
+        iterate_in_threadpool(chunks),
+        media_type=export_format.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="transcription_{job_id}.{export_format.extension}"'
+        }
+    )
+
+def format_sse(event: dict) -> str:
+    """Serializa un evento de trabajo en formato Server-Sent Events"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    """Endpoint SSE con el progreso de un trabajo: etapas, porcentaje de FFmpeg,
+    segmentos de Whisper a medida que se decodifican y el estado final.
+
+    Al reconectar, EventSource envía `Last-Event-ID` y se reanuda desde ahí.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    
+    try:
+        last_event_id = int(request.headers.get("last-event-id") or 0)
+    except ValueError:
+        last_event_id = 0
+    
+    async def event_stream():
+        sent = last_event_id
+        idle = 0.0
+        # Estado actual para que el cliente no tenga que esperar al primer evento
+        yield f"event: snapshot\ndata: {json.dumps(job.to_dict())}\n\n"
+        if job.status in FINISHED_STATES and sent >= job.last_event_id:
+            # Reconexión después del evento final
+            return
+        while True:
+            events = job.events_since(sent)
+            for event in events:
+                yield format_sse(event)
+                sent = event['id']
+                if event['type'] == "status" and event['status'] in FINISHED_STATES:
+                    return
+            if events:
+                idle = 0.0
+            elif idle >= JOB_EVENTS_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                idle = 0.0
+            await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+            idle += JOB_EVENTS_POLL_SECONDS
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Evitar que proxies como nginx acumulen la respuesta
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Endpoint para cancelar un trabajo en cola o en curso"""
+    job = job_queue.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job.to_dict()
+
+async def artifact_response(request: Request, filename: str, media_type: str):
+    """Respuesta de descarga de un archivo generado, con soporte de Range.
+    
+    Responde 410 si el archivo existió pero ya caducó o se eliminó.
+    """
+    file_path = await run_in_threadpool(artifact_store.resolve, filename)
+    if DOWNLOAD_ACCEL_REDIRECT:
+        return accel_redirect_response(DOWNLOAD_ACCEL_REDIRECT, filename, media_type)
+    return RangeFileResponse(str(file_path), request.headers, filename, media_type, request.method)
+
+@app.api_route("/download/{filename}", methods=["GET", "HEAD"])
+async def download_transcription(filename: str, request: Request):
+    """Endpoint para descargar archivos de transcripción (VTT o TXT)"""
     # Determinar tipo de media según la extensión
     if filename.lower().endswith('.txt'):
         media_type = 'text/plain'
+    elif filename.lower().endswith('.zip'):
+        media_type = 'application/zip'
     else:
         media_type = 'text/vtt'
     
-    return FileResponse(
-        path=str(file_path),
-        filename=filename,
-        media_type=media_type
-    )
+    return await artifact_response(request, filename, media_type)
 
 @app.delete("/cleanup")
 async def cleanup_temp_files():
-    """Endpoint para limpiar archivos temporales"""
+    """Endpoint para limpiar los archivos de resultado.
+    
+    Las entradas de los trabajos en curso no se tocan; los temporales
+    huérfanos los elimina la limpieza periódica.
+    """
     try:
-        count = 0
-        for file_path in TEMP_DIR.glob("*"):
-            if file_path.is_file():
-                file_path.unlink()
-                count += 1
+        count = await run_in_threadpool(artifact_store.clear)
         
         return {"message": f"Se eliminaron {count} archivos temporales"}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error limpiando archivos: {str(e)}")
 
+def build_subtitle_filter(ass_path: str):
+    """Construye el filtro `ass` de FFmpeg para un archivo ASS ya estilizado"""
+    subtitle_filter = f"ass=filename='{filter_path(ass_path)}'"
+    logger.debug("Filtro de subtítulos: %s", subtitle_filter)
+    return subtitle_filter
+
 def create_subtitled_video(video_path: str, vtt_path: str, output_path: str,
                           font_color: str = "#ffffff", background_color: str = "#000000",
                           font_size: int = 20, background_opacity: float = 0.8,
-                          box_enabled: bool = False, box_color: str = "#000000"):
-    """Crea un video con subtítulos usando FFmpeg"""
+                          box_enabled: bool = False, box_color: str = "#000000",
+                          duration: float = None, on_progress=None,
+                          encoder: EncoderSettings = None, faststart: bool = MP4_FASTSTART):
+    """Crea un video con subtítulos usando FFmpeg.
+
+    Si se indican `duration` y `on_progress`, se informa de la fracción del
+    video ya codificada y del número de frames. `encoder` fija preset, CRF,
+    hilos y aceleración por hardware; si el codificador por hardware falla se
+    reintenta con libx264. Con `faststart` el MP4 se puede reproducir antes
+    de terminar de descargarse. Devuelve el nombre del codificador usado.
+    """
     try:
         # Verificar si FFmpeg está disponible
-        if not check_ffmpeg():
-            raise HTTPException(
-                status_code=500,
-                detail="FFmpeg no está instalado. Por favor instala FFmpeg desde https://ffmpeg.org/download.html"
-            )
+        require_ffmpeg()
         
         # Verificar que el archivo VTT existe
         if not os.path.exists(vtt_path):
@@ -420,217 +1672,490 @@ def create_subtitled_video(video_path: str, vtt_path: str, output_path: str,
             )
         
         # Convertir a ruta absoluta para evitar problemas de rutas relativas
-        vtt_path_absolute = os.path.abspath(vtt_path)
         video_path_absolute = os.path.abspath(video_path)
         output_path_absolute = os.path.abspath(output_path)
         
-        # Debug logging - imprimir rutas que se están usando
-        print(f"DEBUG - Ruta VTT original: {vtt_path}")
-        print(f"DEBUG - Ruta VTT absoluta: {vtt_path_absolute}")
-        print(f"DEBUG - Archivo VTT existe: {os.path.exists(vtt_path_absolute)}")
-        print(f"DEBUG - Ruta video absoluta: {video_path_absolute}")
-        print(f"DEBUG - Ruta output absoluta: {output_path_absolute}")
+        logger.debug("Rutas: VTT %s, video %s, salida %s",
+                     vtt_path, video_path_absolute, output_path_absolute)
         
-        # Convertir colores hex a formato FFmpeg
-        def hex_to_rgb(hex_color):
-            hex_color = hex_color.lstrip('#')
-            return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+        style = SubtitleStyle(
+            font_color=font_color, background_color=background_color, font_size=font_size,
+            background_opacity=background_opacity, box_enabled=box_enabled, box_color=box_color
+        )
+        encoder = encoder or resolve_encoder_settings(DEFAULT_ENCODER_PROFILE)
+        choices = encoder_choices(encoder)
         
-        font_rgb = hex_to_rgb(font_color)
-        bg_rgb = hex_to_rgb(background_color)
+        # Videos largos: piezas en paralelo (solo con libx264; los codificadores
+        # por hardware ya son rápidos y comparten una única GPU)
+        if (PARALLEL_BURN_WORKERS > 1 and len(choices) == 1 and duration
+                and duration >= PARALLEL_BURN_MIN_DURATION):
+            return burn_pieces_in_parallel(
+                video_path_absolute, vtt_path, output_path_absolute, style, encoder,
+                duration, on_progress, faststart
+            )
         
-        # Usar ruta absoluta y escapar caracteres especiales para Windows
-        # Reemplazar \ con \\ y : con \: para FFmpeg en Windows
-        vtt_path_for_filter = vtt_path_absolute.replace('\\', '\\\\').replace(':', '\\:')
+        # El ASS con el estilo se genera una vez y se reutiliza en quemados repetidos
+        ass_path = ass_cache.get_or_create(vtt_path, style, parse_vtt)
+        subtitle_filter = build_subtitle_filter(ass_path)
         
-        # Crear filtro de subtítulos con sintaxis correcta usando filename=
-        if box_enabled:
-            # Configuración para caja - BorderStyle=4 crea una caja opaca de fondo
-            box_rgb = hex_to_rgb(box_color)
+        for choice in choices:
+            # Comando FFmpeg para añadir subtítulos
+            cmd = [
+                'ffmpeg', *choice.input_args, '-i', video_path_absolute,
+                '-vf', subtitle_filter + choice.filter_suffix, *choice.output_args,
+                '-c:a', 'copy', *container_args(output_path_absolute, faststart),
+                '-y', output_path_absolute
+            ]
             
-            # Detectar si el color es muy oscuro y ajustar opacidad automáticamente
-            # Calcular luminancia del color para determinar si es oscuro
-            luminance = (0.299 * box_rgb[0] + 0.587 * box_rgb[1] + 0.114 * box_rgb[2])
+            logger.debug("Comando FFmpeg: %s", " ".join(cmd))
             
-            # Si el color es muy oscuro (luminance < 50), usar menos opacidad para mejor visibilidad
-            # Si es claro, usar más opacidad
-            if luminance < 50:
-                alpha = "A0"  # 62% opaco para colores oscuros
-                print(f"DEBUG - Color oscuro detectado (luminance: {luminance:.1f}), usando opacidad 62%")
-            else:
-                alpha = "D0"  # 81% opaco para colores claros
-                print(f"DEBUG - Color claro detectado (luminance: {luminance:.1f}), usando opacidad 81%")
+            result = run_ffmpeg(cmd, duration, on_progress)
+            if result.returncode == 0:
+                break
             
-            # Para cajas, usamos BorderStyle=4 y configuramos BackColour con opacidad
-            # El formato de color en ASS es &HAABBGGRR donde AA es alpha (transparencia)
-            subtitle_filter = (
-                f"subtitles=filename='{vtt_path_for_filter}':force_style='"
-                f"FontSize={font_size},"
-                f"PrimaryColour=&H00{font_rgb[2]:02x}{font_rgb[1]:02x}{font_rgb[0]:02x},"
-                f"BorderStyle=4,"
-                f"BackColour=&H{alpha}{box_rgb[2]:02x}{box_rgb[1]:02x}{box_rgb[0]:02x},"
-                f"Outline=1,"
-                f"OutlineColour=&H00000000,"
-                f"Shadow=0,"
-                f"MarginV=20,"
-                f"MarginL=15,"
-                f"MarginR=15'"
-            )
-            print(f"DEBUG - Modo caja habilitado:")
-            print(f"DEBUG - Color de caja RGB: {box_rgb}")
-            print(f"DEBUG - BackColour con opacidad automática: &H{alpha}{box_rgb[2]:02x}{box_rgb[1]:02x}{box_rgb[0]:02x}")
-            print(f"DEBUG - Configuración: BorderStyle=4, Outline=1 para mejor visibilidad")
-        else:
-            # Configuración normal sin caja (BorderStyle=1 con outline)
-            subtitle_filter = (
-                f"subtitles=filename='{vtt_path_for_filter}':force_style='"
-                f"FontSize={font_size},"
-                f"PrimaryColour=&H00{font_rgb[2]:02x}{font_rgb[1]:02x}{font_rgb[0]:02x},"
-                f"BorderStyle=1,"
-                f"OutlineColour=&H00{bg_rgb[2]:02x}{bg_rgb[1]:02x}{bg_rgb[0]:02x},"
-                f"Outline=2,"
-                f"Shadow=1,"
-                f"MarginV=20'"
-            )
-            print(f"DEBUG - Modo normal (sin caja)")
-        
-        print(f"DEBUG - Filtro de subtítulos: {subtitle_filter}")
-        
-        # Comando FFmpeg para añadir subtítulos
-        cmd = [
-            'ffmpeg', '-i', video_path_absolute, '-vf', subtitle_filter,
-            '-c:a', 'copy', '-y', output_path_absolute
-        ]
-        
-        print(f"DEBUG - Comando FFmpeg: {' '.join(cmd)}")
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
+            logger.debug("Error FFmpeg stderr: %s", result.stderr)
+            if choice is not choices[-1]:
+                logger.warning("Falló el codificador %s, reintentando con el siguiente", choice.name)
         
         if result.returncode != 0:
-            print(f"DEBUG - Error FFmpeg stdout: {result.stdout}")
-            print(f"DEBUG - Error FFmpeg stderr: {result.stderr}")
             raise HTTPException(
                 status_code=500,
                 detail=f"Error añadiendo subtítulos: {result.stderr}"
             )
         
-        print("DEBUG - Video subtitulado creado exitosamente")
-        return True
+        logger.debug("Video subtitulado creado exitosamente con %s", choice.name)
+        return choice.name
         
-    except HTTPException:
+    except (HTTPException, JobCancelled):
         raise
     except Exception as e:
-        print(f"DEBUG - Excepción en create_subtitled_video: {str(e)}")
+        logger.exception("Excepción en create_subtitled_video")
         raise HTTPException(status_code=500, detail=f"Error procesando video: {str(e)}")
 
+def container_args(output_path: str, faststart: bool):
+    """Opciones del contenedor de salida: en MP4 con `faststart` el índice
+    (átomo moov) se escribe al principio del archivo"""
+    if faststart and output_path.lower().endswith('.mp4'):
+        return ['-movflags', '+faststart']
+    return []
+
+class PieceAborted(Exception):
+    """Detiene las demás piezas cuando una falla"""
+
+def burn_pieces_in_parallel(video_path: str, vtt_path: str, output_path: str, style: SubtitleStyle,
+                            encoder: EncoderSettings, duration: float, on_progress=None,
+                            faststart: bool = MP4_FASTSTART):
+    """Divide el video por keyframes, quema los subtítulos de cada pieza en
+    paralelo con libx264 y une el resultado con el audio original"""
+    cues = parse_vtt(vtt_path)
+    work_dir = tempfile.mkdtemp(prefix="burn_", dir=str(TEMP_DIR))
+    try:
+        pieces = split_at_keyframes(video_path, duration / PARALLEL_BURN_WORKERS, work_dir)
+        workers = min(PARALLEL_BURN_WORKERS, len(pieces))
+        # Repartir los núcleos entre las piezas que se codifican a la vez
+        threads = encoder.threads or max(1, (os.cpu_count() or 1) // workers)
+        choice = software_choice(replace(encoder, threads=threads))
+        logger.info("Quemado en paralelo: %s piezas, %s a la vez, %s hilos por pieza",
+                    len(pieces), workers, threads)
+        
+        encoded_seconds = {}
+        progress_lock = threading.Lock()
+        abort = threading.Event()
+        
+        def burn_piece(index, piece):
+            piece_ass = os.path.join(work_dir, f"piece_{index:04d}.ass")
+            piece_cues = slice_cues(cues, piece.start, piece.end)
+            write_ass(piece_cues, style, piece_ass)
+            # Sin subtítulos en la pieza basta con recodificarla
+            subtitle_filter = build_subtitle_filter(piece_ass) if piece_cues else "null"
+            piece_output = os.path.join(work_dir, f"burned_{index:04d}.mkv")
+            
+            def piece_progress(fraction, seconds=0.0, frame=None):
+                if abort.is_set():
+                    raise PieceAborted()
+                with progress_lock:
+                    encoded_seconds[index] = seconds
+                    total = sum(encoded_seconds.values())
+                if on_progress is not None:
+                    on_progress(total / duration, seconds=round(total, 2))
+            
+            cmd = [
+                'ffmpeg', '-i', piece.path, '-vf', subtitle_filter,
+                *choice.output_args, '-an', '-y', piece_output
+            ]
+            result = run_ffmpeg(cmd, piece.duration, piece_progress)
+            if result.returncode != 0:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error añadiendo subtítulos: {result.stderr}"
+                )
+            return piece_output
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="burn-piece") as executor:
+            futures = [executor.submit(burn_piece, i, piece) for i, piece in enumerate(pieces)]
+            try:
+                outputs = [future.result() for future in futures]
+            except BaseException:
+                abort.set()
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        concat_pieces(outputs, video_path, output_path, work_dir,
+                      container_args(output_path, faststart))
+        logger.debug("Video subtitulado creado exitosamente en %s piezas", len(pieces))
+        return choice.name
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def mux_soft_subtitles(video_path: str, vtt_path: str, output_path: str,
+                       duration: float = None, on_progress=None, faststart: bool = MP4_FASTSTART):
+    """Añade el VTT como pista de subtítulos sin recodificar (`-c copy`).
+
+    En MP4 la pista se guarda como mov_text. Si los streams del video no se
+    pueden copiar a MP4 se usa MKV con la pista en WebVTT. Devuelve la ruta
+    del archivo generado.
+    """
+    require_ffmpeg()
+    
+    attempts = [
+        (output_path, 'mov_text'),
+        (str(Path(output_path).with_suffix('.mkv')), 'webvtt'),
+    ]
+    for path, subtitle_codec in attempts:
+        cmd = [
+            'ffmpeg', '-i', os.path.abspath(video_path), '-i', os.path.abspath(vtt_path),
+            '-map', '0:v', '-map', '0:a?', '-map', '1:0',
+            '-c', 'copy', '-c:s', subtitle_codec,
+            '-disposition:s:0', 'default', *container_args(path, faststart),
+            '-y', os.path.abspath(path)
+        ]
+        logger.debug("Comando FFmpeg: %s", " ".join(cmd))
+        result = run_ffmpeg(cmd, duration, on_progress)
+        if result.returncode == 0:
+            logger.debug("Pista de subtítulos añadida en %s", path)
+            return path
+        logger.debug("Error FFmpeg stderr: %s", result.stderr)
+        if os.path.exists(path):
+            os.remove(path)
+    
+    raise HTTPException(
+        status_code=500,
+        detail=f"Error añadiendo la pista de subtítulos: {result.stderr}"
+    )
+
 def count_vtt_subtitles(vtt_path: str):
-    """Cuenta el número de subtítulos en un archivo VTT"""
+    """Cuenta el número de subtítulos en un archivo VTT (leyéndolo por trozos)"""
     try:
-        with open(vtt_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-            # Contar líneas que contienen timestamps (formato: HH:MM:SS.mmm --> HH:MM:SS.mmm)
-            import re
-            timestamps = re.findall(r'\d{2}:\d{2}:\d{2}\.\d{3} --> \d{2}:\d{2}:\d{2}\.\d{3}', content)
-            return len(timestamps)
+        return count_vtt_cues(vtt_path)
     except Exception:
         return 0
 
-@app.post("/subtitle")
+def run_subtitle_job(job, video_path: str, vtt_path: str, output_path: str,
+                     output_filename: str, video_hash: str = None, mode: str = "burn",
+                     encoder: EncoderSettings = None, faststart: bool = MP4_FASTSTART, **style):
+    """Quema los subtítulos en el video (o los añade como pista si
+    `mode` es "soft") para un trabajo encolado"""
+    job.set_stage("probing")
+    # Obtener duración del video
+    duration = get_media_duration(video_path, video_hash)
+    return add_subtitles(
+        job, video_path, vtt_path, output_path, output_filename, duration, video_hash,
+        mode, encoder, faststart, **style
+    )
+
+def add_subtitles(job, video_path: str, vtt_path: str, output_path: str, output_filename: str,
+                  duration: float, video_hash: str = None, mode: str = "burn",
+                  encoder: EncoderSettings = None, faststart: bool = MP4_FASTSTART, **style):
+    """Quema o añade como pista el VTT en el video ya inspeccionado y
+    registra el resultado"""
+    # Contar subtítulos
+    subtitle_count = count_vtt_subtitles(vtt_path)
+    
+    burn_fps = None
+    if mode == "soft":
+        # Sin recodificar: el reproductor dibuja los subtítulos
+        job.set_stage("muxing_subtitles")
+        output_path = mux_soft_subtitles(
+            video_path, vtt_path, output_path, duration, on_progress=job.set_progress,
+            faststart=faststart
+        )
+        output_filename = os.path.basename(output_path)
+        video_encoder = "copy"
+    else:
+        # Crear video subtitulado informando del progreso de FFmpeg
+        job.set_stage("burning_subtitles")
+        started = time.perf_counter()
+        video_encoder = create_subtitled_video(
+            video_path, vtt_path, output_path, **style,
+            duration=duration, on_progress=job.set_progress, encoder=encoder,
+            faststart=faststart
+        )
+        video_stream = media_inspector.inspect(video_path, video_hash).video_stream
+        if video_stream is not None and video_stream.frame_rate:
+            burn_fps = duration * video_stream.frame_rate / (time.perf_counter() - started)
+            BURN_FPS.observe(burn_fps, encoder=video_encoder)
+    
+    # Obtener tamaño del archivo resultante
+    file_size = os.path.getsize(output_path)
+    expires_at = artifact_store.register(output_filename, ARTIFACT_VIDEO_TTL_SECONDS)
+    
+    # Retornar información del video subtitulado
+    return {
+        "message": "Video subtitulado completado exitosamente",
+        "duration": round(duration, 2),
+        "subtitle_count": subtitle_count,
+        "file_size": file_size,
+        "mode": mode,
+        "video_encoder": video_encoder,
+        "burn_fps": round(burn_fps, 1) if burn_fps else None,
+        "download_url": f"/download-video/{output_filename}",
+        "expires_at": expires_at
+    }
+
+@app.post("/subtitle", status_code=202)
 async def subtitle_video(
-    video: UploadFile = File(...),
+    request: Request,
+    video: UploadFile = File(None),
     vtt: UploadFile = File(...),
+    video_upload_id: str = Form(None),
     font_color: str = Form("#ffffff"),
     background_color: str = Form("#000000"),
     font_size: int = Form(20),
     background_opacity: float = Form(0.8),
     box_enabled: bool = Form(False),
-    box_color: str = Form("#000000")
+    box_color: str = Form("#000000"),
+    mode: str = Form("burn"),
+    profile: str = Form(None),
+    preset: str = Form(None),
+    crf: int = Form(None),
+    threads: int = Form(None),
+    hwaccel: str = Form(None),
+    faststart: bool = Form(MP4_FASTSTART)
 ):
-    """Endpoint para añadir subtítulos a un video"""
+    """Endpoint para añadir subtítulos a un video.
+
+    Guarda los archivos, encola el trabajo y responde de inmediato con su
+    identificador; el progreso se sigue en /jobs/{job_id}/events. El video
+    puede venir en la petición o de una subida previa (`video_upload_id`).
+    """
     
     # Validar tipo de archivo de video
-    if not video.content_type.startswith('video/'):
+    video_name, video_content_type = await run_in_threadpool(input_source, video, video_upload_id)
+    if not video_content_type or not video_content_type.startswith('video/'):
         raise HTTPException(status_code=400, detail="El archivo debe ser un video")
     
     # Validar archivo VTT
     if not vtt.filename.lower().endswith('.vtt'):
         raise HTTPException(status_code=400, detail="El archivo de subtítulos debe ser VTT")
     
+    # Validar modo y opciones de codificación
+    if mode not in ['burn', 'soft']:
+        raise HTTPException(status_code=400, detail="Modo debe ser 'burn' o 'soft'")
+    try:
+        encoder = resolve_encoder_settings(
+            profile or DEFAULT_ENCODER_PROFILE, preset, crf, threads, hwaccel
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    client_id = request_client_id(request)
+    admission.check(client_id, [POOL_RENDER])
+    
     # Crear nombres de archivos temporales
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    video_filename = f"input_video_{timestamp}_{video.filename}"
-    vtt_filename = f"subtitles_{timestamp}.vtt"
-    output_filename = f"subtitled_video_{timestamp}.mp4"
+    token = uuid.uuid4().hex
+    video_filename = f"input_video_{token}_{safe_filename(video_name)}"
+    vtt_filename = f"subtitles_{token}.vtt"
+    output_filename = f"subtitled_video_{token}.mp4"
     
     # Usar os.path.join para construcción correcta de rutas
     video_path = os.path.join(str(TEMP_DIR), video_filename)
     vtt_path = os.path.join(str(TEMP_DIR), vtt_filename)
     output_path = os.path.join(str(TEMP_DIR), output_filename)
     
-    # Debug logging para verificar rutas
-    print(f"DEBUG - Construyendo rutas:")
-    print(f"DEBUG - TEMP_DIR: {TEMP_DIR}")
-    print(f"DEBUG - video_path: {video_path}")
-    print(f"DEBUG - vtt_path: {vtt_path}")
-    print(f"DEBUG - output_path: {output_path}")
+    logger.debug("Rutas: video %s, VTT %s, salida %s", video_path, vtt_path, output_path)
+    
+    # Limpiar archivos temporales de entrada
+    cleanup = partial(remove_paths, video_path, vtt_path)
     
     try:
-        # Guardar archivos subidos
-        with open(video_path, "wb") as buffer:
-            shutil.copyfileobj(video.file, buffer)
-        
-        with open(vtt_path, "wb") as buffer:
-            shutil.copyfileobj(vtt.file, buffer)
-        
-        # Obtener duración del video
-        duration = get_media_duration(video_path)
-        
-        # Contar subtítulos
-        subtitle_count = count_vtt_subtitles(vtt_path)
-        
-        # Crear video subtitulado
-        create_subtitled_video(
-            video_path, vtt_path, output_path,
-            font_color, background_color, font_size, background_opacity,
-            box_enabled, box_color
-        )
-        
-        # Obtener tamaño del archivo resultante
-        file_size = os.path.getsize(output_path)
-        
-        # Retornar información del video subtitulado
-        return {
-            "message": "Video subtitulado completado exitosamente",
-            "duration": round(duration, 2),
-            "subtitle_count": subtitle_count,
-            "file_size": file_size,
-            "download_url": f"/download-video/{output_filename}"
-        }
-        
+        # Guardar archivos subidos (las tareas bloqueantes van al threadpool
+        # para no congelar el event loop)
+        video_hash = await store_input(video, video_upload_id, video_path)
+        await run_in_threadpool(save_upload, vtt, vtt_path)
+        # Un VTT sin subtítulos o ilegible se rechaza antes de encolar el quemado
+        await run_in_threadpool(validate_vtt, vtt_path)
+    except ValueError as e:
+        cleanup()
+        raise HTTPException(status_code=400, detail=str(e))
     except HTTPException:
+        cleanup()
         raise
     except Exception as e:
+        cleanup()
         raise HTTPException(status_code=500, detail=f"Error inesperado: {str(e)}")
+    # Con video_upload_id solo se sube el VTT en esta petición
+    uploaded = os.path.getsize(vtt_path) + (os.path.getsize(video_path) if video is not None else 0)
+    timings = record_upload(request, "subtitle", uploaded)
     
-    finally:
-        # Limpiar archivos temporales de entrada
-        for temp_file_path in [video_path, vtt_path]:
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-
-@app.get("/download-video/{filename}")
-async def download_video(filename: str):
-    """Endpoint para descargar videos subtitulados"""
-    file_path = os.path.join(str(TEMP_DIR), filename)
-    
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="Archivo no encontrado")
-    
-    return FileResponse(
-        path=file_path,
-        filename=filename,
-        media_type='video/mp4'
+    duration = await run_in_threadpool(
+        input_duration, video_path, video_hash, cleanup, check_limit=False
+    )
+    cost = JobCost(render=render_cost(duration, mode, encoder.preset))
+    
+    job = submit_job(
+        client_id, cost, "subtitle", run_subtitle_job,
+        video_path, vtt_path, output_path, output_filename, video_hash,
+        mode=mode, encoder=encoder, faststart=faststart, font_color=font_color, background_color=background_color,
+        font_size=font_size, background_opacity=background_opacity,
+        box_enabled=box_enabled, box_color=box_color,
+        cleanup=cleanup, timings=timings
+    )
+    
+    return {
+        "message": "Subtitulado encolado",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+def run_transcribe_subtitle_job(job, input_path: Path, audio_path: Path, vtt_path: Path,
+                                vtt_filename: str, output_path: Path, output_filename: str,
+                                options: TranscriptionOptions, content_hash: str = None,
+                                mode: str = "burn", encoder: EncoderSettings = None,
+                                faststart: bool = MP4_FASTSTART, **style):
+    """Transcribe el video y le añade los subtítulos en el mismo trabajo.
+    
+    El ffprobe del principio sirve para las dos fases (queda en la caché del
+    inspector por hash) y el quemado empieza en cuanto se escribe el VTT.
+    """
+    job.set_stage("extracting_audio")
+    duration = extract_audio_or_process_audio(
+        str(input_path), str(audio_path), content_hash, on_progress=job.set_progress
+    )
+    audio = read_wav_audio(str(audio_path))
+    # El audio ya está en memoria: el WAV no hace falta durante el quemado
+    audio_path.unlink()
+    transcription = finish_transcription(job, audio, duration, vtt_path, vtt_filename, options)
+    del audio
+    
+    video = add_subtitles(
+        job, str(input_path), str(vtt_path), str(output_path), output_filename, duration,
+        content_hash, mode, encoder, faststart, **style
+    )
+    return {
+        **video,
+        "message": "Transcripción y subtitulado completados exitosamente",
+        "transcription": transcription
+    }
+
+@app.post("/transcribe/subtitle", status_code=202)
+async def transcribe_and_subtitle(
+    request: Request,
+    file: UploadFile = File(None),
+    upload_id: str = Form(None),
+    language: str = Form(...),
+    vad: bool = Form(False),
+    model: str = Form(WHISPER_MODEL_NAME),
+    word_timestamps: bool = Form(WORD_TIMESTAMPS),
+    max_words: int = Form(None),
+    max_chars: int = Form(None),
+    max_cue_duration: float = Form(None),
+    font_color: str = Form("#ffffff"),
+    background_color: str = Form("#000000"),
+    font_size: int = Form(20),
+    background_opacity: float = Form(0.8),
+    box_enabled: bool = Form(False),
+    box_color: str = Form("#000000"),
+    mode: str = Form("burn"),
+    profile: str = Form(None),
+    preset: str = Form(None),
+    crf: int = Form(None),
+    threads: int = Form(None),
+    hwaccel: str = Form(None),
+    faststart: bool = Form(MP4_FASTSTART)
+):
+    """Transcribe un video y devuelve el video subtitulado en un solo trabajo.
+    
+    Equivale a /transcribe seguido de /subtitle con el VTT resultante, pero el
+    video se sube y se guarda una sola vez. El resultado incluye el VTT
+    (`transcription.download_url`) y el video (`download_url`).
+    """
+    filename, content_type = await run_in_threadpool(input_source, file, upload_id)
+    if not content_type or not content_type.startswith('video/'):
+        raise HTTPException(status_code=400, detail="El archivo debe ser un video")
+    validate_transcription_options(language, "vtt", model)
+    options = TranscriptionOptions(
+        language, "vtt", vad, model, word_timestamps,
+        resolve_cue_limits(max_words, max_chars, max_cue_duration)
     )
+    if mode not in ['burn', 'soft']:
+        raise HTTPException(status_code=400, detail="Modo debe ser 'burn' o 'soft'")
+    try:
+        encoder = resolve_encoder_settings(
+            profile or DEFAULT_ENCODER_PROFILE, preset, crf, threads, hwaccel
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    client_id = request_client_id(request)
+    admission.check(client_id, [POOL_AUDIO, POOL_RENDER])
+    
+    timings = record_upload(request, "transcribe_subtitle", file.size or 0) if file is not None else {}
+    
+    token = uuid.uuid4().hex
+    input_path = TEMP_DIR / f"input_video_{token}_{safe_filename(filename)}"
+    audio_path = TEMP_DIR / f"audio_{token}.wav"
+    vtt_filename = transcription_output_filename("vtt")
+    output_filename = f"subtitled_video_{token}.mp4"
+    
+    # La entrada solo se conserva hasta el final del trabajo
+    cleanup = partial(remove_paths, input_path, audio_path)
+    
+    try:
+        started = time.perf_counter()
+        content_hash = await store_input(file, upload_id, input_path)
+        timings["saving_upload"] = time.perf_counter() - started
+    except HTTPException:
+        raise
+    except Exception as e:
+        cleanup()
+        raise HTTPException(status_code=500, detail=f"Error guardando archivo: {str(e)}")
+    
+    duration = await run_in_threadpool(input_duration, str(input_path), content_hash, cleanup)
+    cost = JobCost(
+        audio=transcription_cost(duration, options.model, options.word_timestamps),
+        render=render_cost(duration, mode, encoder.preset)
+    )
+    
+    job = submit_job(
+        client_id, cost, "transcribe_subtitle", run_transcribe_subtitle_job,
+        input_path, audio_path, TEMP_DIR / vtt_filename, vtt_filename,
+        TEMP_DIR / output_filename, output_filename, options, content_hash,
+        mode=mode, encoder=encoder, faststart=faststart, font_color=font_color,
+        background_color=background_color, font_size=font_size,
+        background_opacity=background_opacity, box_enabled=box_enabled, box_color=box_color,
+        cleanup=cleanup, timings=timings
+    )
+    logger.info("Trabajo de transcripción y subtitulado encolado: %s", job.id)
+    
+    return {
+        "message": "Transcripción y subtitulado encolados",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events"
+    }
+
+@app.api_route("/download-video/{filename}", methods=["GET", "HEAD"])
+async def download_video(filename: str, request: Request):
+    """Endpoint para descargar videos subtitulados. Admite Range para que el
+    navegador pueda saltar a cualquier punto y reanudar descargas cortadas"""
+    # El modo con pista de subtítulos puede generar MKV
+    media_type = 'video/x-matroska' if filename.lower().endswith('.mkv') else 'video/mp4'
+    
+    return await artifact_response(request, filename, media_type)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -0,0 +1,441 @@
+"""Utilidades de FFmpeg/FFprobe: inspección de archivos y decodificación de audio"""
+import hashlib
+import json
+import queue
+import subprocess
+import threading
+import time
+import wave
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+from metrics import DECODE_SECONDS, FFPROBE_SECONDS
+
+# Formato que espera Whisper: PCM mono a 16 kHz
+SAMPLE_RATE = 16000
+
+# Tamaño de los bloques que se envían a FFmpeg por stdin
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class StreamInfo:
+    index: int
+    codec_type: str
+    codec_name: Optional[str] = None
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    frame_rate: Optional[float] = None
+    sample_rate: Optional[int] = None
+    channels: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class MediaInfo:
+    duration: float
+    format_name: Optional[str]
+    streams: Tuple[StreamInfo, ...]
+
+    @property
+    def has_video(self):
+        return any(stream.codec_type == 'video' for stream in self.streams)
+
+    @property
+    def has_audio(self):
+        return any(stream.codec_type == 'audio' for stream in self.streams)
+
+    @property
+    def video_stream(self) -> Optional[StreamInfo]:
+        return next((s for s in self.streams if s.codec_type == 'video'), None)
+
+    @property
+    def audio_stream(self) -> Optional[StreamInfo]:
+        return next((s for s in self.streams if s.codec_type == 'audio'), None)
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_frame_rate(value) -> Optional[float]:
+    # FFprobe expresa los fps como fracción, p. ej. "30000/1001"
+    if not value or value == '0/0':
+        return None
+    if '/' in value:
+        num, den = value.split('/', 1)
+        num, den = _to_float(num), _to_float(den)
+        return num / den if num is not None and den else None
+    return _to_float(value)
+
+
+def probe_media(media_path: str) -> MediaInfo:
+    """Ejecuta ffprobe una sola vez y devuelve duración, streams y códecs"""
+    try:
+        cmd = [
+            'ffprobe', '-v', 'quiet', '-print_format', 'json',
+            '-show_format', '-show_streams', media_path
+        ]
+        started = time.perf_counter()
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        FFPROBE_SECONDS.observe(time.perf_counter() - started)
+        data = json.loads(result.stdout)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error analizando archivo con FFprobe: {str(e)}")
+
+    streams = tuple(
+        StreamInfo(
+            index=_to_int(stream.get('index')) or 0,
+            codec_type=stream.get('codec_type', ''),
+            codec_name=stream.get('codec_name'),
+            duration=_to_float(stream.get('duration')),
+            width=_to_int(stream.get('width')),
+            height=_to_int(stream.get('height')),
+            frame_rate=_parse_frame_rate(stream.get('avg_frame_rate') or stream.get('r_frame_rate')),
+            sample_rate=_to_int(stream.get('sample_rate')),
+            channels=_to_int(stream.get('channels')),
+        )
+        for stream in data.get('streams', [])
+    )
+
+    # Buscar duración en streams de video o audio
+    duration = 0.0
+    for stream in streams:
+        if stream.codec_type in ['video', 'audio'] and stream.duration and stream.duration > 0:
+            duration = stream.duration
+            break
+    else:
+        # Si no se encuentra en streams, buscar en format
+        duration = _to_float(data.get('format', {}).get('duration')) or 0.0
+
+    return MediaInfo(
+        duration=duration,
+        format_name=data.get('format', {}).get('format_name'),
+        streams=streams,
+    )
+
+
+def hash_file(path: str, chunk_size: int = STREAM_CHUNK_SIZE) -> str:
+    """Calcula el SHA-256 del contenido de un archivo"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter_file_chunks(f, chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaInspector:
+    """Inspecciona archivos con una sola llamada a ffprobe y cachea el resultado
+    por hash de contenido, así un mismo archivo subido varias veces no se vuelve
+    a analizar."""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, MediaInfo]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def inspect(self, media_path: str, content_hash: Optional[str] = None) -> MediaInfo:
+        if content_hash is None:
+            content_hash = hash_file(media_path)
+
+        with self._lock:
+            info = self._cache.get(content_hash)
+            if info is not None:
+                self._cache.move_to_end(content_hash)
+                self.hits += 1
+                return info
+            self.misses += 1
+
+        info = probe_media(media_path)
+
+        with self._lock:
+            self._cache[content_hash] = info
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return info
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+def iter_file_chunks(file_obj, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Lee un archivo abierto en bloques"""
+    return iter(lambda: file_obj.read(chunk_size), b"")
+
+
+def iter_queue_chunks(chunk_queue: "queue.Queue") -> Iterator[bytes]:
+    """Itera los bloques de una cola hasta recibir None"""
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is None:
+            return
+        yield chunk
+
+
+def decode_audio_stream(chunks: Iterable[bytes], max_duration: Optional[float] = None) -> np.ndarray:
+    """Envía los bloques a FFmpeg por stdin y devuelve el audio como float32 mono a 16 kHz.
+
+    Si se indica `max_duration`, la decodificación se aborta en cuanto el audio
+    supera ese límite, sin esperar a que termine la subida.
+    """
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+        '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(SAMPLE_RATE), '-ac', '1', 'pipe:1'
+    ]
+    started = time.perf_counter()
+    try:
+        process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=500,
+            detail="FFmpeg no está instalado. Por favor instala FFmpeg desde https://ffmpeg.org/download.html"
+        )
+
+    writer_errors = []
+
+    def write_input():
+        # Se escribe en otro hilo para no bloquearse con stdout lleno
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError, OSError):
+            # FFmpeg terminó antes de consumir toda la entrada
+            pass
+        except Exception as e:
+            writer_errors.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    stderr_lines = []
+
+    def read_stderr():
+        stderr_lines.append(process.stderr.read())
+
+    writer = threading.Thread(target=write_input, daemon=True)
+    stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+    writer.start()
+    stderr_reader.start()
+
+    max_bytes = int(max_duration * SAMPLE_RATE * 2) if max_duration else None
+    pcm = bytearray()
+    try:
+        while True:
+            block = process.stdout.read(STREAM_CHUNK_SIZE)
+            if not block:
+                break
+            pcm.extend(block)
+            if max_bytes is not None and len(pcm) > max_bytes:
+                process.kill()
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"El archivo debe durar menos de {int(max_duration // 60)} minutos"
+                )
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        writer.join()
+        stderr_reader.join()
+
+    if writer_errors:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error leyendo el archivo subido: {str(writer_errors[0])}"
+        )
+
+    if process.returncode != 0 or not pcm:
+        stderr = b"".join(stderr_lines).decode('utf-8', errors='replace')
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error procesando audio con FFmpeg: {stderr}"
+        )
+
+    # Incluye la espera de la subida, que llega a la vez que se decodifica
+    DECODE_SECONDS.observe(time.perf_counter() - started, source="stream")
+    # Misma normalización que whisper.load_audio
+    return np.frombuffer(pcm, np.int16).flatten().astype(np.float32) / 32768.0
+
+
+class StreamingDecoder:
+    """Proceso FFmpeg de larga duración para audio en directo (p. ej. Opus/WebM
+    de MediaRecorder): recibe bloques comprimidos con `write` y entrega el PCM
+    s16le mono a 16 kHz a `on_pcm` a medida que se decodifica."""
+
+    def __init__(self, on_pcm: Callable[[bytes], None]):
+        cmd = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-fflags', 'nobuffer',
+            '-i', 'pipe:0', '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+            '-ar', str(SAMPLE_RATE), '-ac', '1', 'pipe:1'
+        ]
+        try:
+            self.process = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=500,
+                detail="FFmpeg no está instalado. Por favor instala FFmpeg desde https://ffmpeg.org/download.html"
+            )
+        self._on_pcm = on_pcm
+        self._stderr = []
+        self._reader = threading.Thread(target=self._read_output, daemon=True)
+        self._stderr_reader = threading.Thread(
+            target=lambda: self._stderr.append(self.process.stderr.read()), daemon=True
+        )
+        self._reader.start()
+        self._stderr_reader.start()
+
+    def _read_output(self):
+        # read1 devuelve lo que haya disponible sin esperar a llenar el bloque
+        while True:
+            block = self.process.stdout.read1(STREAM_CHUNK_SIZE)
+            if not block:
+                break
+            self._on_pcm(block)
+
+    def write(self, data: bytes):
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError, OSError):
+            raise HTTPException(
+                status_code=400,
+                detail=f"No se pudo decodificar el audio recibido: {self.error or 'FFmpeg terminó'}"
+            )
+
+    def close(self):
+        """Cierra la entrada y espera a que FFmpeg entregue el audio pendiente"""
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self._reader.join()
+        self.process.wait()
+        self._stderr_reader.join()
+
+    @property
+    def error(self) -> str:
+        return b"".join(self._stderr).decode('utf-8', errors='replace').strip()
+
+
+def _progress_seconds(values: dict) -> Optional[float]:
+    # out_time_us en versiones recientes; out_time_ms (también en µs) en las antiguas
+    for key in ('out_time_us', 'out_time_ms'):
+        microseconds = _to_int(values.get(key))
+        if microseconds is not None:
+            return max(microseconds, 0) / 1_000_000
+    return None
+
+
+def run_ffmpeg(cmd: List[str], duration: Optional[float] = None,
+               on_progress: Optional[Callable[..., None]] = None) -> subprocess.CompletedProcess:
+    """Ejecuta FFmpeg y, si se indica `on_progress`, informa del avance.
+
+    El avance se lee de la salida de `-progress pipe:1` y se entrega como
+    `on_progress(fracción, seconds=..., frame=...)` respecto a `duration`.
+    Si el callback lanza una excepción (p. ej. al cancelar el trabajo),
+    FFmpeg se detiene y la excepción se propaga.
+    """
+    if on_progress is None or not duration:
+        return subprocess.run(cmd, capture_output=True, text=True)
+
+    cmd = [cmd[0], '-nostats', '-progress', 'pipe:1'] + list(cmd[1:])
+    process = subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        text=True, errors='replace'
+    )
+
+    stderr_lines = []
+
+    def read_stderr():
+        stderr_lines.append(process.stderr.read())
+
+    stderr_reader = threading.Thread(target=read_stderr, daemon=True)
+    stderr_reader.start()
+
+    try:
+        values = {}
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key != 'progress':
+                values[key] = value
+                continue
+            # "progress=continue|end" cierra cada bloque de estadísticas
+            seconds = _progress_seconds(values)
+            if seconds is not None:
+                on_progress(
+                    min(seconds / duration, 1.0),
+                    seconds=round(seconds, 2),
+                    frame=_to_int(values.get('frame'))
+                )
+            values = {}
+        process.wait()
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        stderr_reader.join()
+
+    return subprocess.CompletedProcess(cmd, process.returncode, '', ''.join(stderr_lines))
+
+
+def load_audio(media_path: str) -> np.ndarray:
+    """Decodifica un archivo (con acceso aleatorio) a float32 mono a 16 kHz"""
+    cmd = [
+        'ffmpeg', '-hide_banner', '-loglevel', 'error', '-nostdin', '-i', media_path,
+        '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ar', str(SAMPLE_RATE), '-ac', '1', 'pipe:1'
+    ]
+    started = time.perf_counter()
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error procesando audio con FFmpeg: {result.stderr.decode('utf-8', errors='replace')}"
+        )
+    DECODE_SECONDS.observe(time.perf_counter() - started, source="file")
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def read_wav_audio(wav_path: str) -> np.ndarray:
+    """Carga un WAV PCM de 16 bits (el que genera FFmpeg) como float32 a 16 kHz"""
+    with wave.open(wav_path, 'rb') as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1 or wav.getframerate() != SAMPLE_RATE:
+            raise HTTPException(status_code=500, detail="Formato de audio intermedio inesperado")
+        pcm = wav.readframes(wav.getnframes())
+    return np.frombuffer(pcm, np.int16).astype(np.float32) / 32768.0
+
+
+def audio_content_hash(audio: np.ndarray) -> str:
+    """SHA-256 del audio decodificado.
+
+    Se calcula sobre el PCM de 16 bits para que el mismo audio tenga el mismo
+    hash tanto si llegó por streaming como si pasó por un WAV intermedio.
+    """
+    pcm = np.round(audio * 32768.0).clip(-32768, 32767).astype(np.int16)
+    return hashlib.sha256(pcm.tobytes()).hexdigest()
@@ -0,0 +1,267 @@
+"""Métricas en formato de texto de Prometheus (`GET /metrics`).
+
+Implementación mínima sin dependencias: contadores e histogramas con
+etiquetas, y métricas calculadas en el momento de la consulta a partir de
+los `stats()` de la cola y las cachés.
+
+Con broker los trabajos se ejecutan en otros procesos: cada worker envía
+`snapshot()` de sus métricas con cada señal de vida y la API las muestra
+junto a las suyas con la etiqueta `worker`.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Starlette añade "; charset=utf-8"
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Segundos: de milisegundos (escritura de un VTT) a minutos (quemado de un video largo)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+BYTES_BUCKETS = tuple(2 ** power for power in range(16, 34, 2))
+# Factor de tiempo real de Whisper: segundos de cómputo por segundo de audio
+RTF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 4)
+FPS_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800, 1600)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    type_name = ""
+    # Si el valor es propio de cada proceso (y se envía desde los workers)
+    per_process = True
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def collect(self) -> Dict[LabelValues, Any]:
+        """Valores actuales por combinación de etiquetas"""
+        raise NotImplementedError
+
+    def format(self, values: Dict[LabelValues, Any], labelnames: Sequence[str]) -> Iterable[str]:
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[str]:
+        return self.format(self.collect(), self.labelnames)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+    def format(self, values, labelnames):
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por cada combinación de etiquetas: [conteos por bucket..., suma, total]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def collect(self):
+        with self._lock:
+            return {key: list(state) for key, state in self._values.items()}
+
+    def format(self, values, labelnames):
+        names = tuple(labelnames) + ("le",)
+        for key, state in values.items():
+            if len(state) != len(self.buckets) + 2:
+                # De un worker con otros buckets (otra versión del código)
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(names, key + (_format_value(bound),))
+                yield f"{self.name}_bucket{labels} {_format_value(cumulative)}"
+            labels = _format_labels(names, key + ("+Inf",))
+            yield f"{self.name}_bucket{labels} {_format_value(state[-1])}"
+            labels = _format_labels(labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(state[-2])}"
+            yield f"{self.name}_count{labels} {_format_value(state[-1])}"
+
+
+class CallbackMetric(_Metric):
+    """Métrica cuyo valor se calcula al consultar /metrics. `callback`
+    devuelve pares (valores de las etiquetas, valor).
+
+    Con `per_process` el valor es del propio proceso (p. ej. los modelos que
+    tiene cargados) y los workers también lo envían; si no, es compartido
+    (p. ej. los trabajos en el broker) y solo lo muestra la API.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), type_name="gauge",
+                 callback: Callable[[], Iterable[Tuple[LabelValues, float]]] = None,
+                 per_process: bool = False):
+        super().__init__(name, documentation, labelnames)
+        self.type_name = type_name
+        self.callback = callback
+        self.per_process = per_process
+
+    def collect(self):
+        return {tuple(key): value for key, value in self.callback() if value is not None}
+
+    def format(self, values, labelnames):
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(labelnames, key)} {_format_value(value)}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"La métrica {metric.name} ya está registrada")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, labelnames=(), callback=None,
+                 type_name="gauge", per_process: bool = False) -> CallbackMetric:
+        return self.register(
+            CallbackMetric(name, documentation, labelnames, type_name, callback, per_process)
+        )
+
+    def snapshot(self) -> Dict[str, list]:
+        """Valores de las métricas propias del proceso, serializables en JSON,
+        para enviarlos desde un worker"""
+        result = {}
+        for metric in self._metrics.values():
+            if not metric.per_process:
+                continue
+            try:
+                result[metric.name] = [[list(key), value] for key, value in metric.collect().items()]
+            except Exception:
+                continue
+        return result
+
+    def render(self, workers: Optional[Dict[str, Dict[str, list]]] = None) -> str:
+        """Texto de /metrics. `workers` son los `snapshot()` de cada worker
+        (id -> métricas), que se añaden con la etiqueta `worker`"""
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+                for worker_id, metrics in (workers or {}).items():
+                    values = {
+                        tuple(key) + (worker_id,): value
+                        for key, value in metrics.get(metric.name, [])
+                    }
+                    samples.extend(metric.format(values, metric.labelnames + ("worker",)))
+            except Exception:
+                # Una métrica que falla no debe impedir ver las demás
+                continue
+            if samples:
+                lines.extend(metric.header())
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Etapas de los trabajos (las mismas que se publican por SSE) y tiempo en cola
+STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds", "Duración de cada etapa de los trabajos", ("kind", "stage")
+)
+JOBS_FINISHED = REGISTRY.counter(
+    "jobs_finished_total", "Trabajos terminados por tipo y estado final", ("kind", "status")
+)
+UPLOAD_BYTES = REGISTRY.histogram(
+    "upload_bytes", "Tamaño de los archivos subidos", ("endpoint",), BYTES_BUCKETS
+)
+UPLOAD_SECONDS = REGISTRY.histogram(
+    "upload_seconds", "Tiempo de recepción y guardado de los archivos subidos", ("endpoint",)
+)
+FFPROBE_SECONDS = REGISTRY.histogram("ffprobe_seconds", "Duración de las llamadas a ffprobe")
+DECODE_SECONDS = REGISTRY.histogram(
+    "ffmpeg_decode_seconds", "Decodificación del audio a PCM de 16 kHz", ("source",)
+)
+WHISPER_RTF = REGISTRY.histogram(
+    "whisper_real_time_factor", "Segundos de Whisper por segundo de audio", ("model",), RTF_BUCKETS
+)
+OUTPUT_WRITE_SECONDS = REGISTRY.histogram(
+    "transcript_write_seconds", "Escritura del archivo de transcripción", ("format",)
+)
+BURN_FPS = REGISTRY.histogram(
+    "burn_fps", "Frames por segundo al quemar subtítulos", ("encoder",), FPS_BUCKETS
+)
+MODEL_LOAD_SECONDS = REGISTRY.histogram(
+    "whisper_model_load_seconds", "Carga de los modelos de Whisper", ("model",)
+)
+ADMISSION_REJECTED = REGISTRY.counter(
+    "admission_rejected_total", "Trabajos rechazados con 429 por falta de capacidad",
+    ("pool", "reason")
+)
+
+
+class RequestStartMiddleware:
+    """Guarda en `request.state.started_at` cuándo empezó la petición, antes
+    de recibir el cuerpo, para medir cuánto tarda la subida"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope.setdefault("state", {})["started_at"] = time.perf_counter()
+        await self.app(scope, receive, send)
@@ -0,0 +1,144 @@
+"""Registro de modelos Whisper: carga bajo demanda y expulsión LRU"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+from backends import (
+    FasterWhisperBackend, InferenceBackend, create_backend, get_backend_class,
+    resolve_backend_options
+)
+from metrics import MODEL_LOAD_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Memoria aproximada (MB) de cada modelo cargado en CPU con fp32
+MODEL_MEMORY_MB = {
+    "tiny": 150,
+    "base": 300,
+    "small": 1000,
+    "medium": 2600,
+    "large": 5000,
+    "large-v2": 5000,
+    "large-v3": 5000,
+}
+
+# Con int8 (faster-whisper) los pesos ocupan aproximadamente un tercio
+INT8_MEMORY_FACTOR = 0.35
+
+
+class ModelRegistry:
+    """Mantiene como máximo `max_models` modelos en memoria sin superar
+    `memory_budget_mb`. Los modelos se cargan en el primer uso y se expulsa el
+    que lleva más tiempo sin usarse."""
+
+    def __init__(self, backend_name: str, allowed_models: Sequence[str],
+                 max_models: int = 2, memory_budget_mb: int = 0):
+        self.backend_name = backend_name
+        self.backend_options = resolve_backend_options(backend_name)
+        self.allowed_models = tuple(allowed_models)
+        self.max_models = max(1, max_models)
+        self.memory_budget_mb = memory_budget_mb
+        self._models: "OrderedDict[str, InferenceBackend]" = OrderedDict()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def is_allowed(self, model_name: str) -> bool:
+        return model_name in self.allowed_models
+
+    def cache_key(self, model_name: str) -> str:
+        """Clave de caché del modelo sin necesidad de cargarlo"""
+        backend_class = get_backend_class(self.backend_name)
+        return backend_class.make_cache_key(model_name, **self.backend_options)
+
+    def estimate_memory_mb(self, model_name: str) -> float:
+        base = model_name.split(".")[0]
+        memory = MODEL_MEMORY_MB.get(base, MODEL_MEMORY_MB["large"])
+        if (get_backend_class(self.backend_name) is FasterWhisperBackend
+                and "int8" in self.backend_options.get("compute_type", "")):
+            memory *= INT8_MEMORY_FACTOR
+        return memory
+
+    def is_loaded(self, model_name: str) -> bool:
+        with self._lock:
+            return model_name in self._models
+
+    def get(self, model_name: str) -> InferenceBackend:
+        """Devuelve el modelo, cargándolo si todavía no está en memoria"""
+        with self._lock:
+            backend = self._models.get(model_name)
+            if backend is not None:
+                self._models.move_to_end(model_name)
+                return backend
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+
+        # Solo un hilo carga cada modelo; el resto espera y lo reutiliza
+        with load_lock:
+            with self._lock:
+                backend = self._models.get(model_name)
+                if backend is not None:
+                    self._models.move_to_end(model_name)
+                    return backend
+
+            logger.info("Cargando modelo Whisper '%s' (%s)...", model_name, self.backend_name)
+            started = time.perf_counter()
+            backend = create_backend(self.backend_name, model_name, **self.backend_options)
+            elapsed = time.perf_counter() - started
+            MODEL_LOAD_SECONDS.observe(elapsed, model=model_name)
+            logger.info("Modelo '%s' cargado en %.1fs", model_name, elapsed)
+
+            with self._lock:
+                self._models[model_name] = backend
+                self.loads += 1
+                self._evict(keep=model_name)
+            return backend
+
+    def warm(self, model_name: str) -> threading.Thread:
+        """Carga un modelo en segundo plano"""
+        def load():
+            try:
+                self.get(model_name)
+            except Exception as e:
+                logger.error("No se pudo precargar el modelo '%s': %s", model_name, e)
+
+        thread = threading.Thread(target=load, name=f"warm-{model_name}", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            loaded = list(self._models)
+        return {
+            "backend": self.backend_name,
+            "loaded": loaded,
+            "max_models": self.max_models,
+            "memory_estimate_mb": round(sum(self.estimate_memory_mb(m) for m in loaded)),
+            "memory_budget_mb": self.memory_budget_mb or None,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self, keep: Optional[str] = None):
+        """Expulsa los modelos menos usados hasta cumplir los límites.
+
+        Un trabajo que ya tenga la referencia al modelo expulsado puede
+        terminar con él; la memoria se libera cuando deja de usarse.
+        """
+        def over_limits():
+            if len(self._models) > self.max_models:
+                return True
+            if self.memory_budget_mb:
+                used = sum(self.estimate_memory_mb(m) for m in self._models)
+                return used > self.memory_budget_mb
+            return False
+
+        while over_limits():
+            victim = next((m for m in self._models if m != keep), None)
+            if victim is None:
+                break
+            del self._models[victim]
+            self.evictions += 1
+            logger.info("Modelo '%s' expulsado de memoria", victim)
@@ -0,0 +1,22 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Los módulos del backend se importan como en main.py (`from jobs import ...`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def create_test_broker(kind, tmp_path):
+    """Broker en un SQLite temporal o, si está instalado fakeredis, en Redis"""
+    from broker import RedisBroker, SQLiteBroker
+
+    if kind == "sqlite":
+        return SQLiteBroker(tmp_path / "jobs.sqlite3", poll_seconds=0.05)
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisBroker(client=fakeredis.FakeRedis())
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def broker(request, tmp_path):
+    return create_test_broker(request.param, tmp_path)
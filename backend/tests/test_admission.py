@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from admission import POOL_AUDIO, POOL_RENDER, AdmissionController, JobCost, LocalReservations
+from conftest import create_test_broker
+from jobs import JOB_COMPLETED, JOB_RUNNING
+
+
+def controller(store, jobs, parallelism=lambda: 1):
+    return AdmissionController({POOL_AUDIO: 100, POOL_RENDER: 0}, 0.5, jobs.get, parallelism, store=store)
+
+
+@pytest.fixture(params=["local", "sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "local":
+        return LocalReservations()
+    return create_test_broker(request.param, tmp_path)
+
+
+def test_client_share_is_shared_between_instances(broker):
+    jobs = {}
+    def parallelism():
+        # Como en main.py, el Retry-After cuenta los workers vivos del broker
+        return broker.stats(30)["workers"]
+
+    first, second = controller(broker, jobs, parallelism), controller(broker, jobs, parallelism)
+
+    ticket = first.admit("a", JobCost(audio=40))
+    first.attach(ticket, "job-1")
+    jobs["job-1"] = {"status": JOB_RUNNING}
+
+    # La otra instancia ve la reserva: "a" ya ocupa casi toda su parte (50)
+    with pytest.raises(HTTPException) as error:
+        second.admit("a", JobCost(audio=20))
+    assert error.value.status_code == 429
+    assert int(error.value.headers["Retry-After"]) >= 1
+    assert second.admit("b", JobCost(audio=40)).client_id == "b"
+    # El pool (100) ya está casi lleno para todos
+    with pytest.raises(HTTPException):
+        first.admit("c", JobCost(audio=30))
+    assert second.stats()["pools"][POOL_AUDIO]["outstanding_seconds"] == 80
+
+    jobs["job-1"] = {"status": JOB_COMPLETED, "started_at": 10.0, "finished_at": 30.0}
+    assert second.admit("a", JobCost(audio=20)).client_id == "a"
+    stats = first.stats()
+    assert stats["jobs"] == 2
+    assert stats["pools"][POOL_AUDIO]["outstanding_seconds"] == 60
+
+
+def test_concurrent_admissions_respect_capacity(store):
+    admission = controller(store, {})
+    admitted, rejected = [], []
+    barrier = threading.Barrier(8)
+
+    def admit(client_id):
+        barrier.wait()
+        try:
+            admitted.append(admission.admit(client_id, JobCost(audio=30)))
+        except HTTPException:
+            rejected.append(client_id)
+
+    threads = [threading.Thread(target=admit, args=(f"client-{i}",)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # El primero entra con el pool vacío; después caben hasta 100 segundos
+    assert len(admitted) == 3
+    assert len(rejected) == 5
+
+
+def test_release_and_unattached_reservations(store, monkeypatch):
+    admission = controller(store, {})
+    ticket = admission.admit("a", JobCost(audio=40))
+    admission.release(ticket)
+    assert admission.stats()["jobs"] == 0
+
+    admission.admit("a", JobCost(audio=40))
+    # Una reserva que nunca se asoció a un trabajo caduca
+    monkeypatch.setattr("admission.UNATTACHED_TIMEOUT", -1)
+    assert admission.stats()["jobs"] == 0
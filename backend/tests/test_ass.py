@@ -0,0 +1,81 @@
+import multiprocessing
+import queue
+import threading
+from pathlib import Path
+
+import pytest
+
+import ass
+from ass import AssCache, SubtitleStyle, write_ass
+
+CUES = [(0.0, 1.5, "Hola"), (1.5, 3.0, "mundo")]
+
+
+@pytest.fixture
+def vtt_path(tmp_path):
+    path = tmp_path / "subs.vtt"
+    path.write_text("WEBVTT\n\n00:00:00.000 --> 00:00:01.500\nHola\n", encoding="utf-8")
+    return path
+
+
+def wait_after_writing(monkeypatch, barrier):
+    """Cada escritor espera al otro después de escribir su temporal y antes
+    de renombrarlo: los dos fallan la búsqueda y escriben la misma clave a la vez"""
+    def write_and_wait(cues, style, output_path):
+        write_ass(cues, style, output_path)
+        barrier.wait(timeout=10)
+    monkeypatch.setattr(ass, "write_ass", write_and_wait)
+
+
+def write_same_key(cache_dir, vtt_path, results):
+    cache = AssCache(cache_dir)
+    results.put(cache.get_or_create(str(vtt_path), SubtitleStyle(), lambda path: CUES))
+
+
+def check_single_valid_ass(cache_dir, paths, tmp_path):
+    expected = tmp_path / "expected.ass"
+    write_ass(CUES, SubtitleStyle(), str(expected))
+    assert len(set(paths)) == 1
+    # Ningún temporal a medias junto al ASS
+    assert list(cache_dir.iterdir()) == [Path(paths[0])]
+    assert Path(paths[0]).read_text(encoding="utf-8") == expected.read_text(encoding="utf-8")
+
+
+def test_two_threads_write_same_key(tmp_path, vtt_path, monkeypatch):
+    wait_after_writing(monkeypatch, threading.Barrier(2))
+    cache_dir = tmp_path / "ass"
+    results = queue.Queue()
+    threads = [
+        threading.Thread(target=write_same_key, args=(cache_dir, vtt_path, results))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    paths = [results.get_nowait() for _ in threads]
+    check_single_valid_ass(cache_dir, paths, tmp_path)
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(),
+                    reason="necesita procesos con fork")
+def test_two_processes_write_same_key(tmp_path, vtt_path, monkeypatch):
+    # Con fork los dos hijos tienen el mismo id de hilo principal: solo el
+    # pid distingue sus temporales
+    context = multiprocessing.get_context("fork")
+    wait_after_writing(monkeypatch, context.Barrier(2))
+    cache_dir = tmp_path / "ass"
+    results = context.Queue()
+    processes = [
+        context.Process(target=write_same_key, args=(cache_dir, vtt_path, results))
+        for _ in range(2)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=30)
+
+    assert [process.exitcode for process in processes] == [0, 0]
+    paths = [results.get(timeout=5) for _ in processes]
+    check_single_valid_ass(cache_dir, paths, tmp_path)
@@ -0,0 +1,221 @@
+import threading
+import time
+from functools import partial
+
+from broker import (
+    BrokeredJob, BrokerJobQueue, Worker, dumps_cleanup, dumps_task, finished_snapshot
+)
+from jobs import JOB_CANCELLED, JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, Job, remove_paths
+
+
+def double(job, value):
+    job.set_stage("doubling")
+    job.set_progress(0.5)
+    return {"value": value * 2}
+
+
+TASKS = {"double": double}
+
+
+def enqueue(broker, job_id, cleanup=None, client_id=None, cost=1.0, after=None):
+    snapshot = {**Job(id=job_id, kind="test").to_dict(), "last_event_id": 0}
+    broker.enqueue(job_id, "test", dumps_task(double, (1,), {}), snapshot, dumps_cleanup(cleanup),
+                   client_id=client_id, cost=cost, after=after)
+    return snapshot
+
+
+def finish(broker, snapshot, status=JOB_COMPLETED):
+    snapshot, event = finished_snapshot(snapshot, status)
+    assert broker.update(snapshot["job_id"], snapshot, [event])
+
+
+def temp_dir(tmp_path, name):
+    path = tmp_path / name
+    path.mkdir()
+    return path
+
+
+def event_ids(broker, job_id, since=0):
+    return [event["id"] for event in broker.events_since(job_id, since)]
+
+
+def test_enqueue_claim_update(broker):
+    snapshot = enqueue(broker, "a")
+    assert broker.snapshot("a")["status"] == JOB_QUEUED
+    assert broker.stats(30)["queued"] == 1
+
+    job_id, payload, claimed, _ = broker.claim("worker-1", timeout=1)
+    assert job_id == "a"
+    assert claimed["job_id"] == "a"
+    assert broker.claim("worker-1", timeout=0.1) is None
+    assert broker.stats(30)["running"] == 1
+
+    events = [{"id": 1, "type": "status", "status": JOB_RUNNING},
+              {"id": 2, "type": "stage", "stage": "doubling"}]
+    assert broker.update("a", {**snapshot, "status": JOB_RUNNING, "last_event_id": 2}, events)
+    assert broker.snapshot("a")["status"] == JOB_RUNNING
+    assert broker.events_since("a", 0) == events
+    assert event_ids(broker, "a", 1) == [2]
+    assert broker.events_since("a", 2) == []
+
+
+def test_merged_progress_is_replaced(broker):
+    snapshot = enqueue(broker, "a")
+    broker.claim("worker-1", timeout=1)
+    broker.update("a", snapshot, [{"id": 1, "type": "stage", "stage": "x"},
+                                  {"id": 2, "type": "progress", "progress": 0.1}])
+    broker.update("a", snapshot, [{"id": 3, "type": "progress", "progress": 0.2}], replaces=2)
+    assert event_ids(broker, "a") == [1, 3]
+    assert broker.events_since("a", 1)[0]["progress"] == 0.2
+
+
+def test_claim_shares_workers_between_clients(broker):
+    snapshots = {job_id: enqueue(broker, job_id, client_id=job_id[0]) for job_id in ("a1", "a2", "a3")}
+    snapshots.update({job_id: enqueue(broker, job_id, client_id="b", cost=2.0) for job_id in ("b1", "b2")})
+    assert broker.stats(30)["queued"] == 5
+
+    def claim():
+        return broker.claim("worker-1", timeout=1)[0]
+
+    # "b" llegó después pero no tiene nada en curso
+    assert [claim(), claim()] == ["a1", "b1"]
+    # "a" tiene menos coste en curso que "b"; con el mismo coste, el que
+    # lleva más tiempo sin empezar uno
+    assert [claim(), claim(), claim()] == ["a2", "b2", "a3"]
+    assert broker.stats(30)["queued"] == 0
+
+    for job_id in ("a1", "a2", "a3"):
+        finish(broker, snapshots[job_id])
+    enqueue(broker, "b3", client_id="b", cost=2.0)
+    enqueue(broker, "a4", client_id="a")
+    # Al terminar sus trabajos "a" deja de contar
+    assert [claim(), claim()] == ["a4", "b3"]
+
+
+def test_cancel_queued_job_leaves_client_queue(broker):
+    enqueue(broker, "a1", client_id="a")
+    enqueue(broker, "b1", client_id="b")
+    broker.request_cancel("a1")
+    assert broker.stats(30)["queued"] == 1
+    assert broker.claim("worker-1", timeout=1)[0] == "b1"
+    assert broker.claim("worker-1", timeout=0.1) is None
+
+
+def test_claim_waits_for_dependencies(broker):
+    first, second = enqueue(broker, "a"), enqueue(broker, "b")
+    enqueue(broker, "batch", after=["a", "b"])
+    assert broker.stats(30)["queued"] == 3
+    assert [broker.claim("worker-1", timeout=1)[0] for _ in range(2)] == ["a", "b"]
+    assert broker.claim("worker-1", timeout=0.1) is None
+
+    finish(broker, first)
+    assert broker.claim("worker-1", timeout=0.1) is None
+    # Cuenta cualquier final, también un fallo
+    finish(broker, second, JOB_FAILED)
+    assert broker.claim("worker-1", timeout=1)[0] == "batch"
+
+
+def test_cancel_job_waiting_for_dependencies(broker, tmp_path):
+    queue = BrokerJobQueue(broker)
+    path = temp_dir(tmp_path, "batch")
+    enqueue(broker, "a", client_id="x")
+    job = queue.submit("test", double, 1, cleanup=partial(remove_paths, str(path)),
+                       client_id="x", after=["a"])
+
+    assert queue.cancel(job.id).status == JOB_CANCELLED
+    assert not path.exists()
+    assert broker.stats(30)["queued"] == 1
+    # La cola del cliente sigue teniendo su otro trabajo
+    assert broker.claim("worker-1", timeout=1)[0] == "a"
+
+
+def test_brokered_job_matches_local_events(broker):
+    snapshot = enqueue(broker, "a")
+    broker.claim("worker-1", timeout=1)
+    job = BrokeredJob(id="a", kind="test", created_at=snapshot["created_at"], broker=broker)
+    job.mark_running()
+    job.set_stage("transcribing")
+    for step in range(50):
+        job.set_progress(step / 50)
+        job.publish("segment", text=str(step))
+        job.set_progress((step + 0.5) / 50)
+    job.flush()
+    assert broker.events_since("a", 0) == job.events
+
+
+def test_cancel_queued_job_runs_cleanup(broker, tmp_path):
+    queue = BrokerJobQueue(broker)
+    path = temp_dir(tmp_path, "queued")
+    job = queue.submit("test", double, 1, cleanup=partial(remove_paths, str(path)))
+
+    cancelled = queue.cancel(job.id)
+    assert cancelled.status == JOB_CANCELLED
+    assert not path.exists()
+    assert broker.events_since(job.id, 0)[-1]["status"] == JOB_CANCELLED
+    # Ya no lo reclama ningún worker
+    assert broker.claim("worker-1", timeout=0.1) is None
+    assert queue.cancel(job.id).status == JOB_CANCELLED
+
+
+def test_cancel_running_job_sets_flag(broker, tmp_path):
+    queue = BrokerJobQueue(broker)
+    path = temp_dir(tmp_path, "running")
+    job = queue.submit("test", double, 1, cleanup=partial(remove_paths, str(path)))
+    broker.claim("worker-1", timeout=1)
+
+    cancelled = queue.cancel(job.id)
+    assert cancelled.status != JOB_CANCELLED
+    assert cancelled.to_dict()["cancel_requested"]
+    assert broker.cancel_requested(job.id)
+    # La limpieza la hace el worker al terminar
+    assert path.exists()
+
+
+def test_fail_orphaned_runs_cleanup(broker, tmp_path):
+    path = temp_dir(tmp_path, "orphan")
+    snapshot = enqueue(broker, "a", cleanup=partial(remove_paths, str(path)))
+    broker.claim("dead-worker", timeout=1)
+    broker.update("a", {**snapshot, "status": JOB_RUNNING, "last_event_id": 1},
+                  [{"id": 1, "type": "progress", "progress": 0.1}])
+    broker.heartbeat("live-worker")
+
+    broker.fail_orphaned(worker_timeout=30)
+    assert broker.snapshot("a")["status"] == JOB_FAILED
+    assert not path.exists()
+    assert broker.claimed_cleanup("a") is None
+    assert broker.events_since("a", 0)[-1]["status"] == JOB_FAILED
+
+    # El worker que se daba por caído ya no puede cambiar el trabajo
+    assert not broker.update("a", {**snapshot, "status": JOB_RUNNING, "last_event_id": 2},
+                             [{"id": 2, "type": "progress", "progress": 0.2}], replaces=1)
+    assert broker.snapshot("a")["status"] == JOB_FAILED
+    events = broker.events_since("a", 0)
+    assert [event["id"] for event in events] == [1, 2]
+    assert events[-1]["status"] == JOB_FAILED
+
+
+def test_worker_runs_job(broker, tmp_path):
+    queue = BrokerJobQueue(broker)
+    path = temp_dir(tmp_path, "job")
+    job = queue.submit("test", double, 21, cleanup=partial(remove_paths, str(path)))
+
+    worker = Worker(broker, TASKS.__getitem__, threads=1, heartbeat_seconds=0.2)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    try:
+        deadline = time.monotonic() + 10
+        while queue.get(job.id).status not in (JOB_COMPLETED, JOB_FAILED):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        worker.stop()
+        thread.join(timeout=10)
+
+    finished = queue.get(job.id)
+    assert finished.status == JOB_COMPLETED
+    assert finished.result == {"value": 42}
+    assert not path.exists()
+    events = broker.events_since(job.id, 0)
+    assert [event["type"] for event in events] == ["status", "stage", "progress", "status"]
+    assert events[-1]["result"] == {"value": 42}
+    assert broker.stats(30)["workers"] == 0
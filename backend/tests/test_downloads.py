@@ -0,0 +1,163 @@
+import asyncio
+import os
+from email.utils import formatdate
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from downloads import ZEROCOPY_EXTENSION, RangeFileResponse, RangeNotSatisfiable, parse_range
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(CONTENT)
+    return path
+
+
+@pytest.fixture
+def client(path):
+    app = FastAPI()
+
+    @app.api_route("/download", methods=["GET", "HEAD"])
+    def download(request: Request):
+        return RangeFileResponse(str(path), request.headers, "vídeo final.mp4", "video/mp4", request.method)
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 10239)),
+    ("bytes=-100", (10140, 10239)),
+    ("bytes=-20000", (0, 10239)),
+    ("bytes=10000-20000", (10000, 10239)),
+    ("bytes=5-5", (5, 5)),
+    # Se ignoran: se responde con el archivo entero
+    ("bytes=0-9,20-29", None),
+    ("items=0-9", None),
+    ("bytes=9-0", None),
+    ("bytes=a-b", None),
+    ("bytes=10", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(CONTENT)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=10240-", "bytes=20000-20010", "bytes=-0"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range(header, len(CONTENT))
+
+
+def test_full_download(client, path):
+    response = client.get("/download")
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["content-length"] == str(len(CONTENT))
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["content-type"] == "video/mp4"
+    assert response.headers["content-disposition"] == "attachment; filename*=utf-8''v%C3%ADdeo%20final.mp4"
+    assert response.headers["last-modified"] == formatdate(os.stat(path).st_mtime, usegmt=True)
+    assert "content-range" not in response.headers
+
+
+def test_head_has_no_body(client):
+    response = client.head("/download")
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["content-length"] == str(len(CONTENT))
+
+
+@pytest.mark.parametrize("header, start, end", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=10000-", 10000, 10239),
+    ("bytes=-240", 10000, 10239),
+])
+def test_partial_download(client, header, start, end):
+    response = client.get("/download", headers={"Range": header})
+    assert response.status_code == 206
+    assert response.content == CONTENT[start:end + 1]
+    assert response.headers["content-range"] == f"bytes {start}-{end}/{len(CONTENT)}"
+    assert response.headers["content-length"] == str(end - start + 1)
+
+
+def test_range_larger_than_chunk(client, monkeypatch):
+    monkeypatch.setattr(RangeFileResponse, "chunk_size", 1000)
+    response = client.get("/download", headers={"Range": "bytes=123-4567"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[123:4568]
+
+
+def test_unsatisfiable_range(client):
+    response = client.get("/download", headers={"Range": "bytes=20000-"})
+    assert response.status_code == 416
+    assert response.content == b""
+    assert response.headers["content-range"] == f"bytes */{len(CONTENT)}"
+    assert response.headers["content-length"] == "0"
+
+
+def test_multiple_ranges_send_whole_file(client):
+    response = client.get("/download", headers={"Range": "bytes=0-9,20-29"})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_not_modified(client):
+    headers = client.get("/download").headers
+    for validators in ({"If-None-Match": headers["etag"]},
+                       {"If-None-Match": f'"otro", W/{headers["etag"]}'},
+                       {"If-None-Match": "*"},
+                       {"If-Modified-Since": headers["last-modified"]}):
+        response = client.get("/download", headers=validators)
+        assert response.status_code == 304, validators
+        assert response.content == b""
+        assert "content-length" not in response.headers
+        assert response.headers["etag"] == headers["etag"]
+
+    # Con If-None-Match se ignora If-Modified-Since
+    response = client.get("/download", headers={
+        "If-None-Match": '"otro"', "If-Modified-Since": headers["last-modified"]
+    })
+    assert response.status_code == 200
+
+
+def test_modified_since_older_date(client):
+    response = client.get("/download", headers={"If-Modified-Since": formatdate(0, usegmt=True)})
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+
+def test_if_range(client, path):
+    headers = client.get("/download").headers
+    for validator in (headers["etag"], headers["last-modified"]):
+        response = client.get("/download", headers={"Range": "bytes=0-9", "If-Range": validator})
+        assert response.status_code == 206
+        assert response.content == CONTENT[:10]
+
+    # El archivo cambió desde la primera parte: se envía entero
+    path.write_bytes(CONTENT[::-1])
+    os.utime(path, ns=(0, 10 ** 9))
+    response = client.get("/download", headers={"Range": "bytes=0-9", "If-Range": headers["etag"]})
+    assert response.status_code == 200
+    assert response.content == CONTENT[::-1]
+    assert "content-range" not in response.headers
+
+
+def test_zerocopy_extension(path):
+    response = RangeFileResponse(str(path), {"range": "bytes=100-199"}, "video.mp4", "video/mp4")
+    messages = []
+
+    async def send(message):
+        if message["type"] == ZEROCOPY_EXTENSION:
+            message = {**message, "file": message["file"].name}
+        messages.append(message)
+
+    scope = {"type": "http", "extensions": {ZEROCOPY_EXTENSION: {}}}
+    asyncio.run(response(scope, None, send))
+    assert messages[0]["status"] == 206
+    assert messages[1] == {"type": ZEROCOPY_EXTENSION, "file": str(path), "offset": 100,
+                           "count": 100, "more_body": False}
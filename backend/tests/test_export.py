@@ -0,0 +1,106 @@
+import json
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import captions
+import export
+from captions import CueLimits, format_timestamp, format_timestamps, iter_vtt_chunks, parse_vtt
+from export import EXPORT_FORMATS, format_srt_timestamp, iter_clean_text, iter_srt, iter_vtt
+
+FIXTURES = Path(__file__).parent / "fixtures" / "export"
+
+
+def load_segments():
+    return json.loads((FIXTURES / "segments.json").read_text(encoding="utf-8"))
+
+
+def render(name, segments, limits=CueLimits()):
+    return "".join(EXPORT_FORMATS[name].render(segments, limits, {}))
+
+
+@pytest.mark.parametrize("name", ["vtt", "srt", "txt"])
+def test_golden(name):
+    expected = (FIXTURES / f"transcript.{name}").read_text(encoding="utf-8")
+    assert render(name, load_segments()) == expected
+
+
+@pytest.mark.parametrize("seconds, expected", [
+    (0, "00:00:00.000"),
+    (0.0004, "00:00:00.000"),
+    (59.9995, "00:01:00.000"),
+    (2099.9995, "00:35:00.000"),
+    (2099.9994, "00:34:59.999"),
+    (3599.9996, "01:00:00.000"),
+    (3725.25, "01:02:05.250"),
+    (36000, "10:00:00.000"),
+    (-0.5, "00:00:00.000"),
+])
+def test_timestamp_boundaries(seconds, expected):
+    assert format_timestamp(seconds) == expected
+    assert format_timestamps(np.array([seconds])) == [expected]
+    assert format_srt_timestamp(seconds) == expected.replace(".", ",")
+
+
+def test_blank_segments_have_no_cues():
+    segments = [{"start": 0.0, "end": 1.0, "text": "  "}, {"start": 1.0, "end": 2.0, "text": ""},
+                {"start": 2.0, "end": 3.0, "text": " ", "words": [{"word": " ", "start": 2.0, "end": 3.0}]}]
+    for limits in (CueLimits(), CueLimits(max_chars=20)):
+        assert "".join(iter_vtt(segments, limits)) == "WEBVTT\n\n"
+        assert "".join(iter_srt(segments, limits)) == ""
+    assert "".join(iter_clean_text(segments)) == ""
+
+
+def test_empty_transcription():
+    assert render("vtt", []) == "WEBVTT\n\n"
+    assert render("srt", []) == ""
+    assert render("txt", []) == ""
+
+
+def test_cues_are_numbered_across_batches(monkeypatch):
+    # Cada cuarto segmento está vacío: hay lotes sin ningún subtítulo
+    segments = [{"start": i, "end": i + 1, "text": f" Frase {i}." if i % 4 else " "} for i in range(20)]
+    expected = render("vtt", segments)
+    numbers = [int(line) for line in expected.splitlines() if line.isdigit()]
+    assert numbers == list(range(1, 16))
+    for batch_size in (1, 3):
+        monkeypatch.setattr(export, "iter_cue_batches", partial(captions.iter_cue_batches, batch_size=batch_size))
+        assert render("vtt", segments) == expected
+
+
+@pytest.fixture
+def long_vtt(tmp_path):
+    segments = [
+        {"start": i * 2.5, "end": i * 2.5 + 2.0, "text": f" Subtítulo {i} con acentos: ñandú."}
+        for i in range(300)
+    ]
+    path = tmp_path / "long.vtt"
+    path.write_text(render("vtt", segments), encoding="utf-8")
+    return path
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 50, 97, 4096])
+def test_vtt_chunks_round_trip(long_vtt, chunk_size, monkeypatch):
+    text = long_vtt.read_text(encoding="utf-8")
+    chunks = list(iter_vtt_chunks(str(long_vtt), chunk_size=chunk_size))
+    assert "".join(chunks) == text
+    # Ningún subtítulo queda partido entre dos trozos
+    assert all(chunk.endswith("\n\n") for chunk in chunks)
+
+    expected = parse_vtt(str(long_vtt))
+    assert len(expected) == 300
+    assert expected[299] == (747.5, 749.5, "Subtítulo 299 con acentos: ñandú.")
+    monkeypatch.setattr(captions, "iter_vtt_chunks", partial(iter_vtt_chunks, chunk_size=chunk_size))
+    assert parse_vtt(str(long_vtt)) == expected
+
+
+def test_vtt_chunks_without_trailing_blank_line(tmp_path):
+    path = tmp_path / "bom.vtt"
+    path.write_text("﻿WEBVTT\n\n1\n00:00:00.000 --> 00:00:01.000\nHola\n\n"
+                    "2\n00:00:01.000 --> 00:00:02.000\nAdiós", encoding="utf-8")
+    chunks = list(iter_vtt_chunks(str(path), chunk_size=10))
+    assert chunks[0].startswith("WEBVTT")
+    assert chunks[-1] == "2\n00:00:01.000 --> 00:00:02.000\nAdiós"
+    assert parse_vtt(str(path)) == [(0.0, 1.0, "Hola"), (1.0, 2.0, "Adiós")]
@@ -0,0 +1,75 @@
+import threading
+import time
+from functools import partial
+
+import pytest
+
+from jobs import JOB_CANCELLED, JOB_COMPLETED, JOB_FAILED, JOB_QUEUED, JobQueue, remove_paths
+
+
+@pytest.fixture
+def queue():
+    queue = JobQueue(max_workers=2)
+    yield queue
+    queue.shutdown()
+
+
+def wait_finished(queue, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while queue.get(job_id).status not in (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return queue.get(job_id)
+
+
+def wait_for(job, event):
+    assert event.wait(10)
+    return job.id
+
+
+def fail(job):
+    raise RuntimeError("roto")
+
+
+def test_job_waits_for_dependencies(queue):
+    release = threading.Event()
+    first = queue.submit("test", wait_for, release)
+    second = queue.submit("test", fail)
+    wait_finished(queue, second.id)
+
+    collected = []
+    batch = queue.submit("test", lambda job: collected.append(job.id) or "ok",
+                         after=[first.id, second.id])
+    # Un worker sigue libre, pero el lote espera a que terminen los dos
+    time.sleep(0.2)
+    assert queue.get(batch.id).status == JOB_QUEUED
+    assert queue.stats()["queued"] == 1
+
+    release.set()
+    assert wait_finished(queue, batch.id).result == "ok"
+    assert wait_finished(queue, first.id).status == JOB_COMPLETED
+    assert collected == [batch.id]
+
+
+def test_finished_dependencies_do_not_block(queue):
+    job = queue.submit("test", lambda job: "ok")
+    wait_finished(queue, job.id)
+    assert wait_finished(queue, queue.submit("test", lambda job: "ok", after=[job.id, "gone"]).id).result == "ok"
+
+
+def test_cancel_job_waiting_for_dependencies(queue, tmp_path):
+    release = threading.Event()
+    first = queue.submit("test", wait_for, release)
+    path = tmp_path / "batch"
+    path.mkdir()
+    batch = queue.submit("test", lambda job: "ok", cleanup=partial(remove_paths, str(path)),
+                         after=[first.id])
+
+    assert queue.cancel(batch.id).status == JOB_CANCELLED
+    deadline = time.monotonic() + 10
+    while path.exists():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    release.set()
+    assert wait_finished(queue, first.id).status == JOB_COMPLETED
+    assert queue.get(batch.id).status == JOB_CANCELLED
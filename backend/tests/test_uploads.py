@@ -0,0 +1,163 @@
+import hashlib
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from uploads import UploadStore
+
+CONTENT = os.urandom(300_000)
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+def open_store(tmp_path):
+    return UploadStore(tmp_path / "uploads", tmp_path / "uploads.sqlite3", ttl=3600)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return open_store(tmp_path)
+
+
+def append(store, upload_id, offset, data):
+    writer = store.open_append(upload_id, offset)
+    try:
+        writer.write(data)
+    finally:
+        upload = writer.close()
+    return upload
+
+
+def blobs(store):
+    return sorted(path.name for path in (store.root / "blobs").iterdir())
+
+
+def test_resume_at_offset(store):
+    upload = store.create("audio.wav", len(CONTENT), "audio/wav")
+    assert append(store, upload.id, 0, CONTENT[:100_000]).offset == 100_000
+    assert store.get(upload.id).offset == 100_000
+    assert not store.get(upload.id).complete
+
+    upload = append(store, upload.id, 100_000, CONTENT[100_000:])
+    assert upload.complete
+    assert upload.to_dict()["sha256"] == DIGEST
+    assert store.blob_path(DIGEST).read_bytes() == CONTENT
+    assert not store.partial_path(upload.id).exists()
+
+
+def test_interrupted_block_keeps_received_bytes(store):
+    upload = store.create("audio.wav", len(CONTENT), "audio/wav")
+    writer = store.open_append(upload.id, 0)
+    writer.write(CONTENT[:50_000])
+    # El cliente se desconecta a mitad del bloque
+    assert writer.close().offset == 50_000
+    assert append(store, upload.id, 50_000, CONTENT[50_000:]).complete
+
+
+@pytest.mark.parametrize("offset", [0, 50_000, 200_000])
+def test_wrong_offset_conflicts(store, offset):
+    upload = store.create("audio.wav", len(CONTENT), "audio/wav")
+    append(store, upload.id, 0, CONTENT[:100_000])
+    with pytest.raises(HTTPException) as error:
+        store.open_append(upload.id, offset)
+    assert error.value.status_code == 409
+    assert "100000" in error.value.detail
+    # Lo recibido sigue intacto
+    assert append(store, upload.id, 100_000, CONTENT[100_000:]).blob == DIGEST
+
+
+def test_concurrent_block_conflicts(store):
+    upload = store.create("audio.wav", len(CONTENT), "audio/wav")
+    writer = store.open_append(upload.id, 0)
+    with pytest.raises(HTTPException) as error:
+        store.open_append(upload.id, 0)
+    assert error.value.status_code == 409
+    writer.write(CONTENT)
+    assert writer.close().complete
+    with pytest.raises(HTTPException) as error:
+        store.open_append(upload.id, len(CONTENT))
+    assert error.value.status_code == 409
+
+
+def test_block_larger_than_declared_size(store):
+    upload = store.create("audio.wav", 10, "audio/wav")
+    writer = store.open_append(upload.id, 0)
+    with pytest.raises(HTTPException) as error:
+        writer.write(b"x" * 11)
+    assert error.value.status_code == 413
+    assert writer.close().offset == 0
+
+
+def test_dedup_only_after_bytes_are_received(store, tmp_path):
+    first = store.create("a.wav", len(CONTENT), "audio/wav", sha256=DIGEST)
+    append(store, first.id, 0, CONTENT)
+
+    # Conocer el hash no da acceso al contenido ya guardado
+    second = store.create("b.wav", len(CONTENT), "audio/wav", sha256=DIGEST.upper())
+    assert not second.complete
+    assert second.offset == 0
+    with pytest.raises(HTTPException) as error:
+        store.materialize(second.id, tmp_path / "input.wav")
+    assert error.value.status_code == 409
+    assert not (tmp_path / "input.wav").exists()
+
+    assert append(store, second.id, 0, CONTENT).blob == DIGEST
+    assert store.deduplicated == 1
+    assert blobs(store) == [DIGEST]
+    assert not store.partial_path(second.id).exists()
+    assert store.stats()["complete"] == 2
+
+
+def test_wrong_hash_restarts_upload(store):
+    upload = store.create("a.wav", len(CONTENT), "audio/wav", sha256=DIGEST)
+    corrupt = bytes([CONTENT[0] ^ 1]) + CONTENT[1:]
+    with pytest.raises(HTTPException) as error:
+        append(store, upload.id, 0, corrupt)
+    assert error.value.status_code == 422
+    assert store.get(upload.id).offset == 0
+    assert blobs(store) == []
+    assert append(store, upload.id, 0, CONTENT).blob == DIGEST
+
+
+def test_rehash_after_restart(tmp_path):
+    store = open_store(tmp_path)
+    upload = store.create("audio.wav", len(CONTENT), "audio/wav", sha256=DIGEST)
+    append(store, upload.id, 0, CONTENT[:123_457])
+
+    # Otro proceso (o la API reiniciada) no tiene el estado del hash en memoria
+    restarted = open_store(tmp_path)
+    assert restarted.get(upload.id).offset == 123_457
+    upload = append(restarted, upload.id, 123_457, CONTENT[123_457:])
+    assert upload.blob == DIGEST
+    assert restarted.blob_path(DIGEST).read_bytes() == CONTENT
+
+
+def test_materialize_links_blob(store, tmp_path):
+    upload = store.create("audio.wav", len(CONTENT), "audio/wav")
+    append(store, upload.id, 0, CONTENT)
+    old = time.time() - 86400
+    os.utime(store.blob_path(DIGEST), (old, old))
+
+    destination = tmp_path / "input.wav"
+    assert store.materialize(upload.id, destination) == DIGEST
+    assert destination.read_bytes() == CONTENT
+    # La entrada del trabajo no parece un temporal antiguo
+    assert destination.stat().st_mtime > old + 3600
+
+
+def test_sweep_keeps_shared_blobs(store):
+    first = store.create("a.wav", len(CONTENT), "audio/wav")
+    second = store.create("b.wav", len(CONTENT), "audio/wav")
+    append(store, first.id, 0, CONTENT)
+    append(store, second.id, 0, CONTENT)
+
+    store.delete(first.id)
+    assert store.sweep()["blobs_removed"] == 0
+    assert blobs(store) == [DIGEST]
+    store.delete(second.id)
+    assert store.sweep()["blobs_removed"] == 1
+    assert blobs(store) == []
+    with pytest.raises(HTTPException) as error:
+        store.get(second.id)
+    assert error.value.status_code == 404
@@ -0,0 +1,145 @@
+"""Caché persistente (SQLite) de resultados de Whisper indexada por contenido del audio"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+def _json_default(value):
+    # Whisper puede devolver escalares de NumPy en algunos campos
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class TranscriptCache:
+    """Guarda los segmentos de Whisper por (hash del audio, idioma, modelo).
+
+    Una petición repetida, o la misma con otro formato de salida, reutiliza los
+    segmentos guardados y se salta Whisper por completo. Cuando el tamaño total
+    supera `max_bytes` se eliminan las entradas usadas hace más tiempo (LRU).
+    """
+
+    def __init__(self, db_path: Path, max_bytes: int):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transcriptions (
+                cache_key TEXT PRIMARY KEY,
+                audio_hash TEXT NOT NULL,
+                language TEXT NOT NULL,
+                model TEXT NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transcriptions_last_access "
+            "ON transcriptions (last_access)"
+        )
+        self._conn.commit()
+        self._total_bytes = self._stored_bytes()
+
+    @staticmethod
+    def make_key(audio_hash: str, language: str, model_name: str) -> str:
+        return f"{audio_hash}:{language}:{model_name}"
+
+    def get(self, audio_hash: str, language: str, model_name: str) -> Optional[dict]:
+        """Devuelve el resultado guardado o None si no está en caché"""
+        key = self.make_key(audio_hash, language, model_name)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM transcriptions WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE transcriptions SET last_access = ? WHERE cache_key = ?",
+                (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, audio_hash: str, language: str, model_name: str, result: dict):
+        """Guarda el texto y los segmentos de una transcripción"""
+        key = self.make_key(audio_hash, language, model_name)
+        payload = json.dumps(
+            {
+                "text": result.get("text", ""),
+                "segments": result.get("segments", []),
+                "language": result.get("language"),
+            },
+            ensure_ascii=False,
+            default=_json_default,
+        )
+        size = len(payload.encode("utf-8"))
+        if size > self.max_bytes:
+            # Un resultado más grande que toda la caché no se guarda
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO transcriptions
+                    (cache_key, audio_hash, language, model, result, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (key, audio_hash, language, model_name, payload, size, now, now)
+            )
+            self._total_bytes = self._stored_bytes()
+            self._evict()
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM transcriptions")
+            self._conn.commit()
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM transcriptions").fetchone()[0]
+            self._total_bytes = self._stored_bytes()
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def _stored_bytes(self) -> int:
+        # Se lee del índice en vez de acumularlo en memoria: varios procesos
+        # (workers) pueden escribir en la misma caché
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM transcriptions"
+        ).fetchone()[0]
+
+    def _evict(self):
+        """Elimina las entradas menos usadas hasta volver al límite de tamaño"""
+        while self._total_bytes > self.max_bytes:
+            row = self._conn.execute(
+                "SELECT cache_key, size FROM transcriptions ORDER BY last_access ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                self._total_bytes = 0
+                break
+            self._conn.execute("DELETE FROM transcriptions WHERE cache_key = ?", (row[0],))
+            self._total_bytes -= row[1]
@@ -0,0 +1,360 @@
+"""Subidas reanudables por bloques con deduplicación por contenido.
+
+El cliente crea la subida (`POST /uploads`), envía el archivo en uno o
+varios `PATCH` indicando en `Upload-Offset` desde qué byte empieza cada
+bloque y, si la conexión se corta, pregunta el offset guardado (`HEAD`) y
+continúa desde ahí. El SHA-256 se calcula mientras llegan los datos.
+
+Al completarse, el archivo se guarda como blob con su hash como nombre: el
+mismo contenido subido dos veces se almacena una sola vez. El hash que el
+cliente puede indicar al crear la subida solo sirve para comprobar que el
+archivo llegó entero: conocer el hash de un archivo no da acceso a él, así
+que siempre hay que enviar los bytes.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class Upload:
+    id: str
+    filename: str
+    content_type: str
+    size: int
+    offset: int
+    sha256: Optional[str]
+    blob: Optional[str]
+    expires_at: float
+
+    @property
+    def complete(self) -> bool:
+        return self.blob is not None
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "size": self.size,
+            "offset": self.offset,
+            "complete": self.complete,
+            "sha256": self.blob,
+            "expires_at": self.expires_at,
+        }
+
+
+class UploadWriter:
+    """Escribe un bloque de una subida a partir de su offset actual.
+
+    `close()` guarda el offset alcanzado aunque el cliente se haya
+    desconectado a mitad, para poder reanudar desde ahí.
+    """
+
+    def __init__(self, store: "UploadStore", upload: Upload, hasher):
+        self.store = store
+        self.upload = upload
+        self.hasher = hasher
+        self.offset = upload.offset
+        self._file = open(store.partial_path(upload.id), "r+b" if upload.offset else "wb")
+        self._file.seek(upload.offset)
+        self._file.truncate()
+
+    def write(self, data: bytes):
+        if self.offset + len(data) > self.upload.size:
+            raise HTTPException(status_code=413, detail="El bloque supera el tamaño declarado de la subida")
+        self._file.write(data)
+        self.hasher.update(data)
+        self.offset += len(data)
+
+    def close(self) -> Upload:
+        self._file.close()
+        return self.store._finish_append(self)
+
+
+class UploadStore:
+    """Subidas en curso (`root/partial`) y blobs completos (`root/blobs`)
+    indexados en SQLite.
+
+    Las subidas caducan a los `ttl` segundos de crearse; `sweep()` borra las
+    caducadas y los blobs que ya no usa ninguna subida.
+    """
+
+    def __init__(self, root: Path, db_path: Path, ttl: float, max_size: int = 0):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.deduplicated = 0
+        (self.root / "partial").mkdir(parents=True, exist_ok=True)
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Estado del SHA-256 de las subidas a medias: id -> (offset, hasher)
+        self._hashers: Dict[str, Tuple[int, object]] = {}
+        # Subidas con un PATCH en curso
+        self._writing = set()
+        db_path = Path(db_path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                sha256 TEXT,
+                blob TEXT,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_blob ON uploads (blob)")
+        self._conn.commit()
+
+    def partial_path(self, upload_id: str) -> Path:
+        return self.root / "partial" / upload_id
+
+    def blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest
+
+    def create(self, filename: str, size: int, content_type: str,
+               sha256: Optional[str] = None) -> Upload:
+        """Crea una subida. Si se indica `sha256`, al completarse se comprueba
+        que el contenido recibido tiene ese hash"""
+        if size < 0:
+            raise HTTPException(status_code=400, detail="El tamaño no puede ser negativo")
+        if self.max_size and size > self.max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"El archivo supera el máximo de {self.max_size // (1024 * 1024)} MB"
+            )
+        if sha256 is not None:
+            sha256 = sha256.lower()
+            if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+                raise HTTPException(status_code=400, detail="sha256 debe ser un hash hexadecimal de 64 caracteres")
+        now = time.time()
+        upload = Upload(uuid.uuid4().hex, filename, content_type, size, 0, sha256, None, now + self.ttl)
+        with self._lock:
+            if size == 0:
+                upload.blob = self._store_blob(upload.id, hashlib.sha256())
+            self._conn.execute(
+                """
+                INSERT INTO uploads (id, filename, content_type, size, offset, sha256, blob,
+                                     created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (upload.id, filename, content_type, size, upload.offset, sha256, upload.blob,
+                 now, upload.expires_at)
+            )
+            self._conn.commit()
+        return upload
+
+    def get(self, upload_id: str) -> Upload:
+        """Estado de una subida; HTTPException 404 si no existe o caducó"""
+        with self._lock:
+            return self._get(upload_id)
+
+    def open_append(self, upload_id: str, offset: int) -> UploadWriter:
+        """Prepara la escritura de un bloque que empieza en `offset`.
+
+        Responde 409 si el offset no es el guardado (el cliente debe
+        consultarlo y continuar desde ahí) o si ya hay otro bloque en curso.
+        """
+        with self._lock:
+            upload = self._get(upload_id)
+            if upload.complete:
+                raise HTTPException(status_code=409, detail="La subida ya está completa")
+            if offset != upload.offset:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Upload-Offset no coincide: la subida va por el byte {upload.offset}"
+                )
+            if upload_id in self._writing:
+                raise HTTPException(status_code=409, detail="Ya hay un bloque en curso para esta subida")
+            self._writing.add(upload_id)
+            hasher_offset, hasher = self._hashers.pop(upload_id, (None, None))
+        try:
+            if hasher_offset != offset:
+                # Tras un reinicio el estado del hash se reconstruye leyendo
+                # lo que ya se había recibido
+                hasher = self._rehash(upload_id, offset)
+            return UploadWriter(self, upload, hasher)
+        except BaseException:
+            with self._lock:
+                self._writing.discard(upload_id)
+            raise
+
+    def materialize(self, upload_id: str, destination: Path) -> str:
+        """Deja el contenido de una subida completa en `destination` (enlace
+        duro al blob, sin copiar, si están en el mismo disco) y devuelve su
+        SHA-256"""
+        with self._lock:
+            upload = self._get(upload_id)
+            if not upload.complete:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"La subida no está completa ({upload.offset} de {upload.size} bytes)"
+                )
+            blob = self.blob_path(upload.blob)
+            try:
+                os.link(blob, destination)
+            except FileNotFoundError:
+                raise HTTPException(status_code=410, detail="El archivo de la subida ya no está disponible")
+            except OSError:
+                shutil.copyfile(blob, destination)
+        # El enlace conserva la fecha del blob, que puede ser antigua; sin
+        # actualizarla la limpieza de TEMP_DIR tomaría la entrada del trabajo
+        # por un temporal huérfano y la borraría con el trabajo en cola
+        os.utime(destination)
+        return upload.blob
+
+    def delete(self, upload_id: str):
+        with self._lock:
+            self._get(upload_id)
+            self._delete(upload_id)
+            self._conn.commit()
+
+    def sweep(self) -> dict:
+        """Elimina las subidas caducadas y los blobs sin subidas que los usen"""
+        now = time.time()
+        with self._lock:
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT id FROM uploads WHERE expires_at <= ?", (now,)
+            ) if row[0] not in self._writing]
+            for upload_id in expired:
+                self._delete(upload_id)
+            self._conn.commit()
+            referenced = {row[0] for row in self._conn.execute(
+                "SELECT DISTINCT blob FROM uploads WHERE blob IS NOT NULL"
+            )}
+            pending = {row[0] for row in self._conn.execute("SELECT id FROM uploads")}
+            orphaned = 0
+            for path in (self.root / "blobs").iterdir():
+                if path.name not in referenced:
+                    try:
+                        path.unlink()
+                        orphaned += 1
+                    except OSError:
+                        pass
+            for path in (self.root / "partial").iterdir():
+                if path.name not in pending:
+                    try:
+                        path.unlink()
+                    except OSError:
+                        pass
+        if expired or orphaned:
+            logger.info("Limpieza de subidas: %s caducadas, %s blobs eliminados", len(expired), orphaned)
+        return {"expired": len(expired), "blobs_removed": orphaned}
+
+    def stats(self):
+        with self._lock:
+            pending, complete = self._conn.execute(
+                "SELECT COALESCE(SUM(blob IS NULL), 0), COALESCE(SUM(blob IS NOT NULL), 0) FROM uploads"
+            ).fetchone()
+            blob_sizes = [path.stat().st_size for path in (self.root / "blobs").iterdir()]
+        return {
+            "pending": pending,
+            "complete": complete,
+            "blobs": len(blob_sizes),
+            "blob_bytes": sum(blob_sizes),
+            "deduplicated": self.deduplicated,
+        }
+
+    def _get(self, upload_id: str) -> Upload:
+        row = self._conn.execute(
+            "SELECT id, filename, content_type, size, offset, sha256, blob, expires_at "
+            "FROM uploads WHERE id = ?", (upload_id,)
+        ).fetchone()
+        if row is None or row[7] <= time.time():
+            raise HTTPException(status_code=404, detail="Subida no encontrada o caducada")
+        return Upload(*row)
+
+    def _delete(self, upload_id: str):
+        """Borra la subida y su parte recibida (con el lock tomado). El blob
+        se conserva hasta la limpieza por si otra subida lo usa"""
+        self._conn.execute("DELETE FROM uploads WHERE id = ?", (upload_id,))
+        self._hashers.pop(upload_id, None)
+        try:
+            self.partial_path(upload_id).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _rehash(self, upload_id: str, offset: int):
+        hasher = hashlib.sha256()
+        if offset == 0:
+            return hasher
+        with open(self.partial_path(upload_id), "rb") as f:
+            remaining = offset
+            while remaining > 0:
+                chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise HTTPException(status_code=500, detail="Faltan datos de la subida en disco")
+                hasher.update(chunk)
+                remaining -= len(chunk)
+        return hasher
+
+    def _store_blob(self, upload_id: str, hasher) -> str:
+        """Mueve la parte recibida a su blob o la descarta si ese contenido ya
+        estaba guardado (con el lock tomado)"""
+        digest = hasher.hexdigest()
+        partial = self.partial_path(upload_id)
+        if self.blob_path(digest).exists():
+            if partial.exists():
+                partial.unlink()
+            self.deduplicated += 1
+            logger.info("Subida %s deduplicada: el contenido ya estaba guardado", upload_id)
+        elif partial.exists():
+            os.replace(partial, self.blob_path(digest))
+        else:
+            self.blob_path(digest).touch()
+        return digest
+
+    def _finish_append(self, writer: UploadWriter) -> Upload:
+        upload = writer.upload
+        with self._lock:
+            self._writing.discard(upload.id)
+            try:
+                current = self._get(upload.id)
+            except HTTPException:
+                # Se eliminó (o caducó) mientras llegaba el bloque
+                self._delete(upload.id)
+                self._conn.commit()
+                raise
+            current.offset = writer.offset
+            if writer.offset == upload.size:
+                digest = writer.hasher.hexdigest()
+                if upload.sha256 is not None and digest != upload.sha256:
+                    # Contenido corrupto: se descarta y el cliente vuelve a empezar
+                    self.partial_path(upload.id).unlink()
+                    self._conn.execute("UPDATE uploads SET offset = 0 WHERE id = ?", (upload.id,))
+                    self._conn.commit()
+                    raise HTTPException(
+                        status_code=422,
+                        detail="El contenido recibido no coincide con el sha256 indicado; la subida se reinicia"
+                    )
+                current.blob = self._store_blob(upload.id, writer.hasher)
+            else:
+                self._hashers[upload.id] = (writer.offset, writer.hasher)
+            self._conn.execute(
+                "UPDATE uploads SET offset = ?, blob = ? WHERE id = ?",
+                (current.offset, current.blob, upload.id)
+            )
+            self._conn.commit()
+        return current
@@ -0,0 +1,127 @@
+"""Detección de voz (VAD) por energía con NumPy para saltarse silencios antes de Whisper"""
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+from media import SAMPLE_RATE
+
+# Duración de cada ventana de análisis
+FRAME_SECONDS = 0.03
+
+
+@dataclass(frozen=True)
+class SpeechTimeline:
+    """Relaciona el audio recortado (solo voz) con la línea de tiempo original"""
+    # Regiones de voz en muestras del audio original
+    regions: Tuple[Tuple[int, int], ...]
+    total_samples: int
+
+    @property
+    def speech_seconds(self) -> float:
+        return sum(end - start for start, end in self.regions) / SAMPLE_RATE
+
+    @property
+    def skipped_seconds(self) -> float:
+        return self.total_samples / SAMPLE_RATE - self.speech_seconds
+
+    def to_original(self, seconds: float, is_start: bool = False) -> float:
+        """Convierte un tiempo del audio recortado al tiempo del audio original.
+
+        Un instante justo en la unión de dos regiones se asigna al final de la
+        primera, salvo que sea el inicio de un segmento (`is_start`), que se
+        asigna al comienzo de la siguiente.
+        """
+        position = seconds * SAMPLE_RATE
+        consumed = 0
+        for start, end in self.regions:
+            length = end - start
+            if position < consumed + length or (not is_start and position == consumed + length):
+                return (start + position - consumed) / SAMPLE_RATE
+            consumed += length
+        if self.regions:
+            return self.regions[-1][1] / SAMPLE_RATE
+        return seconds
+
+
+def detect_speech(audio: np.ndarray, threshold_db: float = 12.0, floor_db: float = -50.0,
+                  min_speech: float = 0.25, min_silence: float = 0.6,
+                  padding: float = 0.2) -> List[Tuple[int, int]]:
+    """Devuelve las regiones con voz como pares (inicio, fin) en muestras.
+
+    Una ventana se considera voz si su energía supera en `threshold_db` el
+    ruido de fondo estimado (percentil 10) y además el umbral absoluto
+    `floor_db` (dBFS). Los silencios más cortos que `min_silence` no cortan
+    una región y las regiones más cortas que `min_speech` se descartan.
+    """
+    frame = int(FRAME_SECONDS * SAMPLE_RATE)
+    frames = len(audio) // frame
+    if frames == 0:
+        return []
+
+    framed = audio[:frames * frame].reshape(frames, frame)
+    rms = np.sqrt(np.mean(framed * framed, axis=1))
+    energy_db = 20 * np.log10(np.maximum(rms, 1e-10))
+
+    noise_floor = np.percentile(energy_db, 10)
+    threshold = max(noise_floor + threshold_db, floor_db)
+    is_speech = energy_db > threshold
+
+    # Bordes de las rachas de ventanas con voz
+    edges = np.diff(np.concatenate(([0], is_speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    # Unir regiones separadas por silencios cortos
+    max_gap = int(min_silence / FRAME_SECONDS)
+    merged = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    min_frames = int(min_speech / FRAME_SECONDS)
+    pad = int(padding * SAMPLE_RATE)
+    regions = []
+    for start, end in merged:
+        if end - start < min_frames:
+            continue
+        region_start = max(0, start * frame - pad)
+        region_end = min(len(audio), end * frame + pad)
+        if regions and region_start <= regions[-1][1]:
+            regions[-1] = (regions[-1][0], region_end)
+        else:
+            regions.append((region_start, region_end))
+    return regions
+
+
+def extract_speech(audio: np.ndarray, **options) -> Tuple[np.ndarray, SpeechTimeline]:
+    """Concatena solo las regiones con voz y devuelve la línea de tiempo para
+    volver a situar los segmentos en el audio original"""
+    regions = detect_speech(audio, **options)
+    timeline = SpeechTimeline(regions=tuple(regions), total_samples=len(audio))
+    if not regions:
+        return np.zeros(0, dtype=np.float32), timeline
+    speech = np.concatenate([audio[start:end] for start, end in regions])
+    return speech, timeline
+
+
+def remap_segments(transcription: dict, timeline: SpeechTimeline) -> dict:
+    """Traslada los tiempos de los segmentos (y palabras) a la línea original"""
+    segments = []
+    for segment in transcription.get('segments', []):
+        mapped = dict(segment)
+        mapped['start'] = round(timeline.to_original(segment['start'], is_start=True), 3)
+        mapped['end'] = round(timeline.to_original(segment['end']), 3)
+        if segment.get('words'):
+            mapped['words'] = [
+                dict(
+                    word,
+                    start=round(timeline.to_original(word['start'], is_start=True), 3),
+                    end=round(timeline.to_original(word['end']), 3),
+                )
+                for word in segment['words']
+            ]
+        segments.append(mapped)
+    return dict(transcription, segments=segments)
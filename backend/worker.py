@@ -0,0 +1,63 @@
+"""Worker de trabajos para el modo con broker (`BROKER_URL`).
+
+La API solo encola los trabajos; cada proceso worker carga su propio modelo
+de Whisper y ejecuta hasta TRANSCRIPTION_WORKERS trabajos a la vez. Para
+ganar capacidad se añaden procesos (`--processes`) o máquinas con el mismo
+BROKER_URL y el mismo almacenamiento compartido (TEMP_DIR, CACHE_DIR y
+UPLOAD_DIR). Usa la misma configuración por variables de entorno que main.py.
+
+Uso (desde el directorio backend):
+    BROKER_URL=sqlite:///cache/jobs.sqlite3 python worker.py --processes 2
+"""
+import argparse
+import multiprocessing
+import signal
+import sys
+
+
+def run_worker(threads: int = None):
+    import main
+    from broker import Worker
+
+    if not main.BROKER_URL:
+        sys.exit("worker.py necesita BROKER_URL (la misma que usa la API)")
+    if main.WARM_DEFAULT_MODEL:
+        main.model_registry.warm(main.WHISPER_MODEL_NAME)
+
+    # Las métricas del worker (etapas, Whisper, quemado, modelos cargados)
+    # viajan con cada señal de vida y las muestra el /metrics de la API
+    worker = Worker(
+        main.job_queue.broker, lambda name: getattr(main, name), threads or main.MAX_WORKERS,
+        worker_timeout=main.job_queue.worker_timeout, metrics=main.REGISTRY.snapshot
+    )
+    # Ctrl+C o SIGTERM: no se reclaman más trabajos y se terminan los que están en curso
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.run()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Worker de transcripción y subtitulado")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Procesos worker (cada uno con su modelo cargado)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="Trabajos a la vez por proceso (por defecto TRANSCRIPTION_WORKERS)")
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        run_worker(args.threads)
+        return
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker, args=(args.threads,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    # Ctrl+C llega a cada hijo, que termina sus trabajos en curso; SIGTERM
+    # (p. ej. al parar el servicio) se reenvía a los hijos
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    cli()
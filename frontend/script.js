@@ -1,12 +1,16 @@
 // Configuración de la API
 const API_BASE_URL = 'http://127.0.0.1:8000';
 
+// Intervalo de consulta del estado de los trabajos en segundo plano
+const JOB_POLL_INTERVAL_MS = 2000;
+
 // Referencias a elementos del DOM (se inicializarán cuando el DOM esté listo)
 let elements = {};
 
 // Variables globales
 let selectedFile = null;
 let downloadUrl = null;
+let exportUrl = null;
 let selectedSubtitleVideo = null;
 let selectedVttFile = null;
 let subtitledVideoDownloadUrl = null;
@@ -23,7 +27,10 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // Transcription elements
         languageSelect: document.getElementById('language'),
+        modelSelect: document.getElementById('model'),
         cleanTranscription: document.getElementById('cleanTranscription'),
+        vadEnabled: document.getElementById('vadEnabled'),
+        wordTimestamps: document.getElementById('wordTimestamps'),
         uploadArea: document.getElementById('uploadArea'),
         videoFile: document.getElementById('videoFile'),
         fileInfo: document.getElementById('fileInfo'),
@@ -37,10 +44,15 @@ document.addEventListener('DOMContentLoaded', function() {
         errorSection: document.getElementById('errorSection'),
         progressFill: document.getElementById('progressFill'),
         progressText: document.getElementById('progressText'),
+        partialTranscript: document.getElementById('partialTranscript'),
         resultDuration: document.getElementById('resultDuration'),
         resultLanguage: document.getElementById('resultLanguage'),
         resultSegments: document.getElementById('resultSegments'),
+        resultSkippedItem: document.getElementById('resultSkippedItem'),
+        resultSkipped: document.getElementById('resultSkipped'),
         downloadBtn: document.getElementById('downloadBtn'),
+        exportFormat: document.getElementById('exportFormat'),
+        exportBtn: document.getElementById('exportBtn'),
         newTranscriptionBtn: document.getElementById('newTranscriptionBtn'),
         errorMessage: document.getElementById('errorMessage'),
         retryBtn: document.getElementById('retryBtn'),
@@ -65,6 +77,8 @@ document.addEventListener('DOMContentLoaded', function() {
         opacityValue: document.getElementById('opacityValue'),
         boxEnabled: document.getElementById('boxEnabled'),
         boxColor: document.getElementById('boxColor'),
+        subtitleMode: document.getElementById('subtitleMode'),
+        encoderProfile: document.getElementById('encoderProfile'),
         generateSubtitlesBtn: document.getElementById('generateSubtitlesBtn'),
         subtitlingProgressSection: document.getElementById('subtitlingProgressSection'),
         subtitlingResultsSection: document.getElementById('subtitlingResultsSection'),
@@ -113,6 +127,7 @@ function initializeEventListeners() {
     elements.removeFile.addEventListener('click', removeSelectedFile);
     elements.transcribeBtn.addEventListener('click', startTranscription);
     elements.downloadBtn.addEventListener('click', downloadTranscriptionFile);
+    elements.exportBtn.addEventListener('click', exportTranscription);
     elements.newTranscriptionBtn.addEventListener('click', resetApplication);
     elements.retryBtn.addEventListener('click', resetToUpload);
 
@@ -310,6 +325,9 @@ async function startTranscription() {
     console.log('DEBUG - Tipo de transcripción enviado:', transcriptionType);
     
     formData.append('transcription_type', transcriptionType);
+    formData.append('vad', elements.vadEnabled.checked);
+    formData.append('word_timestamps', elements.wordTimestamps.checked);
+    formData.append('model', elements.modelSelect.value);
     
     // Verificar FormData antes de enviar
     console.log('DEBUG - Verificando FormData antes de enviar...');
@@ -318,40 +336,54 @@ async function startTranscription() {
     }
 
     try {
-        // Simular progreso
         updateProgress(0, 'Iniciando transcripción...');
         updateStep(1, 'active');
+        elements.partialTranscript.textContent = '';
+        elements.partialTranscript.style.display = 'none';
 
-        // Realizar petición
-        const response = await fetch(`${API_BASE_URL}/transcribe`, {
-            method: 'POST',
-            body: formData
+        // Realizar petición informando del avance de la subida
+        const response = await postFormWithProgress(`${API_BASE_URL}/transcribe`, formData, (fraction) => {
+            updateProgress(fraction * 25, `Subiendo archivo... ${Math.round(fraction * 100)}%`);
         });
 
-        updateProgress(25, 'Subiendo archivo...');
-        updateStep(1, 'completed');
-        updateStep(2, 'active');
-
         if (!response.ok) {
-            const errorData = await response.json();
-            throw new Error(errorData.detail || 'Error en la transcripción');
+            throw new Error(response.data.detail || 'Error en la transcripción');
         }
 
-        updateProgress(50, 'Procesando video...');
-        updateStep(2, 'completed');
-        updateStep(3, 'active');
-
-        const result = await response.json();
-
-        const progressText = elements.cleanTranscription.checked ? 'Generando transcripción...' : 'Generando archivo VTT...';
-        updateProgress(75, progressText);
-        updateStep(3, 'completed');
-        updateStep(4, 'active');
+        updateStep(1, 'completed');
+        updateStep(2, 'active');
 
-        // Simular tiempo de procesamiento final
-        await new Promise(resolve => setTimeout(resolve, 1000));
+        // El backend encola el trabajo y responde con su identificador
+        const job = response.data;
+        console.log('DEBUG - Trabajo encolado:', job.job_id);
+        updateProgress(25, 'En cola, esperando un worker libre...');
+
+        const result = await followJob(job.job_id, (event) => {
+            if (event.type === 'segment') {
+                // Transcripción parcial mientras Whisper avanza
+                updateStep(2, 'completed');
+                updateStep(3, 'active');
+                updateProgress(40 + event.progress * 55, `Transcribiendo... ${Math.round(event.progress * 100)}%`);
+                appendPartialTranscript(event.text);
+            } else if (event.stage === 'extracting_audio') {
+                const percent = event.progress ? Math.round(event.progress * 100) : 0;
+                updateProgress(25 + (event.progress || 0) * 15, `Extrayendo audio... ${percent}%`);
+            } else if (event.stage === 'transcribing' && event.type !== 'progress') {
+                updateStep(2, 'completed');
+                updateStep(3, 'active');
+                updateProgress(40, 'Transcribiendo con Whisper...');
+            } else if (event.stage === 'writing_output') {
+                updateStep(2, 'completed');
+                updateStep(3, 'completed');
+                updateStep(4, 'active');
+                const progressText = elements.cleanTranscription.checked ? 'Generando transcripción...' : 'Generando archivo VTT...';
+                updateProgress(95, progressText);
+            }
+        });
 
         updateProgress(100, 'Transcripción completada');
+        updateStep(2, 'completed');
+        updateStep(3, 'completed');
         updateStep(4, 'completed');
 
         // Mostrar resultados
@@ -363,6 +395,105 @@ async function startTranscription() {
     }
 }
 
+// Envía un formulario con XMLHttpRequest para poder mostrar el avance de la subida
+function postFormWithProgress(url, formData, onUploadProgress) {
+    return new Promise((resolve, reject) => {
+        const xhr = new XMLHttpRequest();
+        xhr.open('POST', url);
+        xhr.responseType = 'json';
+        xhr.upload.onprogress = (event) => {
+            if (event.lengthComputable && onUploadProgress) {
+                onUploadProgress(event.loaded / event.total);
+            }
+        };
+        xhr.onload = () => resolve({
+            ok: xhr.status >= 200 && xhr.status < 300,
+            status: xhr.status,
+            data: xhr.response || {}
+        });
+        xhr.onerror = () => reject(new Error('No se puede conectar con el servidor'));
+        xhr.send(formData);
+    });
+}
+
+// Sigue el progreso de un trabajo por Server-Sent Events. Cada evento
+// (snapshot, stage, progress, segment) se pasa a onEvent. Si el navegador no
+// soporta EventSource o la conexión se cierra, se vuelve a la consulta periódica
+function followJob(jobId, onEvent) {
+    const pollJob = () => waitForJob(jobId, (status) => onEvent({ type: 'snapshot', ...status }));
+    if (!window.EventSource) {
+        return pollJob();
+    }
+
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`${API_BASE_URL}/jobs/${jobId}/events`);
+
+        ['snapshot', 'stage', 'progress', 'segment'].forEach((type) => {
+            source.addEventListener(type, (message) => {
+                onEvent({ type, ...JSON.parse(message.data) });
+            });
+        });
+
+        source.addEventListener('status', (message) => {
+            const data = JSON.parse(message.data);
+            if (data.status === 'completed') {
+                source.close();
+                resolve(data.result);
+            } else if (data.status === 'failed') {
+                source.close();
+                reject(new Error(data.error || 'Error en el trabajo'));
+            } else if (data.status === 'cancelled') {
+                source.close();
+                reject(new Error('El trabajo fue cancelado'));
+            }
+        });
+
+        // EventSource reintenta solo tras cortes de red; si queda cerrado se consulta el estado
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) {
+                pollJob().then(resolve, reject);
+            }
+        };
+    });
+}
+
+function appendPartialTranscript(text) {
+    if (!text) {
+        return;
+    }
+    elements.partialTranscript.style.display = 'block';
+    elements.partialTranscript.textContent += (elements.partialTranscript.textContent ? ' ' : '') + text;
+    elements.partialTranscript.scrollTop = elements.partialTranscript.scrollHeight;
+}
+
+// Consulta periódicamente el estado de un trabajo hasta que termine
+async function waitForJob(jobId, onUpdate) {
+    while (true) {
+        const response = await fetch(`${API_BASE_URL}/jobs/${jobId}`);
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.detail || 'Error consultando el estado del trabajo');
+        }
+
+        const status = await response.json();
+        if (onUpdate) {
+            onUpdate(status);
+        }
+
+        if (status.status === 'completed') {
+            return status.result;
+        }
+        if (status.status === 'failed') {
+            throw new Error(status.error || 'Error en la transcripción');
+        }
+        if (status.status === 'cancelled') {
+            throw new Error('La transcripción fue cancelada');
+        }
+
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+}
+
 function updateProgress(percentage, text) {
     elements.progressFill.style.width = `${percentage}%`;
     elements.progressText.textContent = text;
@@ -389,6 +520,14 @@ function showResults(result) {
     elements.resultLanguage.textContent = getLanguageDisplay(result.language);
     elements.resultSegments.textContent = `${result.original_segments_count} segmentos`;
 
+    // Mostrar cuánto audio omitió el VAD (si se usó)
+    if (result.vad) {
+        elements.resultSkipped.textContent = `${result.vad.skipped_seconds} segundos`;
+        elements.resultSkippedItem.style.display = 'flex';
+    } else {
+        elements.resultSkippedItem.style.display = 'none';
+    }
+
     // Actualizar texto del botón de descarga según el tipo del resultado (no del checkbox)
     const isClean = result.transcription_type === 'clean';
     console.log('DEBUG - Es transcripción limpia según resultado:', isClean);
@@ -396,6 +535,9 @@ function showResults(result) {
 
     // Guardar URL de descarga
     downloadUrl = `${API_BASE_URL}${result.download_url}`;
+
+    // Otros formatos se generan desde los segmentos guardados, sin transcribir de nuevo
+    exportUrl = result.export_url ? `${API_BASE_URL}${result.export_url}` : null;
 }
 
 function showError(message) {
@@ -434,6 +576,19 @@ function downloadTranscriptionFile() {
     }
 }
 
+function exportTranscription() {
+    if (exportUrl) {
+        const format = elements.exportFormat.value;
+        const link = document.createElement('a');
+        link.href = `${exportUrl}?format=${format}`;
+        link.download = `transcription_${Date.now()}.${format}`;
+
+        document.body.appendChild(link);
+        link.click();
+        document.body.removeChild(link);
+    }
+}
+
 function resetApplication() {
     // Limpiar archivo seleccionado
     removeSelectedFile();
@@ -446,6 +601,7 @@ function resetApplication() {
     
     // Limpiar variables
     downloadUrl = null;
+    exportUrl = null;
     
     // Resetear pasos de progreso
     for (let i = 1; i <= 4; i++) {
@@ -652,41 +808,43 @@ async function startSubtitling() {
     formData.append('background_opacity', elements.backgroundOpacity.value);
     formData.append('box_enabled', elements.boxEnabled.checked);
     formData.append('box_color', elements.boxColor.value);
+    formData.append('mode', elements.subtitleMode.value);
+    formData.append('profile', elements.encoderProfile.value);
 
     try {
         // Update progress
         updateSubtitlingProgress(0, 'Iniciando proceso...');
         updateSubtitlingStep(1, 'active');
 
-        // Make request
-        const response = await fetch(`${API_BASE_URL}/subtitle`, {
-            method: 'POST',
-            body: formData
+        // Make request (showing upload progress)
+        const response = await postFormWithProgress(`${API_BASE_URL}/subtitle`, formData, (fraction) => {
+            updateSubtitlingProgress(fraction * 25, `Subiendo archivos... ${Math.round(fraction * 100)}%`);
         });
 
-        updateSubtitlingProgress(25, 'Subiendo archivos...');
-        updateSubtitlingStep(1, 'completed');
-        updateSubtitlingStep(2, 'active');
-
         if (!response.ok) {
-            const errorData = await response.json();
-            throw new Error(errorData.detail || 'Error en el subtitulado');
+            throw new Error(response.data.detail || 'Error en el subtitulado');
         }
 
-        updateSubtitlingProgress(50, 'Procesando video...');
-        updateSubtitlingStep(2, 'completed');
-        updateSubtitlingStep(3, 'active');
-
-        const result = await response.json();
-
-        updateSubtitlingProgress(75, 'Añadiendo subtítulos...');
-        updateSubtitlingStep(3, 'completed');
-        updateSubtitlingStep(4, 'active');
+        updateSubtitlingProgress(25, 'En cola, esperando un worker libre...');
+        updateSubtitlingStep(1, 'completed');
+        updateSubtitlingStep(2, 'active');
 
-        // Simulate final processing time
-        await new Promise(resolve => setTimeout(resolve, 2000));
+        // The backend queues the job; follow its progress
+        const result = await followJob(response.data.job_id, (event) => {
+            if (event.stage === 'probing') {
+                updateSubtitlingProgress(25, 'Procesando video...');
+            } else if (event.stage === 'burning_subtitles' || event.stage === 'muxing_subtitles') {
+                updateSubtitlingStep(2, 'completed');
+                updateSubtitlingStep(3, 'active');
+                const fraction = event.progress || 0;
+                const frameText = event.frame ? ` (frame ${event.frame})` : '';
+                updateSubtitlingProgress(25 + fraction * 70, `Añadiendo subtítulos... ${Math.round(fraction * 100)}%${frameText}`);
+            }
+        });
 
         updateSubtitlingProgress(100, 'Video subtitulado completado');
+        updateSubtitlingStep(2, 'completed');
+        updateSubtitlingStep(3, 'completed');
         updateSubtitlingStep(4, 'completed');
 
         // Show results
@@ -759,6 +917,8 @@ function resetSubtitling() {
     elements.backgroundOpacity.value = '0.8';
     elements.boxEnabled.checked = false;
     elements.boxColor.value = '#000000';
+    elements.subtitleMode.value = 'burn';
+    elements.encoderProfile.value = 'fast';
     updateOpacityValue();
     
     // Hide all sections